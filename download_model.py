@@ -2,57 +2,99 @@
 """
 下载 Z-Image 模型
 
+并发分块下载、断点续传、逐文件校验（见 worker/zimage_worker/download.py），
+下载到普通目录，之后用 --model 指向该目录即可。
+
 使用方法:
     python download_model.py
+    python download_model.py --endpoint https://hf-mirror.com --no-load
+    python download_model.py --output D:/models/Z-Image-Turbo --workers 16
 """
+import argparse
+import logging
 import os
 import sys
+from pathlib import Path
 
 if sys.platform == "win32":
     os.system("chcp 65001 >nul 2>&1")
     if hasattr(sys.stdout, 'reconfigure'):
         sys.stdout.reconfigure(encoding='utf-8', errors='replace')
 
-# 禁用符号链接警告
-os.environ["HF_HUB_DISABLE_SYMLINKS_WARNING"] = "1"
-
-print("=" * 50)
-print("  Z-Image 模型下载器")
-print("=" * 50)
-print()
-print("模型: Tongyi-MAI/Z-Image-Turbo")
-print("大小: 约 25GB")
-print("来源: HuggingFace")
-print()
-print("下载中，请耐心等待...")
-print("(如果下载慢，可设置镜像: set HF_ENDPOINT=https://hf-mirror.com)")
-print()
-
-import torch
-from diffusers import ZImagePipeline
-
-try:
-    pipe = ZImagePipeline.from_pretrained(
-        "Tongyi-MAI/Z-Image-Turbo",
-        torch_dtype=torch.bfloat16,
-        low_cpu_mem_usage=True,
+sys.path.insert(0, str(Path(__file__).resolve().parent / "worker"))
+
+from zimage_worker.download import CHUNK, Downloader, DownloadError
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Z-Image 模型下载器")
+    parser.add_argument("--repo", default="Tongyi-MAI/Z-Image-Turbo", help="模型仓库")
+    parser.add_argument("--output", default="models/Z-Image-Turbo", help="下载目录 (默认: models/Z-Image-Turbo)")
+    parser.add_argument("--revision", default="main")
+    parser.add_argument(
+        "--endpoint",
+        default=None,
+        help="下载源，如镜像 https://hf-mirror.com (默认读 HF_ENDPOINT，否则 HuggingFace)"
     )
-    
+    parser.add_argument("--workers", type=int, default=8, help="并发连接数 (默认: 8)")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK // 2 ** 20, help="分块大小 MB，0 为整文件单连接")
+    parser.add_argument("--verify", action="store_true", help="重新校验已下载的文件")
+    parser.add_argument("--no-load", action="store_true", help="下载校验后不试加载模型（省去约 25GB 内存读入）")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    # 下载器的摘要和重试警告走 logging
+    logging.basicConfig(level=logging.INFO, format="   %(message)s")
+
+    print("=" * 50)
+    print("  Z-Image 模型下载器")
+    print("=" * 50)
+    print()
+    print(f"模型: {args.repo}")
+    print("大小: 约 25GB")
+    print(f"目录: {Path(args.output).absolute()}")
+    print("中断后重新运行即可续传")
+    print()
+
+    try:
+        result = Downloader(
+            args.repo, args.output, args.revision, args.endpoint, workers=args.workers,
+            chunk_size=args.chunk_size * 2 ** 20 or 2 ** 62, verify_existing=args.verify,
+        ).download()
+    except (DownloadError, OSError) as e:
+        print(f"\n❌ 下载失败: {e}")
+        print()
+        print("常见问题:")
+        print("1. 检查网络连接，重新运行会从断点继续")
+        print("2. 尝试镜像: --endpoint https://hf-mirror.com")
+        print("3. 服务器不支持分块下载时加 --chunk-size 0")
+        sys.exit(1)
+    except KeyboardInterrupt:
+        print("\n已中断，重新运行即可续传")
+        sys.exit(130)
+
+    speed = result["speed"] / 2 ** 20
+    print(f"   {result['files']} 个文件已校验（{result['skipped']} 个此前已下载），"
+          f"本次 {result['bytes'] / 2 ** 30:.2f}GB，用时 {result['seconds']:.0f}s，平均 {speed:.1f}MB/s")
+
+    if not args.no_load:
+        print("\n正在试加载模型（可用 --no-load 跳过）...")
+        import torch
+        from diffusers import ZImagePipeline
+        ZImagePipeline.from_pretrained(args.output, torch_dtype=torch.bfloat16, low_cpu_mem_usage=True)
+
     print()
     print("=" * 50)
     print("  ✅ 下载完成！")
     print("=" * 50)
     print()
     print("现在可以运行:")
-    print("  python generate.py --prompt \"你的提示词\"")
-    print()
-    
-except Exception as e:
-    print(f"\n❌ 下载失败: {e}")
+    print(f"  python generate.py --model {args.output} --prompt \"你的提示词\"")
+    print(f"  或在 .env 中设置 MODEL_ID={Path(args.output).absolute()}")
     print()
-    print("常见问题:")
-    print("1. 确保已开启 Windows 开发者模式")
-    print("2. 检查网络连接")
-    print("3. 尝试设置镜像: set HF_ENDPOINT=https://hf-mirror.com")
-    import traceback
-    traceback.print_exc()
+
+
+if __name__ == "__main__":
+    main()
@@ -19,9 +19,17 @@ if sys.platform == "win32":
     sys.stderr.reconfigure(encoding='utf-8', errors='replace')
 
 import torch
-from diffusers import ZImagePipeline
 from pathlib import Path
 
+# Worker 运行时中的模型加载等模块与本脚本共用
+sys.path.insert(0, str(Path(__file__).resolve().parent / "worker"))
+
+from zimage_worker import encoding, memory
+from zimage_worker.compile_cache import CompileCache, compile_pipeline
+from zimage_worker.pipelines import load_zimage, model_fingerprint
+from zimage_worker.snapshot import format_timings
+from zimage_worker.step_cache import StepCache
+
 
 def parse_args():
     parser = argparse.ArgumentParser(description="Z-Image 图像生成")
@@ -35,7 +43,20 @@ def parse_args():
         "--output", "-o",
         type=str,
         default="output.png",
-        help="输出图像路径 (默认: output.png)"
+        help="输出图像路径，格式按扩展名（.png / .webp / .jpg / .avif）(默认: output.png)"
+    )
+    parser.add_argument(
+        "--format",
+        type=str,
+        default=None,
+        choices=["png", "webp", "jpeg", "avif"],
+        help="输出格式，默认按 --output 扩展名；webp 为无损"
+    )
+    parser.add_argument(
+        "--compress-level",
+        type=int,
+        default=None,
+        help="PNG 压缩级别 0~9 (默认: 3，PIL 默认 6 明显更慢而几乎不变小) / WebP method 0~6"
     )
     parser.add_argument(
         "--width", "-W",
@@ -79,10 +100,48 @@ def parse_args():
         action="store_true",
         help="启用 CPU 卸载以节省显存（适合显存不足时使用）"
     )
+    parser.add_argument(
+        "--snapshot",
+        type=str,
+        default=None,
+        help="预构建快照目录，加载更快（不存在时从 --model 构建一次，见 worker/zimage_worker/snapshot.py）"
+    )
+    parser.add_argument(
+        "--quantize",
+        type=str,
+        default="none",
+        choices=["none", "int8", "fp8"],
+        help="transformer / text encoder 权重量化，显存减半，可不开 CPU 卸载（量化结果缓存到 --quantize-cache）"
+    )
+    parser.add_argument(
+        "--quantize-cache",
+        type=str,
+        default=None,
+        help="量化缓存目录 (默认: ~/.cache/zimage/quantized)"
+    )
+    parser.add_argument(
+        "--cache-threshold",
+        type=float,
+        default=0.0,
+        help="去噪步间缓存阈值，相邻步变化小于阈值时复用 transformer block 输出，越大越快、偏差越大；0 为关闭 (建议 0.05~0.2)"
+    )
+    parser.add_argument(
+        "--memory-mode",
+        type=str,
+        default="auto",
+        choices=["auto", "low", "off"],
+        help="显存规划：auto 按可用显存和尺寸自动启用 VAE 分块解码 / attention 分块，low 总是启用 (默认: auto)"
+    )
     parser.add_argument(
         "--compile",
         action="store_true",
-        help="编译模型以加速推理（首次运行会较慢）"
+        help="编译模型以加速推理（首次运行某尺寸会较慢，编译结果缓存到 --compile-cache）"
+    )
+    parser.add_argument(
+        "--compile-cache",
+        type=str,
+        default=None,
+        help="编译缓存目录 (默认: ~/.cache/zimage/compile)"
     )
     parser.add_argument(
         "--flash-attention",
@@ -98,19 +157,16 @@ def main():
     print(f"🚀 正在加载 Z-Image 模型: {args.model}")
     print(f"   设备: {args.device}")
     
-    # 加载模型
-    pipe = ZImagePipeline.from_pretrained(
-        args.model,
-        torch_dtype=torch.bfloat16 if args.device == "cuda" else torch.float32,
-        low_cpu_mem_usage=True,
-    )
-    
-    # 设备配置
+    # 加载模型并放到设备上
     if args.cpu_offload:
         print("   启用 CPU 卸载模式")
-        pipe.enable_model_cpu_offload()
-    else:
-        pipe.to(args.device)
+    if args.quantize != "none":
+        print(f"   权重量化: {args.quantize}")
+    pipe, timings = load_zimage(
+        args.model, args.device, args.cpu_offload, args.snapshot or "",
+        args.quantize, args.quantize_cache or "",
+    )
+    print(f"   加载耗时: {format_timings(timings)}")
     
     # 可选：Flash Attention
     if args.flash_attention:
@@ -120,10 +176,21 @@ def main():
         except Exception as e:
             print(f"   ⚠️ 无法启用 Flash Attention: {e}")
     
-    # 可选：模型编译
+    # 可选：去噪步间缓存（需在编译之前包装 block）
+    step_cache = StepCache.attach(pipe.transformer, args.cache_threshold)
+    
+    # 可选：模型编译（产物缓存到磁盘，同一模型 / 尺寸再次运行直接命中）
+    compile_cache = None
     if args.compile:
-        print("   正在编译模型（首次运行会较慢）...")
-        pipe.transformer.compile()
+        compile_cache = CompileCache(
+            args.compile_cache,
+            model_fingerprint(args.model, args.snapshot or "", args.quantize),
+            "bfloat16" if args.device == "cuda" else "float32",
+            args.device,
+        )
+        cached = (args.width, args.height) in compile_cache.warm_sizes()
+        print(f"   编译缓存: {compile_cache.dir} ({'命中' if cached else '未命中，首次编译会较慢'})")
+        compile_pipeline(pipe, compile_cache)
     
     # 设置随机种子
     generator = None
@@ -136,20 +203,46 @@ def main():
     print(f"🔄 推理步数: {args.steps}")
     print("\n⏳ 正在生成图像...")
     
+    # 按可用显存和尺寸决定是否分块解码 / 分块 attention
+    plan = memory.plan(
+        args.width, args.height, args.device, args.memory_mode,
+        memory.attention_heads(pipe.transformer), 2 if args.device == "cuda" else 4,
+    )
+    memory.apply(pipe, plan)
+    if plan.vae_tiling or plan.attention_chunk:
+        print(f"   显存规划: VAE 分块 {'开' if plan.vae_tiling else '关'}, attention 分块 {plan.attention_chunk or '关'}")
+    
     # 生成图像
-    image = pipe(
-        prompt=args.prompt,
-        height=args.height,
-        width=args.width,
-        num_inference_steps=args.steps,
-        guidance_scale=0.0,  # Turbo 模型无需引导
-        generator=generator,
-    ).images[0]
+    with memory.track(args.device) as usage, memory.chunked_attention(pipe.transformer, plan.attention_chunk):
+        image = pipe(
+            prompt=args.prompt,
+            height=args.height,
+            width=args.width,
+            num_inference_steps=args.steps,
+            guidance_scale=0.0,  # Turbo 模型无需引导
+            generator=generator,
+        ).images[0]
+    if "peak_mb" in usage:
+        print(f"   内存峰值: {usage['peak_mb']} MB")
+    
+    if step_cache.enabled:
+        stats = step_cache.stats()
+        print(f"   步间缓存: 跳过 {stats['skipped']}/{stats['steps']} 步")
+    
+    if compile_cache is not None:
+        compile_cache.mark_warm([(args.width, args.height)])
     
     # 保存图像
     output_path = Path(args.output)
     output_path.parent.mkdir(parents=True, exist_ok=True)
-    image.save(output_path)
+    fmt = args.format or encoding.format_for(output_path)
+    output_path.write_bytes(encoding.encode(image, fmt, args.compress_level, metadata={
+        "prompt": args.prompt,
+        "seed": args.seed,
+        "model": args.model,
+        "steps": args.steps,
+        "size": f"{args.width}x{args.height}",
+    }))
     
     print(f"\n✅ 图像已保存到: {output_path.absolute()}")
 
@@ -8,7 +8,10 @@ from pydantic import BaseModel
 from typing import List, Optional, Literal
 
 from app.models import get_db, User, Job, Worker
+from app.config import settings
 from app.api.deps import get_current_admin
+from app.services import quota, job_events, tracing
+from app.services.chat_limiter import chat_limiter
 
 router = APIRouter()
 
@@ -123,6 +126,7 @@ async def list_users(
     users = result.scalars().all()
     
     total = await db.scalar(select(func.count(User.id)))
+    usage = await quota.get_usage(db, [u.id for u in users])
     
     return {
         "users": [
@@ -135,7 +139,7 @@ async def list_users(
                 is_admin=u.is_admin,
                 is_active=u.is_active,
                 daily_quota=u.daily_quota,
-                today_used_count=u.today_used_count,
+                today_used_count=usage[u.id],
                 total_generations=u.total_generations,
                 created_at=u.created_at,
             )
@@ -365,6 +369,55 @@ async def list_workers(
     }
 
 
+@router.get("/chat/rate-limit")
+async def get_chat_rate_limit(
+    admin: User = Depends(get_current_admin),
+):
+    """聊天限流统计（本进程计数）"""
+    return {
+        "stats": dict(chat_limiter.stats),
+        "limits": {
+            "per_connection": {"rate": settings.CHAT_RATE_PER_CONNECTION, "burst": settings.CHAT_BURST_PER_CONNECTION},
+            "per_user": {"rate": settings.CHAT_RATE_PER_USER, "burst": settings.CHAT_BURST_PER_USER},
+            "max_strikes": settings.CHAT_RATE_MAX_STRIKES,
+            "shared": bool(settings.RATE_LIMIT_STORAGE_URL),
+        },
+    }
+
+
+@router.get("/traces/stages")
+async def get_trace_stages(
+    limit: int = Query(default=500, ge=1, le=5000, description="统计最近结束的任务数"),
+    admin: User = Depends(get_current_admin),
+    db: AsyncSession = Depends(get_db),
+):
+    """最近结束任务各阶段耗时分位数（毫秒）"""
+    result = await db.execute(
+        select(Job.result_metadata)
+        .where(Job.status.in_(["done", "failed"]), Job.finished_at.isnot(None))
+        .order_by(Job.finished_at.desc())
+        .limit(limit)
+    )
+    traces = [meta["trace"] for meta in result.scalars().all() if meta and meta.get("trace")]
+    return {"jobs": len(traces), "stages": tracing.stage_percentiles(traces)}
+
+
+@router.get("/jobs/{job_id}/trace")
+async def get_job_trace(
+    job_id: str,
+    admin: User = Depends(get_current_admin),
+    db: AsyncSession = Depends(get_db),
+):
+    """单个任务的链路（各阶段起点相对提交时间，毫秒）"""
+    job = await db.get(Job, job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="任务不存在")
+    trace = tracing.trace_of(job)
+    if not trace:
+        raise HTTPException(status_code=404, detail="该任务没有链路记录")
+    return {"job_id": job.id, "status": job.status, **trace}
+
+
 @router.post("/jobs/{job_id}/retry")
 async def retry_job(
     job_id: str,
@@ -381,10 +434,15 @@ async def retry_job(
     if job.status != "failed":
         raise HTTPException(status_code=400, detail="只能重试失败的任务")
     
+    old_status = job.status
     job.status = "queued"
     job.error_message = None
     job.retry_count = (job.retry_count or 0) + 1
+    # 失败时已退还的配额重新记上（管理员操作，不受限额约束）
+    if settings.REFUND_QUOTA_ON_FAILURE:
+        await quota.reserve(db, job.user_id, None)
     await db.commit()
+    await job_events.job_transition(job.user_id, old_status, job.status)
     
     return {"success": True, "message": "任务已重新排队"}
 
@@ -405,8 +463,12 @@ async def cancel_job(
     if job.status not in ["queued", "running"]:
         raise HTTPException(status_code=400, detail="只能取消排队中或运行中的任务")
     
+    old_status = job.status
     job.status = "cancelled"
+    await quota.refund(db, job.user_id, job.created_at)
     await db.commit()
+    await job_events.job_transition(job.user_id, old_status, job.status)
+    await job_events.job_finished(job.id)
     
     return {"success": True, "message": "任务已取消"}
 
@@ -1,5 +1,6 @@
 # -*- coding: utf-8 -*-
 """认证 API - Linux DO Connect OAuth"""
+import logging
 from datetime import datetime, timedelta
 from urllib.parse import urlencode
 from fastapi import APIRouter, Depends, HTTPException, Query
@@ -13,6 +14,9 @@ import httpx
 from app.models import get_db, User
 from app.config import settings
 from app.api.deps import get_current_user
+from app.services import quota
+
+logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
@@ -76,7 +80,7 @@ async def oauth_callback(
     try:
         async with httpx.AsyncClient(timeout=30.0) as client:
             # Step 1: 用授权码换取 access_token
-            print(f"[OAuth] Requesting token with code: {code[:10]}...")
+            logger.debug("Requesting token")
             token_resp = await client.post(
                 settings.LINUX_DO_TOKEN_URL,
                 data={
@@ -87,13 +91,13 @@ async def oauth_callback(
                     "redirect_uri": settings.LINUX_DO_REDIRECT_URI,
                 },
             )
-            print(f"[OAuth] Token response status: {token_resp.status_code}")
-            print(f"[OAuth] Token response: {token_resp.text[:500]}")
+            logger.info("Token response status: %s", token_resp.status_code)
             
             token_data = token_resp.json()
             
             if "access_token" not in token_data:
-                print(f"[OAuth] Token error: {token_data}")
+                # 只记录错误字段，不输出完整响应
+                logger.warning("Token error: %s", token_data.get("error", "unknown"))
                 error_msg = token_data.get("error_description", token_data.get("error", "获取令牌失败"))
                 raise HTTPException(status_code=400, detail=f"获取令牌失败: {error_msg}")
             
@@ -105,13 +109,13 @@ async def oauth_callback(
                 headers={"Authorization": f"Bearer {linux_do_token}"},
             )
             user_data = user_resp.json()
-            print(f"[OAuth] User data: {user_data}")
+            logger.debug("User info received: id=%s username=%s", user_data.get("id"), user_data.get("username"))
             
     except httpx.RequestError as e:
-        print(f"[OAuth] Request error: {e}")
+        logger.warning("Request error: %s", e)
         raise HTTPException(status_code=400, detail=f"OAuth 请求失败: {str(e)}")
     except Exception as e:
-        print(f"[OAuth] Error: {e}")
+        logger.exception("OAuth callback failed: %s", e)
         raise HTTPException(status_code=400, detail=f"OAuth 失败: {str(e)}")
     
     # 解析用户信息
@@ -153,7 +157,7 @@ async def oauth_callback(
         user.update_quota_by_trust_level()
         db.add(user)
         await db.flush()
-        print(f"[OAuth] New user created: {username} (TL{trust_level}, quota={user.daily_quota})")
+        logger.info("New user created: %s (TL%s, quota=%s)", username, trust_level, user.daily_quota)
     else:
         # 更新现有用户信息
         user.username = username
@@ -162,7 +166,7 @@ async def oauth_callback(
         user.trust_level = trust_level
         user.is_silenced = is_silenced
         user.update_quota_by_trust_level()
-        print(f"[OAuth] User updated: {username} (TL{trust_level}, quota={user.daily_quota})")
+        logger.info("User updated: %s (TL%s, quota=%s)", username, trust_level, user.daily_quota)
     
     await db.commit()
     
@@ -241,8 +245,12 @@ async def dev_login(
 
 
 @router.get("/me", response_model=UserInfo)
-async def get_me(user: User = Depends(get_current_user)):
+async def get_me(
+    user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db),
+):
     """获取当前用户信息"""
+    used = (await quota.get_usage(db, [user.id]))[user.id]
     return UserInfo(
         id=user.id,
         username=user.username,
@@ -251,7 +259,7 @@ async def get_me(user: User = Depends(get_current_user)):
         is_admin=user.is_admin,
         trust_level=user.trust_level,
         daily_quota=user.daily_quota,
-        today_used_count=user.today_used_count,
-        remaining_quota=user.remaining_quota,
+        today_used_count=used,
+        remaining_quota=max(0, user.daily_quota - used),
         total_generations=user.total_generations,
     )
@@ -2,85 +2,176 @@
 """聊天室 API"""
 import asyncio
 import json
+import logging
 from datetime import datetime
 from typing import Dict, Set, Optional, List
 from fastapi import APIRouter, WebSocket, WebSocketDisconnect, Depends, Query
+from fastapi.responses import Response
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select, desc
 from jose import jwt, JWTError
 
 from app.models.database import get_db
 from app.models.user import User
-from app.models.chat import ChatMessage, ChatActivityLog
+from app.models.chat import ChatMessage
 from app.config import settings
+from app.services.events import bus, CHAT, NODE_ID
+from app.services.chat_fanout import ChatConnection, serialize
+from app.services.chat_store import chat_store
+from app.services.chat_history import chat_history, message_row, public_message
+from app.services.presence import PresenceIndex
+from app.services.chat_limiter import MessageThrottle
+from app.services.ratelimit import client_ip
+from app.services import metrics
+
+logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
 # 在线用户管理
 class ConnectionManager:
+    """
+    聊天连接管理
+
+    本进程只持有自己的 WebSocket；广播和加入 / 离开事件通过事件总线同步到其他进程。
+    所有进程的在线用户由 PresenceIndex 增量维护，加入 / 离开时管理员只收到差异。
+    """
     def __init__(self):
-        # websocket -> user_info
-        self.active_connections: Dict[WebSocket, dict] = {}
-        self.lock = asyncio.Lock()
+        # websocket -> 连接（含发送队列和写协程）
+        self.active_connections: Dict[WebSocket, ChatConnection] = {}
+        # 所有进程的在线用户
+        self.presence = PresenceIndex()
     
     async def connect(self, websocket: WebSocket, user_info: dict):
+        """接受连接并在本进程登记（加入事件由 announce_join 发布）"""
         await websocket.accept()
-        async with self.lock:
-            self.active_connections[websocket] = user_info
+        connection = ChatConnection(websocket, user_info, on_dead=self._remove)
+        self.active_connections[websocket] = connection
+        connection.start()
+        metrics.CHAT_CONNECTIONS.inc()
+    
+    async def announce_join(self, websocket: WebSocket, user_info: dict, activity: dict):
+        await bus.publish(CHAT, {
+            'kind': 'join', 'node': NODE_ID, 'conn': id(websocket),
+            'user_info': user_info, 'activity': activity,
+            'timestamp': datetime.utcnow().isoformat(),
+        })
     
-    async def disconnect(self, websocket: WebSocket):
-        async with self.lock:
-            if websocket in self.active_connections:
-                del self.active_connections[websocket]
+    async def disconnect(self, websocket: WebSocket, activity: dict):
+        connection = self.active_connections.pop(websocket, None)
+        if connection:
+            connection.stop()
+            metrics.CHAT_CONNECTIONS.dec()
+        await bus.publish(CHAT, {
+            'kind': 'leave', 'node': NODE_ID, 'conn': id(websocket),
+            'activity': activity,
+            'timestamp': datetime.utcnow().isoformat(),
+        })
     
-    async def broadcast(self, message: dict, activity: dict = None):
-        """广播消息给所有连接，管理员额外收到在线用户列表和活动日志"""
-        async with self.lock:
-            dead_connections = []
-            online_users = self._get_online_users_internal(include_details=True)
-            
-            for connection, info in self.active_connections.items():
-                try:
-                    msg = message.copy()
-                    # 管理员额外信息
-                    if info.get('is_admin'):
-                        msg['online_users'] = online_users
-                        if activity:
-                            msg['activity'] = activity
-                    await connection.send_json(msg)
-                except:
-                    dead_connections.append(connection)
-            
-            # 清理断开的连接
-            for conn in dead_connections:
-                if conn in self.active_connections:
-                    del self.active_connections[conn]
+    def _remove(self, connection: ChatConnection):
+        """写失败 / 慢消费者被断开时移除（离开事件由接收循环退出时发布）"""
+        if self.active_connections.get(connection.websocket) is connection:
+            del self.active_connections[connection.websocket]
+            metrics.CHAT_CONNECTIONS.dec()
     
-    def get_online_count(self) -> int:
-        return len(self.active_connections)
+    def send_to(self, websocket: WebSocket, message: dict):
+        """单发消息，经过该连接的发送队列以保证顺序"""
+        connection = self.active_connections.get(websocket)
+        if connection:
+            connection.send(serialize(message))
+    
+    async def shutdown(self):
+        """进程退出时通知其他进程移除本进程的在线用户"""
+        await bus.publish(CHAT, {'kind': 'node_down', 'node': NODE_ID})
+    
+    async def broadcast(self, message: dict, history: dict = None):
+        """广播消息给所有进程的所有连接，history 为最近记录缓冲区的变更"""
+        await bus.publish(CHAT, {'kind': 'broadcast', 'message': message, 'history': history})
+    
+    async def sync_presence(self):
+        """
+        定期广播本进程的连接集合
+        
+        其他进程据此校正在线列表，超过 3 个周期没有同步的进程（崩溃、未发 node_down）
+        的在线用户会被移除。
+        """
+        interval = settings.CHAT_PRESENCE_SYNC_SECONDS
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                connections = {str(id(ws)): c.user_info for ws, c in self.active_connections.items()}
+                await bus.publish(CHAT, {'kind': 'presence_sync', 'node': NODE_ID, 'connections': connections})
+                for node in self.presence.expired_nodes(interval * 3):
+                    logger.warning("Node %s stopped syncing presence, dropping its connections", node)
+                    self._presence_changed(self.presence.drop_node(node))
+            except Exception as e:
+                logger.warning("Presence sync error: %s", e)
+    
+    async def handle_event(self, event: dict):
+        """处理总线上的聊天事件"""
+        kind = event['kind']
+        if kind == 'broadcast':
+            if event.get('history'):
+                chat_history.apply(event['history'])
+            with metrics.CHAT_BROADCAST_SECONDS.time():
+                self._deliver(event['message'])
+        elif kind in ('join', 'leave'):
+            # 所有进程（包括发布者自己）都在这里更新在线索引和活动日志
+            if kind == 'join':
+                diff = self.presence.add(event['node'], event['conn'], event['user_info'])
+            else:
+                diff = self.presence.remove(event['node'], event['conn'])
+            chat_history.apply({'activity': event['activity']})
+            self._presence_changed(diff, event['activity'], event['timestamp'])
+        elif event.get('node') == NODE_ID:
+            # 本进程的连接以 active_connections 为准
+            return
+        elif kind == 'presence_sync':
+            self._presence_changed(self.presence.sync_node(event['node'], event['connections']))
+        elif kind == 'node_down':
+            self._presence_changed(self.presence.drop_node(event['node']))
+    
+    def _presence_changed(self, diff: Optional[dict], activity: dict = None, timestamp: str = None):
+        """广播在线人数更新；管理员额外收到在线列表差异和活动日志"""
+        if diff is None and activity is None:
+            return
+        message = {
+            'type': 'online_update',
+            'online_count': self.presence.connection_count,
+            'timestamp': timestamp or datetime.utcnow().isoformat(),
+        }
+        admin_extras = {}
+        if diff:
+            admin_extras['presence'] = diff
+        if activity:
+            admin_extras['activity'] = activity
+        self._deliver(message, admin_extras)
+    
+    def _deliver(self, message: dict, admin_extras: dict = None):
+        """
+        投递给本进程的连接（只入队，不等待发送）
+        
+        每条消息只序列化一次；带管理员附加字段时再为管理员序列化一次，
+        开销与在线人数无关。
+        """
+        connections = list(self.active_connections.values())
+        text = serialize(message)
+        admin_text = text
+        if admin_extras and any(c.is_admin for c in connections):
+            admin_text = serialize(dict(message, **admin_extras))
+        
+        for connection in connections:
+            connection.send(admin_text if connection.is_admin else text)
     
-    def _get_online_users_internal(self, include_details: bool = False) -> list:
-        """内部方法：获取在线用户列表"""
-        users = []
-        seen = set()
-        for ws, info in self.active_connections.items():
-            display_name = info.get('display_name', '匿名用户')
-            username = info.get('username')
-            key = (display_name, username)
-            if key not in seen:
-                seen.add(key)
-                user_data = {'display_name': display_name}
-                if include_details:
-                    user_data['user_id'] = info.get('user_id')
-                    user_data['username'] = username
-                users.append(user_data)
-        return users
+    def get_online_count(self) -> int:
+        return self.presence.connection_count
     
     def get_online_users(self, include_user_id: bool = False) -> list:
-        """获取在线用户列表"""
-        return self._get_online_users_internal(include_details=include_user_id)
+        """获取在线用户列表（缓存的快照，不要修改）"""
+        return self.presence.snapshot(include_details=include_user_id)
 
 manager = ConnectionManager()
+bus.subscribe(CHAT, manager.handle_event)
 
 
 @router.websocket("/ws")
@@ -139,32 +230,62 @@ async def websocket_endpoint(
     
     await manager.connect(websocket, user_info)
     
-    # 保存加入活动日志
-    await save_activity_log(user_id, username, display_name, 'join')
+    # 记录加入活动日志（批量延迟写入）
+    joined_at = chat_store.add_activity(user_id, username, display_name, 'join')
+    join_activity = {
+        'type': 'join',
+        'display_name': display_name,
+        'username': username,
+        'timestamp': joined_at.isoformat(),
+    }
+    
+    # 广播加入事件：各进程更新在线索引并推送在线人数，管理员收到在线列表差异和活动日志
+    await manager.announce_join(websocket, user_info, join_activity)
     
-    # 如果是管理员，先发送历史活动日志
+    # 如果是管理员，发送历史活动日志和完整在线列表（已包含本次加入）
     if is_admin:
-        activity_logs = await get_activity_logs(100)
-        await websocket.send_json({
+        manager.send_to(websocket, {
             'type': 'init',
-            'activity_logs': activity_logs,
+            'activity_logs': chat_history.activity_logs(100),
             'online_count': manager.get_online_count(),
-            'online_users': manager._get_online_users_internal(include_details=True),
+            'online_users': manager.get_online_users(include_user_id=True),
+            'presence_version': manager.presence.version,
         })
     
-    # 广播在线人数更新，管理员可见活动日志
-    await manager.broadcast(
-        {
-            'type': 'online_update',
-            'online_count': manager.get_online_count(),
-            'timestamp': datetime.utcnow().isoformat(),
-        },
-        activity={
-            'type': 'join',
+    async def publish_message(content: str):
+        # 进程内分配ID，立即广播，数据库写入由 chat_store 批量完成
+        msg_id, created_at = chat_store.add_message(user_id, display_name, content)
+        metrics.CHAT_MESSAGES.inc()
+        
+        # 构建消息（包含ID供删除使用）
+        message = {
+            'type': 'message',
+            'id': str(msg_id),
             'display_name': display_name,
-            'username': username,
-            'timestamp': datetime.utcnow().isoformat(),
+            'avatar_url': display_avatar,
+            'content': content,
+            'timestamp': created_at.isoformat(),
+            'is_admin': is_admin,
         }
+        
+        await manager.broadcast(
+            message,
+            history={'message': message_row(msg_id, user_id, display_name, content, message['timestamp'])},
+        )
+    
+    def close_abusive():
+        connection = manager.active_connections.get(websocket)
+        if connection:
+            connection.close(code=1008)
+    
+    # 发送限流：登录用户按 user_id，游客按 IP
+    user_key = f"user:{user_id}" if user_id else f"ip:{client_ip(websocket.headers, websocket.client)}"
+    throttle = MessageThrottle(
+        conn_key=f"{NODE_ID}:{id(websocket)}",
+        user_key=user_key,
+        publish=publish_message,
+        notify=lambda wait: manager.send_to(websocket, {'type': 'rate_limited', 'retry_after': round(wait, 1)}),
+        close=close_abusive,
     )
     
     try:
@@ -177,150 +298,72 @@ async def websocket_endpoint(
                 if not content or len(content) > 500:
                     continue
                 
-                # 先保存消息到数据库获取ID
-                msg_id = await save_message(user_id, display_name, content)
-                
-                # 构建消息（包含ID供删除使用）
-                message = {
-                    'type': 'message',
-                    'id': msg_id,
-                    'display_name': display_name,
-                    'avatar_url': display_avatar,
-                    'content': content,
-                    'timestamp': datetime.utcnow().isoformat(),
-                    'is_admin': is_admin,
-                }
-                
-                await manager.broadcast(message)
+                if not await throttle.submit(content):
+                    logger.info("Closing %s (%s): too many rate-limited messages", display_name, user_key)
+                    break
                 
             except json.JSONDecodeError:
                 continue
                 
     except WebSocketDisconnect:
-        await manager.disconnect(websocket)
-        # 保存离开活动日志
-        await save_activity_log(user_id, username, display_name, 'leave')
-        # 广播在线人数更新，管理员可见活动日志
-        await manager.broadcast(
-            {
-                'type': 'online_update',
-                'online_count': manager.get_online_count(),
-                'timestamp': datetime.utcnow().isoformat(),
-            },
-            activity={
-                'type': 'leave',
-                'display_name': display_name,
-                'username': username,
-                'timestamp': datetime.utcnow().isoformat(),
-            }
-        )
-
-
-async def save_message(user_id: Optional[int], display_name: str, content: str) -> int:
-    """保存聊天消息并返回ID"""
-    from app.models.database import async_session
+        pass
     
-    async with async_session() as db:
-        msg = ChatMessage(
-            user_id=user_id,
-            display_name=display_name,
-            content=content,
-        )
-        db.add(msg)
-        await db.commit()
-        await db.refresh(msg)
-        return msg.id
+    throttle.stop()
+    # 记录离开活动日志
+    left_at = chat_store.add_activity(user_id, username, display_name, 'leave')
+    leave_activity = {
+        'type': 'leave',
+        'display_name': display_name,
+        'username': username,
+        'timestamp': left_at.isoformat(),
+    }
+    await manager.disconnect(websocket, leave_activity)
 
 
-async def save_activity_log(user_id: Optional[int], username: Optional[str], display_name: str, activity_type: str):
-    """保存活动日志"""
-    from app.models.database import async_session
-    
-    async with async_session() as db:
-        log = ChatActivityLog(
-            user_id=user_id,
-            username=username,
-            display_name=display_name,
-            activity_type=activity_type,
-        )
-        db.add(log)
-        await db.commit()
+async def _query_messages(db: AsyncSession, limit: int, before_id: Optional[int]) -> list:
+    """按 ID 倒序分页查询（雪花 ID 随时间递增）"""
+    query = select(ChatMessage).order_by(desc(ChatMessage.id)).limit(limit)
+    if before_id is not None:
+        query = query.where(ChatMessage.id < before_id)
+    result = await db.execute(query)
+    return list(reversed(result.scalars().all()))
 
 
-async def get_activity_logs(limit: int = 100) -> list:
-    """获取活动日志"""
-    from app.models.database import async_session
+async def _messages_page(db: AsyncSession, limit: int, before_id: Optional[int], include_user_id: bool):
+    # 最近的记录直接返回内存缓冲中预先序列化的响应
+    if before_id is None and chat_history.can_serve(limit):
+        return Response(content=chat_history.messages_response(limit, include_user_id), media_type="application/json")
     
-    async with async_session() as db:
-        result = await db.execute(
-            select(ChatActivityLog)
-            .order_by(desc(ChatActivityLog.created_at))
-            .limit(limit)
-        )
-        logs = result.scalars().all()
-        
-        return [
-            {
-                'type': log.activity_type,
-                'display_name': log.display_name,
-                'username': log.username,
-                'timestamp': log.created_at.isoformat(),
-            }
-            for log in reversed(logs)
-        ]
+    # 更早的记录按游标查询数据库
+    messages = await _query_messages(db, limit, before_id)
+    rows = [
+        message_row(msg.id, msg.user_id, msg.display_name, msg.content, msg.created_at.isoformat())
+        for msg in messages
+    ]
+    return {
+        'messages': rows if include_user_id else [public_message(row) for row in rows],
+        'next_before_id': rows[0]['id'] if len(rows) == limit else None,
+    }
 
 
 @router.get("/messages")
 async def get_messages(
     limit: int = Query(default=50, ge=1, le=200),
+    before_id: Optional[int] = Query(default=None, description="游标：返回 ID 小于该值的更早消息"),
     db: AsyncSession = Depends(get_db),
 ):
     """获取历史消息"""
-    result = await db.execute(
-        select(ChatMessage)
-        .order_by(desc(ChatMessage.created_at))
-        .limit(limit)
-    )
-    messages = result.scalars().all()
-    
-    return {
-        'messages': [
-            {
-                'id': msg.id,
-                'display_name': msg.display_name,
-                'content': msg.content,
-                'timestamp': msg.created_at.isoformat(),
-            }
-            for msg in reversed(messages)
-        ]
-    }
+    return await _messages_page(db, limit, before_id, include_user_id=False)
 
 
 @router.get("/messages/admin")
 async def get_messages_admin(
     limit: int = Query(default=100, ge=1, le=500),
+    before_id: Optional[int] = Query(default=None, description="游标：返回 ID 小于该值的更早消息"),
     db: AsyncSession = Depends(get_db),
 ):
     """管理员获取历史消息（包含用户ID）"""
-    result = await db.execute(
-        select(ChatMessage)
-        .order_by(desc(ChatMessage.created_at))
-        .limit(limit)
-    )
-    messages = result.scalars().all()
-    
-    return {
-        'messages': [
-            {
-                'id': msg.id,
-                'user_id': msg.user_id,
-                'display_name': msg.display_name,
-                'content': msg.content,
-                'timestamp': msg.created_at.isoformat(),
-            }
-            for msg in reversed(messages)
-        ]
-    }
+    return await _messages_page(db, limit, before_id, include_user_id=True)
 
 
 @router.get("/online")
@@ -338,22 +381,27 @@ async def delete_message(
     db: AsyncSession = Depends(get_db),
 ):
     """管理员删除聊天消息"""
-    # 查找消息
-    result = await db.execute(select(ChatMessage).where(ChatMessage.id == message_id))
-    message = result.scalar_one_or_none()
-    
-    if not message:
-        from fastapi import HTTPException
-        raise HTTPException(status_code=404, detail="消息不存在")
-    
-    await db.delete(message)
-    await db.commit()
+    # 尚未写入数据库的消息直接从缓冲区移除
+    if not chat_store.discard_message(message_id):
+        # 查找消息
+        result = await db.execute(select(ChatMessage).where(ChatMessage.id == message_id))
+        message = result.scalar_one_or_none()
+        
+        if not message:
+            from fastapi import HTTPException
+            raise HTTPException(status_code=404, detail="消息不存在")
+        
+        await db.delete(message)
+        await db.commit()
     
     # 广播删除消息事件
-    await manager.broadcast({
-        'type': 'delete',
-        'message_id': message_id,
-        'timestamp': datetime.utcnow().isoformat(),
-    })
+    await manager.broadcast(
+        {
+            'type': 'delete',
+            'message_id': str(message_id),
+            'timestamp': datetime.utcnow().isoformat(),
+        },
+        history={'delete': str(message_id)},
+    )
     
     return {"success": True}
@@ -46,9 +46,7 @@ async def get_current_user(
     if not user.is_active:
         raise HTTPException(status_code=403, detail="账号已禁用")
     
-    # 重置每日配额
-    user.reset_daily_quota_if_needed()
-    
+    # 每日配额由 app.services.quota 按日期桶惰性计算，这里不再写库重置
     return user
 
 
@@ -1,16 +1,22 @@
 # -*- coding: utf-8 -*-
 """任务 API"""
+import logging
 import uuid
 from datetime import datetime, timedelta
 from typing import Optional
 from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Form
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, func, and_
+from sqlalchemy import select, func, and_, update
 from pydantic import BaseModel, Field
 
 from app.models import get_db, User, Job, JobStatus, Worker, WorkerStatus
 from app.config import settings
 from app.api.deps import get_current_user, verify_worker_auth
+from app.services.admission import admission
+from app.services import quota, job_events, metrics, tracing
+from app.logs import bind
+
+logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
@@ -50,6 +56,7 @@ class JobStatusUpdate(BaseModel):
     """任务状态更新"""
     status: str
     error_message: Optional[str] = None
+    trace: Optional[dict] = None  # Worker 测量的阶段耗时，见 app.services.tracing
 
 
 @router.post("", response_model=JobResponse)
@@ -58,50 +65,29 @@ async def create_job(
     user: User = Depends(get_current_user),
     db: AsyncSession = Depends(get_db),
 ):
-    """提交生图任务"""
-    
+    """
+    提交生图任务
+
+    准入检查读内存计数（见 app.services.admission），配额原子预占（见 app.services.quota），
+    常见路径只有一次配额 UPDATE 和一次任务 INSERT
+    """
     # 检查是否有在线 Worker
-    result = await db.execute(select(Worker))
-    workers = result.scalars().all()
-    online_workers = [w for w in workers if w.is_online]
-    
-    if not online_workers:
+    if not admission.workers_online():
         raise HTTPException(status_code=503, detail="生图服务当前离线，请稍后再试")
     
+    queue_length = admission.queue_length
+    
     # 管理员跳过队列限制检查
     if not user.is_admin:
         # 检查用户是否有待处理任务
-        result = await db.execute(
-            select(func.count(Job.id)).where(
-                and_(
-                    Job.user_id == user.id,
-                    Job.status.in_([JobStatus.QUEUED.value, JobStatus.RUNNING.value])
-                )
-            )
-        )
-        pending_count = result.scalar()
-        
-        if pending_count >= 1:
+        if admission.has_pending(user.id):
             raise HTTPException(status_code=429, detail="您已有任务在处理中，请等待完成后再提交")
         
-        # 检查配额
-        if not user.can_submit_job():
-            raise HTTPException(status_code=429, detail=f"今日配额已用完（{user.daily_quota}张/天）")
-        
         # 检查队列长度
-        result = await db.execute(
-            select(func.count(Job.id)).where(Job.status == JobStatus.QUEUED.value)
-        )
-        queue_length = result.scalar()
-        
         if queue_length >= settings.HARD_QUEUE_LIMIT:
             raise HTTPException(status_code=503, detail="系统繁忙，请稍后再试")
     
-    # 检查队列长度（用于提示）
-    result = await db.execute(
-        select(func.count(Job.id)).where(Job.status == JobStatus.QUEUED.value)
-    )
-    queue_length = result.scalar()
+    # 队列过长提示
     queue_overload = queue_length >= settings.MAX_QUEUE_LENGTH
     
     # 管理员任务优先级更高（插队）
@@ -119,10 +105,23 @@ async def create_job(
         seed=job_data.seed,
         status=JobStatus.QUEUED.value,
         priority=priority,
+        result_metadata={"trace": tracing.new_trace()},
     )
     
-    db.add(job)
-    await db.flush()
+    # 检查之后立即在本地占用名额，之后才有 await（配额预占、写库）：
+    # 同一用户的并发提交在此之后都会被 has_pending 拦下；预占或提交失败时释放。
+    # 事件在提交成功后才发布，其他节点不会计入回滚的任务
+    admission.on_job_transition(user.id, None, job.status)
+    try:
+        # 原子预占配额（管理员不限额，只记录用量），与任务 INSERT 同一事务
+        if not await quota.reserve(db, user.id, None if user.is_admin else user.daily_quota):
+            raise HTTPException(status_code=429, detail=f"今日配额已用完（{user.daily_quota}张/天）")
+        db.add(job)
+        await db.commit()
+    except Exception:
+        admission.on_job_transition(user.id, job.status, None)
+        raise
+    await job_events.job_transition(user.id, None, job.status, applied=True)
     
     return JobResponse(
         id=job.id,
@@ -264,25 +263,59 @@ async def update_job_status(
     
     if not job:
         raise HTTPException(status_code=404, detail="任务不存在")
+    bind(job_id=job.id, trace_id=tracing.trace_id_of(job))
     
     old_status = job.status
+    # 只接受持有该任务的 Worker 的上报（或领取排队中的任务）：超时重新排队、被其他 Worker 领取后，
+    # 原 Worker 迟到的 failed / queued 不能覆盖新的运行；终态不再变化
+    owns = old_status == JobStatus.RUNNING.value and job.worker_id == worker.id
+    claims = old_status == JobStatus.QUEUED.value and status_update.status == JobStatus.RUNNING.value
+    if not (owns or claims):
+        logger.warning("Rejected status %s from worker %s (status=%s, owner=%s)", status_update.status, worker.id, old_status, job.worker_id)
+        raise HTTPException(status_code=409, detail="任务不在该 Worker 的运行中")
+    
     job.status = status_update.status
+    logger.info("Status %s -> %s reported by worker %s", old_status, job.status, worker.id)
     
     if status_update.status == JobStatus.RUNNING.value:
         job.started_at = datetime.utcnow()
         job.worker_id = worker.id
+    elif status_update.status == JobStatus.QUEUED.value and old_status == JobStatus.RUNNING.value:
+        # Worker 退出前归还已领取但未开始的任务
+        job.started_at = None
+        job.worker_id = None
     elif status_update.status in (JobStatus.DONE.value, JobStatus.FAILED.value):
         job.finished_at = datetime.utcnow()
+        metrics.job_completed(job.status, job.created_at, job.started_at, job.finished_at)
+        tracing.merge_reported(job, status_update.trace)
+        tracing.exporter.export_job(job)
         
         if status_update.error_message:
             job.error_message = status_update.error_message
         
-        # 注意：用户统计在 upload_job_result 中更新，这里不再重复更新
-        # 避免配额被消耗两次
+        # 配额在提交时已预占，失败时按配置退还
+        if status_update.status == JobStatus.FAILED.value and old_status in (
+            JobStatus.QUEUED.value, JobStatus.RUNNING.value
+        ):
+            await quota.refund_failed(db, job.user_id, job.created_at)
+    
+    # 提交成功后再发布事件
+    await db.commit()
+    await job_events.job_transition(job.user_id, old_status, job.status)
+    if job.status == JobStatus.RUNNING.value:
+        await job_events.job_started(job.id, job.started_at)
+    elif job.status == JobStatus.QUEUED.value:
+        await job_events.job_requeued(job.id, None)
+    elif job.status in (JobStatus.DONE.value, JobStatus.FAILED.value):
+        await job_events.job_finished(job.id)
     
     return {"success": True, "old_status": old_status, "new_status": job.status}
 
 
+_IMAGE_EXTENSIONS = {"image/png": "png", "image/webp": "webp", "image/jpeg": "jpg", "image/avif": "avif"}
+_IMAGE_TYPES = {extension: content_type for content_type, extension in _IMAGE_EXTENSIONS.items()}
+
+
 @router.post("/{job_id}/result")
 async def upload_job_result(
     job_id: str,
@@ -296,41 +329,66 @@ async def upload_job_result(
     import aiofiles
     from pathlib import Path
     
+    received_at = datetime.utcnow()
     result = await db.execute(select(Job).where(Job.id == job_id))
     job = result.scalar_one_or_none()
     
     if not job:
         raise HTTPException(status_code=404, detail="任务不存在")
-    
+    bind(job_id=job.id, trace_id=tracing.trace_id_of(job))
+
+    # 只接受当前持有该任务的 Worker 的结果：已取消、超时退还配额或被重新分配的任务不能再完成
+    if job.status != JobStatus.RUNNING.value or job.worker_id != worker.id:
+        logger.warning("Rejected result from worker %s (status=%s, owner=%s)", worker.id, job.status, job.worker_id)
+        raise HTTPException(status_code=409, detail="任务不在该 Worker 的运行中")
+
     # 解析元数据
     try:
         meta = json.loads(metadata) if metadata else {}
     except:
         meta = {}
+    reported_trace = meta.pop("trace", None) if isinstance(meta, dict) else None
     
     # 保存图片
     today = datetime.now().strftime("%Y-%m-%d")
     save_dir = settings.STORAGE_ROOT / str(job.user_id) / today
     save_dir.mkdir(parents=True, exist_ok=True)
     
-    save_path = save_dir / f"{job_id}.png"
+    # Worker 可选 PNG / WebP / JPEG / AVIF 编码，按上传的 Content-Type 决定扩展名
+    extension = _IMAGE_EXTENSIONS.get(image.content_type, "png")
+    save_path = save_dir / f"{job_id}.{extension}"
     
+    save_started = datetime.utcnow()
     async with aiofiles.open(save_path, "wb") as f:
         content = await image.read()
         await f.write(content)
+    metrics.JOB_UPLOAD_BYTES.observe(len(content))
     
-    # 更新任务
+    # 更新任务（保留提交时创建的链路记录）
     job.image_path = str(save_path.relative_to(settings.STORAGE_ROOT))
-    job.result_metadata = meta
+    trace = tracing.trace_of(job)
+    job.result_metadata = {**meta, "trace": trace} if trace else meta
+    tracing.merge_reported(job, reported_trace, received_at)
+    tracing.record(job, "save", save_started, datetime.utcnow())
+    old_status = job.status
     job.status = JobStatus.DONE.value
     job.finished_at = datetime.utcnow()
+    metrics.job_completed(job.status, job.created_at, job.started_at, job.finished_at)
     
-    # 更新用户统计
-    result = await db.execute(select(User).where(User.id == job.user_id))
-    user = result.scalar_one_or_none()
-    if user:
-        user.today_used_count += 1
-        user.total_generations += 1
+    # 更新用户统计（配额已在提交时预占，这里只累加总数，原子更新避免并发丢失）
+    await db.execute(
+        update(User)
+        .where(User.id == job.user_id)
+        .values(total_generations=User.total_generations + 1)
+    )
+    
+    commit_started = datetime.utcnow()
+    await db.commit()
+    tracing.record(job, "commit", commit_started, datetime.utcnow())
+    await job_events.job_transition(job.user_id, old_status, job.status)
+    await job_events.job_finished(job.id)
+    tracing.exporter.export_job(job)
+    logger.info("Result uploaded by worker %s (%d bytes)", worker.id, len(content))
     
     return {"success": True, "image_path": job.image_path}
 
@@ -354,7 +412,7 @@ async def get_job_image(
     if not file_path.exists():
         raise HTTPException(status_code=404, detail="图片文件不存在")
     
-    return FileResponse(file_path, media_type="image/png")
+    return FileResponse(file_path, media_type=_IMAGE_TYPES.get(file_path.suffix.lstrip("."), "image/png"))
 
 
 class PublishRequest(BaseModel):
@@ -475,8 +533,12 @@ async def cancel_job(
     if job.status not in [JobStatus.QUEUED.value, JobStatus.RUNNING.value]:
         raise HTTPException(status_code=400, detail="只能取消排队中或生成中的任务")
     
+    old_status = job.status
     job.status = JobStatus.CANCELLED.value
+    await quota.refund(db, job.user_id, job.created_at)
     await db.commit()
+    await job_events.job_transition(job.user_id, old_status, job.status)
+    await job_events.job_finished(job.id)
     
     return {"success": True, "message": "任务已取消"}
 
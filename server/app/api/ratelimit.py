@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+"""
+全局 API 限流中间件
+
+纯 ASGI 中间件，在路由之前按 (方法, 路径) 匹配 RATE_LIMIT_RULES 中的预算，
+按调用方身份（登录用户 ID，否则客户端 IP，来自 TRUSTED_PROXIES 时取代理头）分别计数，超出返回 429 和 Retry-After。
+计数使用 GCRA（见 app.services.ratelimit），RATE_LIMIT_STORAGE_URL 为 Redis 时多进程共享。
+
+规则格式："方法 路径模板" -> "次数/周期[:容量]"，周期为 s / m / h，
+路径中的 {参数} 匹配一个路径段，* 匹配任意方法；容量省略时等于次数。
+例如 "GET /api/jobs/{id}": "2/s:10" 表示每个用户每秒 2 次、最多连续 10 次。
+
+未匹配任何规则的 /api 请求使用 RATE_LIMIT_DEFAULT。
+Worker（携带正确的 X-API-Key）和 WebSocket 不经过限流。
+"""
+import json
+import math
+import re
+from typing import Dict, List, Optional, Tuple
+
+from jose import jwt, JWTError
+
+from app.config import settings
+from app.services.ratelimit import resolve_ip, shared_store
+
+_PERIODS = {"s": 1.0, "m": 60.0, "h": 3600.0}
+
+
+class RateLimitRule:
+    __slots__ = ("name", "method", "pattern", "rate", "burst")
+
+    def __init__(self, route: str, budget: str):
+        method, _, path = route.strip().partition(" ")
+        self.name = route.strip()
+        self.method = method.upper()
+        # {参数} -> 一个路径段；只匹配整个路径
+        self.pattern = re.compile("^" + re.sub(r"\\\{[^/]+?\\\}", "[^/]+", re.escape(path.strip())) + "/?$")
+        self.rate, self.burst = parse_budget(budget)
+
+    def matches(self, method: str, path: str) -> bool:
+        return (self.method == "*" or self.method == method) and self.pattern.match(path) is not None
+
+
+def parse_budget(budget: str) -> Tuple[float, int]:
+    """"10/m:5" -> (每秒速率, 容量)"""
+    amount, _, rest = budget.partition("/")
+    period, _, burst = rest.partition(":")
+    count = float(amount)
+    rate = count / _PERIODS[period.strip()[-1]] / float(period.strip()[:-1] or 1)
+    return rate, int(burst) if burst else max(1, int(count))
+
+
+def load_rules(rules: Dict[str, str]) -> List[RateLimitRule]:
+    return [RateLimitRule(route, budget) for route, budget in rules.items()]
+
+
+class RateLimitMiddleware:
+    def __init__(self, app, rules: Dict[str, str] = None, default: str = None, store=None):
+        self.app = app
+        self.rules = load_rules(settings.RATE_LIMIT_RULES if rules is None else rules)
+        default = settings.RATE_LIMIT_DEFAULT if default is None else default
+        self.default = RateLimitRule("* /api/default", default) if default else None
+        self.store = store or shared_store
+        # 令牌 -> 用户 ID，避免每个请求都验签
+        self._token_users: Dict[str, Optional[int]] = {}
+
+    def _match(self, method: str, path: str) -> Optional[RateLimitRule]:
+        for rule in self.rules:
+            if rule.matches(method, path):
+                return rule
+        if self.default and path.startswith("/api/"):
+            return self.default
+        return None
+
+    def _user_id(self, token: str) -> Optional[int]:
+        if token in self._token_users:
+            return self._token_users[token]
+        try:
+            payload = jwt.decode(token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
+            user_id = int(payload["sub"])
+        except (JWTError, KeyError, TypeError, ValueError):
+            user_id = None
+        if len(self._token_users) >= 10_000:
+            self._token_users.clear()
+        self._token_users[token] = user_id
+        return user_id
+
+    def _identity(self, scope) -> Optional[str]:
+        """调用方身份，Worker 返回 None（不限流）"""
+        authorization = api_key = real_ip = forwarded = None
+        for name, value in scope["headers"]:
+            if name == b"authorization":
+                authorization = value
+            elif name == b"x-api-key":
+                api_key = value
+            elif name == b"x-real-ip":
+                real_ip = value
+            elif name == b"x-forwarded-for":
+                forwarded = value
+
+        if api_key is not None and api_key.decode("latin-1") == settings.WORKER_API_KEY:
+            return None
+        if authorization is not None and authorization[:7].lower() == b"bearer ":
+            user_id = self._user_id(authorization[7:].decode("latin-1").strip())
+            if user_id is not None:
+                return f"user:{user_id}"
+        client = scope.get("client")
+        return "ip:" + resolve_ip(
+            client[0] if client else None,
+            real_ip.decode("latin-1") if real_ip is not None else None,
+            forwarded.decode("latin-1") if forwarded is not None else None,
+        )
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not settings.RATE_LIMIT_ENABLED:
+            return await self.app(scope, receive, send)
+        rule = self._match(scope["method"], scope["path"])
+        if rule is None:
+            return await self.app(scope, receive, send)
+        identity = self._identity(scope)
+        if identity is None:
+            return await self.app(scope, receive, send)
+
+        wait = await self.store.hit(f"api:{rule.name}:{identity}", rule.rate, rule.burst)
+        if not wait:
+            return await self.app(scope, receive, send)
+
+        body = json.dumps({"detail": "请求过于频繁，请稍后再试"}, ensure_ascii=False).encode()
+        await send({
+            "type": "http.response.start",
+            "status": 429,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode()),
+                (b"retry-after", str(max(1, math.ceil(wait))).encode()),
+            ],
+        })
+        await send({"type": "http.response.body", "body": body})
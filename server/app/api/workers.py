@@ -1,5 +1,6 @@
 # -*- coding: utf-8 -*-
 """Worker API"""
+import logging
 from datetime import datetime
 from fastapi import APIRouter, Depends, HTTPException
 from sqlalchemy.ext.asyncio import AsyncSession
@@ -9,6 +10,12 @@ from typing import Optional
 
 from app.models import get_db, Worker, WorkerStatus, Job, JobStatus
 from app.api.deps import verify_worker_auth, get_current_admin
+from app.services.admission import admission
+from app.services.reaper import reaper
+from app.services import job_events, metrics, tracing
+from app.logs import bind
+
+logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
@@ -46,6 +53,8 @@ async def heartbeat(
     if data.gpu_info:
         worker.gpu_info = data.gpu_info
     
+    await job_events.worker_seen(worker.id, worker.status, worker.last_seen_at)
+    
     return HeartbeatResponse(success=True)
 
 
@@ -63,17 +72,23 @@ async def get_next_job(
     # 检查 Worker 是否匹配
     if worker.id != worker_id:
         raise HTTPException(status_code=403, detail="Worker ID 不匹配")
+    claim_started = datetime.utcnow()
     
     # 原子性查找并锁定最高优先级的 queued 任务
     from sqlalchemy import update
-    from datetime import datetime
     
     # 使用 UPDATE ... WHERE 实现原子性领取
     # 只有成功将状态从 queued 改为 running 的 Worker 才能获得任务
     # 优先级高的先处理（管理员任务插队），同优先级按创建时间
+    query = select(Job).where(Job.status == JobStatus.QUEUED.value)
+    
+    # 本 Worker 上超时/失联过的重试任务优先留给其他在线 Worker
+    avoided = reaper.avoided_jobs(worker.id)
+    if avoided and admission.online_worker_count() > 1:
+        query = query.where(Job.id.notin_(avoided))
+    
     result = await db.execute(
-        select(Job)
-        .where(Job.status == JobStatus.QUEUED.value)
+        query
         .order_by(Job.priority.desc(), Job.created_at.asc())
         .limit(1)
         .with_for_update(skip_locked=True)  # 跳过已被锁定的行
@@ -86,10 +101,18 @@ async def get_next_job(
         return Response(status_code=204)
     
     # 原子性更新状态为 running，由当前 Worker 领取
+    old_status = job.status
     job.status = JobStatus.RUNNING.value
     job.started_at = datetime.utcnow()
     job.worker_id = worker.id
+    tracing.record(job, "queue", job.created_at, job.started_at)
+    tracing.record(job, "claim", claim_started, job.started_at)
     await db.commit()
+    await job_events.job_transition(job.user_id, old_status, job.status)
+    await job_events.job_started(job.id, job.started_at)
+    metrics.job_claimed(job.created_at, job.started_at)
+    bind(job_id=job.id, trace_id=tracing.trace_id_of(job))
+    logger.info("Job claimed by worker %s", worker.id)
     
     return {
         "id": job.id,
@@ -103,6 +126,7 @@ async def get_next_job(
         "seed": job.seed,
         "sampler": job.sampler,
         "created_at": job.created_at.isoformat(),
+        "trace_id": tracing.trace_id_of(job),
     }
 
 
@@ -150,6 +174,7 @@ async def delete_worker(
     
     await db.delete(worker)
     await db.commit()
+    await job_events.worker_removed(worker_id)
     
     return {"success": True, "message": f"已删除 Worker: {worker_id}"}
 
@@ -39,12 +39,78 @@ class Settings(BaseSettings):
     WORKER_API_KEY: str = os.getenv("WORKER_API_KEY", "dev-api-key-change-in-production")
     WORKER_HEARTBEAT_TIMEOUT: int = 30  # 秒
     
+    # 事件总线（多进程 / 多主机部署）
+    # 为空时使用进程内总线；设置为 redis://host:6379/0 后可运行多个 uvicorn 进程
+    EVENT_BUS_URL: str = os.getenv("EVENT_BUS_URL", "")
+    EVENT_BUS_PREFIX: str = "zimage"
+    LEADER_LEASE_SECONDS: int = 15  # 单例后台任务的主节点租约
+    
+    # 聊天室
+    CHAT_SEND_QUEUE_SIZE: int = 256  # 每个连接的发送队列长度
+    CHAT_SLOW_CONSUMER_POLICY: str = "drop_oldest"  # 队列满时：drop_oldest / disconnect
+    CHAT_SEND_TIMEOUT_SECONDS: float = 10.0  # 单条消息发送超时，超时视为断开
+    CHAT_FLUSH_INTERVAL_MS: int = 200  # 消息/活动日志批量写入间隔
+    CHAT_FLUSH_MAX_ROWS: int = 200  # 缓冲达到该行数立即写入
+    CHAT_FLUSH_MAX_RETRIES: int = 6  # 批量写入连续失败次数上限（按间隔指数退避，约 25 秒），之后逐行写入并丢弃失败行
+    CHAT_HISTORY_SIZE: int = 500  # 内存中保留的最近消息/活动日志条数
+    CHAT_ID_NODE: int = int(os.getenv("CHAT_ID_NODE", "-1"))  # 消息 ID 节点号 0-1023，-1 表示按主机名和 PID 生成（多台主机时建议显式设置）
+    CHAT_PRESENCE_SYNC_SECONDS: int = 30  # 各进程广播在线连接集合的间隔，3 个周期未同步的进程视为下线
+    CHAT_RATE_PER_CONNECTION: float = 1.0  # 每个连接每秒可发消息数
+    CHAT_BURST_PER_CONNECTION: int = 5  # 每个连接可连续发送的消息数
+    CHAT_RATE_PER_USER: float = 2.0  # 每个用户（游客按 IP）每秒可发消息数，多个标签页共享
+    CHAT_BURST_PER_USER: int = 10
+    CHAT_COALESCE_MAX_CHARS: int = 500  # 超限消息合并后的最大长度，超出部分丢弃
+    CHAT_RATE_MAX_STRIKES: int = 10  # 连续超限次数超过该值关闭连接
+    
+    # 限流计数存储：为空时进程内计数；设置为 redis://... 后多进程共享（默认与事件总线相同）
+    RATE_LIMIT_STORAGE_URL: str = os.getenv("RATE_LIMIT_STORAGE_URL", os.getenv("EVENT_BUS_URL", ""))
+    # 受信任的反向代理（逗号分隔的 IP / 网段，如 127.0.0.1,172.16.0.0/12）：只有来自这些地址的请求
+    # 才采信 X-Real-IP / X-Forwarded-For；为空时一律按直连地址计数（防止伪造请求头绕过限流）
+    TRUSTED_PROXIES: str = os.getenv("TRUSTED_PROXIES", "")
+    
+    # API 限流（按用户 ID，未登录按 IP）："方法 路径模板" -> "次数/周期[:容量]"，按顺序取第一条匹配
+    RATE_LIMIT_ENABLED: bool = True
+    RATE_LIMIT_RULES: dict = {
+        "POST /api/jobs": "10/m:5",
+        "GET /api/jobs/{job_id}": "2/s:20",  # 前端轮询任务状态
+        "GET /api/jobs/{job_id}/image": "10/s:60",
+        "GET /api/gallery": "2/s:20",
+        "POST /api/social/jobs/{job_id}/like": "1/s:5",
+        "POST /api/social/jobs/{job_id}/comments": "6/m:3",
+        "GET /api/social/jobs/{job_id}/comments": "2/s:20",
+        "GET /api/chat/messages": "1/s:10",
+    }
+    RATE_LIMIT_DEFAULT: str = "10/s:50"  # 其他 /api 请求；为空表示不限
+    
+    # 日志
+    LOG_LEVEL: str = os.getenv("LOG_LEVEL", "INFO")
+    LOG_FORMAT: str = os.getenv("LOG_FORMAT", "json")  # json / text
+    LOG_LEVELS: dict = {  # 按模块覆盖级别
+        "sqlalchemy.engine": "WARNING",
+        "httpx": "WARNING",
+    }
+    LOG_SAMPLE_RATES: dict = {  # 高频模块 DEBUG 日志的采样比例
+        "app.api.chat": 0.01,
+        "app.api.ratelimit": 0.01,
+        "app.services.chat_limiter": 0.05,
+    }
+    LOG_QUEUE_SIZE: int = 10000  # 待写日志队列上限，满了丢弃新日志
+    
+    # 任务链路追踪导出（OTLP/HTTP，如 http://localhost:4318；为空不导出，链路仍记录在任务中）
+    OTLP_ENDPOINT: str = os.getenv("OTLP_ENDPOINT", "")
+    OTLP_SERVICE_NAME: str = "zimage-server"
+    OTLP_EXPORT_INTERVAL_SECONDS: float = 5.0
+    OTLP_MAX_QUEUE_SPANS: int = 10000  # 导出积压上限，超过后丢弃
+    
     # 任务配置
     MAX_QUEUE_LENGTH: int = 50  # 队列软上限
     HARD_QUEUE_LIMIT: int = 500  # 硬上限
     JOB_TIMEOUT_SECONDS: int = 300
     MAX_RETRY_COUNT: int = 1
+    REQUEUE_EXPIRED_JOBS: bool = os.getenv("REQUEUE_EXPIRED_JOBS", "false").lower() == "true"  # 超时/Worker 失联的任务在重试次数内重新排队（默认直接失败）
+    REAP_ON_WORKER_TIMEOUT: bool = True  # 心跳超时立即回收该 Worker 的运行中任务
     REFUND_QUOTA_ON_FAILURE: bool = True
+    ADMISSION_RECONCILE_SECONDS: int = 10  # 准入计数与数据库校准间隔
     
     # 配额配置（基于 Linux DO trust_level）
     # trust_level 0-1: 1张/天, 2: 5张/天, 3-4: 20张/天
@@ -58,7 +124,7 @@ class Settings(BaseSettings):
     DEFAULT_DAILY_QUOTA: int = 1  # 默认配额（未登录或无 trust_level）
     ADMIN_DAILY_QUOTA: int = 1000
     
-    # 分辨率限制
+    # 分辨率限制（调高前参考 zimage_worker_memory_peak_mb 指标确认各 Worker 显存够用）
     MAX_WIDTH: int = 1024
     MAX_HEIGHT: int = 1024
     
@@ -0,0 +1,218 @@
+# -*- coding: utf-8 -*-
+"""
+日志
+
+- 调用方只把日志记录放进有界队列（满了直接丢弃并计数），格式化和写 stdout
+  在后台线程完成，事件循环不会因为日志 I/O 阻塞
+- 输出为单行 JSON（LOG_FORMAT=text 时为便于本地阅读的文本），自动带上
+  request_id / job_id / trace_id 等关联字段（contextvars，按请求 / 任务隔离）
+- LOG_LEVELS 按模块设置级别；LOG_SAMPLE_RATES 对高频模块的 DEBUG 日志按比例采样
+- 输出前脱敏：令牌、密码、API Key 等字段的值替换为 ***
+
+用法：
+    logger = logging.getLogger(__name__)
+    logger.info("Job %s requeued", job.id)
+    with log_context(job_id=job.id):
+        ...
+"""
+import atexit
+import contextvars
+import json
+import logging
+import logging.handlers
+import queue
+import random
+import re
+import sys
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Dict, Optional
+
+from app.config import settings
+
+# 关联字段
+_context: contextvars.ContextVar[Dict[str, str]] = contextvars.ContextVar("log_context", default={})
+
+
+@contextmanager
+def log_context(**fields):
+    """在当前请求 / 任务范围内为日志附加字段"""
+    token = _context.set({**_context.get(), **{k: str(v) for k, v in fields.items() if v is not None}})
+    try:
+        yield
+    finally:
+        _context.reset(token)
+
+
+def bind(**fields):
+    """为当前上下文（请求或后台任务）剩余部分附加字段"""
+    _context.set({**_context.get(), **{k: str(v) for k, v in fields.items() if v is not None}})
+
+
+# ---------- 脱敏 ----------
+
+_SECRET_KEYS = r"(?:access_token|refresh_token|id_token|token|client_secret|secret|password|api_key|x-api-key|authorization)"
+_REDACT_PATTERNS = [
+    # JSON / dict / 查询参数形式：key": "value"、'key': 'value'、key=value
+    (re.compile(r"""(["']?%s["']?\s*[:=]\s*["']?)([^"'&,\s}]+)""" % _SECRET_KEYS, re.IGNORECASE), r"\1***"),
+    (re.compile(r"(Bearer\s+)[A-Za-z0-9\-._~+/]+=*", re.IGNORECASE), r"\1***"),
+    # 裸 JWT
+    (re.compile(r"eyJ[A-Za-z0-9_-]{8,}\.[A-Za-z0-9_-]{8,}\.[A-Za-z0-9_-]+"), "***"),
+]
+
+
+def redact(text: str) -> str:
+    for pattern, replacement in _REDACT_PATTERNS:
+        text = pattern.sub(replacement, text)
+    return text
+
+
+# ---------- 格式化（后台线程执行） ----------
+
+_STANDARD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime", "context"}
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(record.created)) + f".{int(record.msecs):03d}Z",
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": redact(record.getMessage()),
+        }
+        entry.update(getattr(record, "context", None) or {})
+        for key, value in record.__dict__.items():
+            if key not in _STANDARD_ATTRS and not key.startswith("_"):
+                entry[key] = value if isinstance(value, (int, float, bool)) or value is None else redact(str(value))
+        if record.exc_text:
+            entry["exc"] = redact(record.exc_text)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    def __init__(self):
+        super().__init__("%(asctime)s %(levelname)-7s [%(name)s] %(message)s")
+
+    def format(self, record: logging.LogRecord) -> str:
+        line = redact(super().format(record))
+        context = getattr(record, "context", None)
+        if context:
+            line += " " + " ".join(f"{k}={v}" for k, v in context.items())
+        return line
+
+
+# ---------- 入队（调用方线程执行，尽量少做事） ----------
+
+class SamplingFilter(logging.Filter):
+    """DEBUG 日志按模块采样，LOG_SAMPLE_RATES = {"app.api.chat": 0.01}"""
+
+    def __init__(self, rates: Dict[str, float]):
+        super().__init__()
+        # 长前缀优先
+        self.rates = sorted(rates.items(), key=lambda item: -len(item[0]))
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno > logging.DEBUG:
+            return True
+        for prefix, rate in self.rates:
+            if record.name == prefix or record.name.startswith(prefix + "."):
+                return random.random() < rate
+        return True
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """队列满时丢弃而不是阻塞或抛错"""
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # 关联字段只能在调用方上下文中读取；参数先合并进消息（之后可能被修改），
+        # JSON 序列化和脱敏留给后台线程
+        record.context = _context.get()
+        if record.exc_info and not record.exc_text:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+        record.msg = record.getMessage()
+        record.args = None
+        record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+_listener: Optional[logging.handlers.QueueListener] = None
+_queue_handler: Optional[NonBlockingQueueHandler] = None
+
+
+def setup_logging():
+    """配置根日志器（重复调用无副作用）"""
+    global _listener, _queue_handler
+    if _listener is not None:
+        return
+
+    output = logging.StreamHandler(sys.stdout)
+    output.setFormatter(TextFormatter() if settings.LOG_FORMAT == "text" else JsonFormatter())
+
+    log_queue: queue.Queue = queue.Queue(maxsize=settings.LOG_QUEUE_SIZE)
+    _queue_handler = NonBlockingQueueHandler(log_queue)
+    _queue_handler.addFilter(SamplingFilter(settings.LOG_SAMPLE_RATES))
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(_queue_handler)
+    root.setLevel(settings.LOG_LEVEL.upper())
+    for name, level in settings.LOG_LEVELS.items():
+        logging.getLogger(name).setLevel(str(level).upper())
+
+    _listener = logging.handlers.QueueListener(log_queue, output, respect_handler_level=False)
+    _listener.start()
+    atexit.register(shutdown_logging)
+
+
+def shutdown_logging():
+    """停止后台线程并写完队列中剩余的日志"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def dropped_count() -> int:
+    return _queue_handler.dropped if _queue_handler else 0
+
+
+class RequestContextMiddleware:
+    """为每个 HTTP / WebSocket 请求生成 request_id（或沿用 X-Request-ID），并写回响应头"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] not in ("http", "websocket"):
+            return await self.app(scope, receive, send)
+
+        request_id = None
+        for name, value in scope["headers"]:
+            if name == b"x-request-id":
+                request_id = value.decode("latin-1")[:64]
+                break
+        request_id = request_id or uuid.uuid4().hex[:16]
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                message.setdefault("headers", [])
+                message["headers"] = list(message["headers"]) + [(b"x-request-id", request_id.encode())]
+            await send(message)
+
+        token = _context.set({"request_id": request_id})
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _context.reset(token)
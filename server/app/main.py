@@ -10,71 +10,84 @@ FastAPI 应用，提供：
 - 管理后台
 """
 import asyncio
-from datetime import datetime, timedelta
+import logging
 from contextlib import asynccontextmanager
 from fastapi import FastAPI
+from fastapi.responses import Response
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from sqlalchemy import select
 
 from app.config import settings
-from app.models import init_db
+from app.logs import setup_logging, shutdown_logging, RequestContextMiddleware
 from app.models.database import async_session
-from app.models.job import Job, JobStatus
+from app.migrations import prepare_database
+from app.services.admission import admission
+from app.services.reaper import reaper
+from app.services.events import bus, LeaderTask
+from app.services import job_events  # noqa: F401  注册任务事件订阅
 from app.api import api_router
+from app.api.ratelimit import RateLimitMiddleware
+from app.api.chat import manager as chat_manager
+from app.services.chat_store import chat_store
+from app.services.ratelimit import shared_store
+from app.services.chat_history import chat_history
+from app.services import metrics
+from app.services.tracing import exporter as trace_exporter
 
-
-async def cleanup_stale_jobs():
-    """定时清理超时任务（仅对 running 状态，从 started_at 计算 5 分钟）"""
-    while True:
-        try:
-            await asyncio.sleep(60)  # 每分钟检查一次
-            
-            async with async_session() as db:
-                timeout_threshold = datetime.utcnow() - timedelta(seconds=settings.JOB_TIMEOUT_SECONDS)
-                
-                # 只查找 running 状态且 started_at 超时的任务
-                # queued 状态的任务不设超时（排队等待是正常的）
-                result = await db.execute(
-                    select(Job).where(
-                        Job.status == JobStatus.RUNNING.value,
-                        Job.started_at.isnot(None),
-                        Job.started_at < timeout_threshold
-                    )
-                )
-                stale_jobs = result.scalars().all()
-                
-                for job in stale_jobs:
-                    job.status = JobStatus.FAILED.value
-                    job.error_message = "生成超时（5分钟），已自动取消"
-                    job.finished_at = datetime.utcnow()
-                    print(f"[Cleanup] Job {job.id} timed out (running for too long), marked as failed")
-                
-                if stale_jobs:
-                    await db.commit()
-                    print(f"[Cleanup] Cleaned up {len(stale_jobs)} stale running jobs")
-                    
-        except Exception as e:
-            print(f"[Cleanup] Error: {e}")
+# 日志在其他模块输出之前配置好（后台线程写出）
+setup_logging()
+logger = logging.getLogger("app.server")
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """应用生命周期"""
     # 启动时初始化数据库
-    print("[Server] Initializing database...")
-    await init_db()
-    print("[Server] Database initialized")
+    logger.info("Initializing database...")
+    # 多进程同时启动时由 migration_lock 串行化，见 app.migrations
+    applied = await prepare_database()
+    if applied:
+        logger.info("Applied migrations: %s", applied)
+    logger.info("Database initialized")
+    
+    # 准入控制计数需要在接收请求前从数据库加载
+    async with async_session() as db:
+        await admission.reconcile(db)
+    reconcile_task = asyncio.create_task(admission.run_reconciler())
+    
+    # 事件总线（多进程部署时同步聊天、任务事件）
+    await bus.start()
+    
+    # 聊天消息批量写入，最近记录加载到内存
+    chat_store.start()
+    async with async_session() as db:
+        await chat_history.warm(db)
+    presence_task = asyncio.create_task(chat_manager.sync_presence())
+    
+    # 任务链路导出（配置 OTLP_ENDPOINT 时）
+    trace_exporter.start()
     
-    # 启动后台清理任务
-    cleanup_task = asyncio.create_task(cleanup_stale_jobs())
-    print("[Server] Started stale job cleanup task")
+    # 超时回收只在主节点运行（按截止时间触发）
+    reaper_leader = LeaderTask("reaper", reaper.run)
+    leader_task = asyncio.create_task(reaper_leader.run())
+    logger.info("Started job reaper election")
     
     yield
     
     # 关闭时清理
-    cleanup_task.cancel()
-    print("[Server] Shutting down...")
+    leader_task.cancel()
+    reconcile_task.cancel()
+    presence_task.cancel()
+    # 等待任务真正退出（主节点在 finally 中释放租约），再关闭总线和共享存储
+    await asyncio.gather(leader_task, reconcile_task, presence_task, return_exceptions=True)
+    await chat_manager.shutdown()
+    await chat_store.stop()
+    await shared_store.close()
+    await trace_exporter.stop()
+    await bus.stop()
+    metrics.mark_process_dead()
+    logger.info("Shutting down...")
+    shutdown_logging()
 
 
 app = FastAPI(
@@ -84,6 +97,9 @@ app = FastAPI(
     lifespan=lifespan,
 )
 
+# API 限流（先注册，位于 CORS 内层，429 响应也带 CORS 头）
+app.add_middleware(RateLimitMiddleware)
+
 # CORS 配置
 app.add_middleware(
     CORSMiddleware,
@@ -93,6 +109,13 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# 请求耗时指标（最外层，包含限流与 CORS 的耗时）
+app.add_middleware(metrics.MetricsMiddleware)
+metrics.instrument_database()
+
+# 请求 ID（最外层，之后所有中间件和路由的日志都带 request_id）
+app.add_middleware(RequestContextMiddleware)
+
 # 注册 API 路由
 app.include_router(api_router, prefix="/api")
 
@@ -111,6 +134,12 @@ async def root():
     }
 
 
+@app.get("/metrics", include_in_schema=False)
+async def prometheus_metrics():
+    """Prometheus 指标（nginx 不转发 /metrics，只在内网抓取）"""
+    return Response(content=await metrics.render(), media_type=metrics.CONTENT_TYPE_LATEST)
+
+
 @app.get("/health")
 async def health_check():
     """健康检查"""
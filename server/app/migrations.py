@@ -0,0 +1,189 @@
+# -*- coding: utf-8 -*-
+"""
+轻量数据库迁移
+
+init_db() 只负责 create_all，无法给已存在的表补索引或改列。
+这里按版本号顺序执行迁移，已执行的版本记录在 schema_migrations 表中，
+每个迁移只会执行一次。迁移函数接收同步 Connection（通过 run_sync 调用），
+同时兼容 SQLite 与 PostgreSQL。
+
+多个 uvicorn 进程 / 多个节点同时启动时，建表和迁移在 migration_lock 下串行执行，
+后拿到锁的进程看到已记录的版本直接跳过。
+"""
+import asyncio
+from contextlib import asynccontextmanager
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, List, Optional, Tuple
+
+from sqlalchemy import Column, DateTime, Index, Integer, MetaData, String, Table, select, text
+from sqlalchemy.engine import Connection, make_url
+
+try:
+    import fcntl
+except ImportError:  # Windows 开发环境：单进程运行，不加锁
+    fcntl = None
+
+from app.config import settings
+
+from app.models.job import Job
+from app.models.user import User
+from app.models.chat import ChatMessage
+from app.services.quota import quota_ledger, current_day
+
+metadata = MetaData()
+
+schema_migrations = Table(
+    "schema_migrations",
+    metadata,
+    Column("version", Integer, primary_key=True),
+    Column("description", String(200), nullable=False),
+    Column("applied_at", DateTime, default=datetime.utcnow, nullable=False),
+)
+
+
+# ==================== Job 表索引 ====================
+#
+# 每个索引对应一组热点查询：
+# - ix_jobs_queue：         Worker 领取 (status=queued ORDER BY priority DESC, created_at)、队列长度统计
+# - ix_jobs_user_status：   create_job 的待处理任务检查 (user_id + status IN queued/running)
+# - ix_jobs_user_created：  我的作品 list_jobs、管理后台用户作品 (user_id ORDER BY created_at DESC)
+# - ix_jobs_status_started：超时清理 (status=running AND started_at < 阈值)
+# - ix_jobs_gallery：       画廊 (status=done AND is_public ORDER BY finished_at DESC)
+#
+# 注意：这里刻意不用部分索引（WHERE status='done'）。查询里的条件都是绑定参数
+# (status = ?)，SQLite 和 PostgreSQL 的通用计划都无法据此证明命中部分索引的谓词，
+# 把过滤列放在复合索引前缀上效果相同且一定能被使用。
+
+JOB_INDEXES = [
+    Index("ix_jobs_queue", Job.status, Job.priority.desc(), Job.created_at),
+    Index("ix_jobs_user_status", Job.user_id, Job.status),
+    Index("ix_jobs_user_created", Job.user_id, Job.created_at.desc()),
+    Index("ix_jobs_status_started", Job.status, Job.started_at),
+    Index("ix_jobs_gallery", Job.status, Job.is_public, Job.finished_at.desc()),
+]
+
+
+def _create_job_indexes(conn: Connection):
+    for index in JOB_INDEXES:
+        index.create(conn, checkfirst=True)
+
+
+def _analyze(conn: Connection):
+    """刷新统计信息，让查询规划器立即使用新索引"""
+    conn.exec_driver_sql("ANALYZE")
+
+
+def _create_quota_ledger(conn: Connection):
+    """创建配额账本，并把用户当前的 today_used_count 记为今天的用量"""
+    quota_ledger.create(conn, checkfirst=True)
+    rows = conn.execute(
+        select(User.id, User.today_used_count).where(User.today_used_count > 0)
+    ).all()
+    if rows:
+        day = current_day()
+        conn.execute(
+            quota_ledger.insert(),
+            [{"user_id": user_id, "day": day, "used": used} for user_id, used in rows],
+        )
+
+
+def _chat_message_bigint_id(conn: Connection):
+    """聊天消息改用进程内雪花 ID（63 位），PostgreSQL 的 INTEGER 放不下；SQLite 整数本身是 64 位"""
+    if conn.dialect.name == "postgresql":
+        conn.exec_driver_sql(f"ALTER TABLE {ChatMessage.__tablename__} ALTER COLUMN id TYPE BIGINT")
+
+
+# (版本号, 描述, 迁移函数)，只能追加，不能修改已发布的版本
+MIGRATIONS: List[Tuple[int, str, Callable[[Connection], None]]] = [
+    (1, "job composite indexes", _create_job_indexes),
+    (2, "analyze after index creation", _analyze),
+    (3, "quota ledger", _create_quota_ledger),
+    (4, "chat message bigint ids", _chat_message_bigint_id),
+]
+
+
+def _apply_pending(conn: Connection) -> List[int]:
+    metadata.create_all(conn, tables=[schema_migrations])
+    applied = set(conn.execute(select(schema_migrations.c.version)).scalars().all())
+
+    newly_applied = []
+    for version, description, migrate in MIGRATIONS:
+        if version in applied:
+            continue
+        migrate(conn)
+        conn.execute(
+            schema_migrations.insert().values(
+                version=version,
+                description=description,
+                applied_at=datetime.utcnow(),
+            )
+        )
+        newly_applied.append(version)
+    return newly_applied
+
+
+async def run_migrations() -> List[int]:
+    """执行所有未执行的迁移，返回本次执行的版本号"""
+    from app.models.database import async_session
+
+    async with async_session() as db:
+        conn = await db.connection()
+        applied = await conn.run_sync(_apply_pending)
+        await db.commit()
+        return applied
+
+
+# ==================== 启动互斥 ====================
+
+# PostgreSQL advisory lock 的键（任意固定值，"zimg"）
+MIGRATION_LOCK_KEY = 0x7A696D67
+
+
+def _sqlite_lock_path(url) -> Optional[Path]:
+    if not url.database or url.database == ":memory:":
+        return None
+    return Path(url.database + ".migrate.lock")
+
+
+@asynccontextmanager
+async def migration_lock():
+    """
+    建表和迁移的互斥锁
+
+    - PostgreSQL：会话级 advisory lock，跨节点有效，进程崩溃时随连接释放
+    - SQLite：数据库文件旁的锁文件（flock），同一台机器上的多个进程
+    """
+    url = make_url(settings.DATABASE_URL)
+    if url.get_backend_name() == "postgresql":
+        from app.models.database import async_session
+
+        async with async_session() as db:
+            await db.execute(text("SELECT pg_advisory_lock(:key)"), {"key": MIGRATION_LOCK_KEY})
+            try:
+                yield
+            finally:
+                await db.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": MIGRATION_LOCK_KEY})
+        return
+
+    lock_path = _sqlite_lock_path(url)
+    if lock_path is None or fcntl is None:
+        yield
+        return
+    lock_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(lock_path, "a") as f:
+        # 等锁期间不阻塞事件循环
+        await asyncio.to_thread(fcntl.flock, f.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+async def prepare_database() -> List[int]:
+    """启动时建表并执行迁移（持有 migration_lock），返回本次执行的版本号"""
+    from app.models import init_db
+
+    async with migration_lock():
+        await init_db()
+        return await run_migrations()
@@ -0,0 +1,2 @@
+# -*- coding: utf-8 -*-
+"""后台服务组件（内存状态、调度等，与具体路由无关）"""
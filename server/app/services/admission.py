@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+"""
+任务提交准入控制
+
+create_job 需要回答四个问题：是否有在线 Worker、用户是否有待处理任务、
+配额是否剩余、队列有多长。原来每次提交都要查 Worker 全表和多次 COUNT，
+这里改为维护内存计数：任务状态变化、Worker 心跳时同步更新，
+后台定期用数据库结果校准（修正多进程、异常路径造成的漂移）。
+
+配额不在这里计数：提交时由 app.services.quota.reserve 在账本表中原子预占。
+"""
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from typing import Dict, Optional
+
+from sqlalchemy import select, func
+
+from app.config import settings
+from app.models import Job, JobStatus, Worker, WorkerStatus
+
+logger = logging.getLogger(__name__)
+
+# 占用"待处理"名额的状态
+ACTIVE_STATUSES = (JobStatus.QUEUED.value, JobStatus.RUNNING.value)
+
+
+class AdmissionController:
+    def __init__(self):
+        # worker_id -> 最近心跳时间（离线状态的 Worker 不在表中）
+        self.worker_last_seen: Dict[str, datetime] = {}
+        # user_id -> queued/running 任务数
+        self.pending_by_user: Dict[int, int] = {}
+        self.queue_length = 0
+        self.reconciled_at: Optional[datetime] = None
+
+    # ---------- 查询 ----------
+
+    def online_worker_count(self) -> int:
+        threshold = datetime.utcnow() - timedelta(seconds=settings.WORKER_HEARTBEAT_TIMEOUT)
+        return sum(1 for seen in self.worker_last_seen.values() if seen >= threshold)
+
+    def workers_online(self) -> bool:
+        return self.online_worker_count() > 0
+
+    def has_pending(self, user_id: int) -> bool:
+        return self.pending_by_user.get(user_id, 0) > 0
+
+    # ---------- 增量更新 ----------
+
+    def on_worker_seen(self, worker_id: str, status: str, seen_at: Optional[datetime] = None):
+        if status == WorkerStatus.OFFLINE.value:
+            self.worker_last_seen.pop(worker_id, None)
+        else:
+            self.worker_last_seen[worker_id] = seen_at or datetime.utcnow()
+
+    def on_worker_removed(self, worker_id: str):
+        self.worker_last_seen.pop(worker_id, None)
+
+    def on_job_transition(self, user_id: int, old_status: Optional[str], new_status: Optional[str]):
+        """任务状态变化（old_status=None 表示新建，new_status=None 表示撤销新建）"""
+        if old_status == new_status:
+            return
+
+        if old_status in ACTIVE_STATUSES:
+            remaining = self.pending_by_user.get(user_id, 0) - 1
+            if remaining > 0:
+                self.pending_by_user[user_id] = remaining
+            else:
+                self.pending_by_user.pop(user_id, None)
+        if old_status == JobStatus.QUEUED.value:
+            self.queue_length = max(0, self.queue_length - 1)
+
+        if new_status in ACTIVE_STATUSES:
+            self.pending_by_user[user_id] = self.pending_by_user.get(user_id, 0) + 1
+        if new_status == JobStatus.QUEUED.value:
+            self.queue_length += 1
+
+    # ---------- 校准 ----------
+
+    async def reconcile(self, db):
+        """用数据库状态覆盖内存计数（全部走索引：Worker 表很小，其余为 status 前缀的 COUNT）"""
+        workers = (await db.execute(select(Worker.id, Worker.status, Worker.last_seen_at))).all()
+        pending = (await db.execute(
+            select(Job.user_id, func.count(Job.id))
+            .where(Job.status.in_(ACTIVE_STATUSES))
+            .group_by(Job.user_id)
+        )).all()
+        queue_length = await db.scalar(
+            select(func.count(Job.id)).where(Job.status == JobStatus.QUEUED.value)
+        )
+
+        self.worker_last_seen = {
+            worker_id: last_seen_at
+            for worker_id, status, last_seen_at in workers
+            if last_seen_at and status != WorkerStatus.OFFLINE.value
+        }
+        self.pending_by_user = {user_id: count for user_id, count in pending}
+        self.queue_length = queue_length or 0
+        self.reconciled_at = datetime.utcnow()
+
+    async def run_reconciler(self):
+        """后台定期校准"""
+        from app.models.database import async_session
+
+        while True:
+            await asyncio.sleep(settings.ADMISSION_RECONCILE_SECONDS)
+            try:
+                async with async_session() as db:
+                    await self.reconcile(db)
+            except Exception as e:
+                logger.warning("Reconcile error: %s", e)
+
+
+admission = AdmissionController()
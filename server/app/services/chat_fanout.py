@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+"""
+聊天消息扇出
+
+每个 WebSocket 连接有一个有界发送队列和独立的写协程：
+- 广播只把预先序列化好的文本放进各连接的队列，不等待任何 socket，
+  慢客户端不会拖慢整个房间，也不会阻塞连接/断开
+- 队列满时按 CHAT_SLOW_CONSUMER_POLICY 处理：
+  drop_oldest 丢弃最旧的一条；disconnect 直接断开该连接
+"""
+import asyncio
+import json
+from typing import Callable, Optional, Set
+
+from fastapi import WebSocket
+
+from app.config import settings
+
+# 关闭 socket 的后台任务：连接对象随后就被移除，这里持有引用，避免任务在完成前被回收
+_closing: Set[asyncio.Task] = set()
+
+
+def serialize(message: dict) -> str:
+    """与 WebSocket.send_json 相同的序列化格式"""
+    return json.dumps(message, separators=(",", ":"), ensure_ascii=False)
+
+
+class ChatConnection:
+    def __init__(self, websocket: WebSocket, user_info: dict, on_dead: Callable[["ChatConnection"], None]):
+        self.websocket = websocket
+        self.user_info = user_info
+        self.is_admin = bool(user_info.get('is_admin'))
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=settings.CHAT_SEND_QUEUE_SIZE)
+        self.dropped = 0
+        self.closed = False
+        self._on_dead = on_dead
+        self._writer: Optional[asyncio.Task] = None
+
+    def start(self):
+        self._writer = asyncio.create_task(self._write_loop())
+
+    def send(self, text: str):
+        """非阻塞入队"""
+        if self.closed:
+            return
+        try:
+            self.queue.put_nowait(text)
+            return
+        except asyncio.QueueFull:
+            pass
+
+        if settings.CHAT_SLOW_CONSUMER_POLICY == "disconnect":
+            self.close(code=1008)
+            return
+        # drop_oldest：丢掉最旧的一条，保证最新消息能送达
+        try:
+            self.queue.get_nowait()
+            self.dropped += 1
+        except asyncio.QueueEmpty:
+            pass
+        self.queue.put_nowait(text)
+
+    async def _write_loop(self):
+        try:
+            while True:
+                text = await self.queue.get()
+                await asyncio.wait_for(self.websocket.send_text(text), settings.CHAT_SEND_TIMEOUT_SECONDS)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            # 发送失败或超时视为断开
+            self.close()
+
+    def stop(self):
+        """客户端已断开：停止写协程，不再关闭 socket"""
+        self.closed = True
+        if self._writer:
+            self._writer.cancel()
+
+    def close(self, code: int = 1000):
+        if self.closed:
+            return
+        self.closed = True
+        if self._writer and self._writer is not asyncio.current_task():
+            self._writer.cancel()
+        self._on_dead(self)
+        task = asyncio.create_task(self._close_socket(code))
+        _closing.add(task)
+        task.add_done_callback(_closing.discard)
+
+    async def _close_socket(self, code: int):
+        try:
+            await self.websocket.close(code=code)
+        except Exception:
+            pass
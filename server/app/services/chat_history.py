@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+"""
+最近聊天记录的内存环形缓冲
+
+启动时从数据库加载最近 CHAT_HISTORY_SIZE 条消息和活动日志，之后随
+发送 / 删除事件（经事件总线，所有进程一致）增量更新。
+/api/chat/messages 与管理员初始化帧直接读缓冲区，响应 JSON 按 (是否管理员, limit)
+缓存，内容变化时整体失效。超出缓冲区的更早记录按 before_id 游标查询数据库。
+"""
+import json
+from collections import deque
+from typing import Dict, Optional, Tuple
+
+from sqlalchemy import select, desc
+
+from app.config import settings
+from app.models.chat import ChatMessage, ChatActivityLog
+
+
+def message_row(msg_id: int, user_id: Optional[int], display_name: str, content: str, timestamp: str) -> dict:
+    # 雪花 ID 超过 JavaScript 的安全整数（2^53），对外一律用字符串，前端按字符串比较、回传
+    return {
+        'id': str(msg_id),
+        'user_id': user_id,
+        'display_name': display_name,
+        'content': content,
+        'timestamp': timestamp,
+    }
+
+
+def public_message(row: dict) -> dict:
+    """普通用户看到的字段（不含 user_id）"""
+    return {
+        'id': row['id'],
+        'display_name': row['display_name'],
+        'content': row['content'],
+        'timestamp': row['timestamp'],
+    }
+
+
+class ChatHistory:
+    def __init__(self, message_capacity: int = None, activity_capacity: int = None):
+        self.messages: deque = deque(maxlen=message_capacity or settings.CHAT_HISTORY_SIZE)
+        self.activity: deque = deque(maxlen=activity_capacity or settings.CHAT_HISTORY_SIZE)
+        # 数据库中的消息全部在缓冲区内（消息总数不超过容量）
+        self.complete = False
+        self._responses: Dict[Tuple[bool, int], bytes] = {}
+
+    # ---------- 加载 ----------
+
+    async def warm(self, db):
+        capacity = self.messages.maxlen
+        result = await db.execute(
+            select(ChatMessage).order_by(desc(ChatMessage.id)).limit(capacity)
+        )
+        rows = result.scalars().all()
+        self.messages.clear()
+        for msg in reversed(rows):
+            self.messages.append(message_row(msg.id, msg.user_id, msg.display_name, msg.content, msg.created_at.isoformat()))
+        self.complete = len(rows) < capacity
+
+        result = await db.execute(
+            select(ChatActivityLog).order_by(desc(ChatActivityLog.created_at)).limit(self.activity.maxlen)
+        )
+        self.activity.clear()
+        for log in reversed(result.scalars().all()):
+            self.activity.append({
+                'type': log.activity_type,
+                'display_name': log.display_name,
+                'username': log.username,
+                'timestamp': log.created_at.isoformat(),
+            })
+        self._responses.clear()
+
+    # ---------- 增量更新 ----------
+
+    def apply(self, change: dict):
+        """处理广播事件附带的历史变更"""
+        if 'message' in change:
+            if len(self.messages) == self.messages.maxlen:
+                self.complete = False
+            self.messages.append(change['message'])
+        if 'activity' in change:
+            self.activity.append(change['activity'])
+        if 'delete' in change:
+            message_id = str(change['delete'])
+            for row in self.messages:
+                if row['id'] == message_id:
+                    self.messages.remove(row)
+                    break
+        if 'message' in change or 'delete' in change:
+            self._responses.clear()
+
+    # ---------- 读取 ----------
+
+    def can_serve(self, limit: int) -> bool:
+        return self.complete or limit <= len(self.messages)
+
+    def messages_response(self, limit: int, include_user_id: bool) -> bytes:
+        """最近 limit 条消息的 JSON 响应体（调用前先检查 can_serve）"""
+        key = (include_user_id, limit)
+        body = self._responses.get(key)
+        if body is None:
+            rows = list(self.messages)[-limit:]
+            if not include_user_id:
+                rows = [public_message(row) for row in rows]
+            oldest = rows[0]['id'] if rows else None
+            body = json.dumps(
+                {'messages': rows, 'next_before_id': None if self.complete and len(rows) == len(self.messages) else oldest},
+                separators=(",", ":"),
+                ensure_ascii=False,
+            ).encode()
+            self._responses[key] = body
+        return body
+
+    def activity_logs(self, limit: int) -> list:
+        return list(self.activity)[-limit:]
+
+
+chat_history = ChatHistory()
@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+"""
+聊天消息限流
+
+每条消息要同时通过两个令牌桶：
+- 连接桶（进程内）：CHAT_RATE_PER_CONNECTION 条/秒，容量 CHAT_BURST_PER_CONNECTION
+- 用户桶（登录用户按 user_id，游客按 IP；RATE_LIMIT_STORAGE_URL 为 Redis 时跨进程共享）：
+  CHAT_RATE_PER_USER 条/秒，容量 CHAT_BURST_PER_USER
+
+超出限制的消息不直接丢弃，而是合并成一条（换行拼接，不超过 CHAT_COALESCE_MAX_CHARS），
+等令牌补充后一次发出；超出限制的每条消息记一次违规，合并消息发出前连续违规超过
+CHAT_RATE_MAX_STRIKES 次关闭连接（1008）。
+"""
+import asyncio
+import logging
+from typing import Awaitable, Callable, Dict, Optional
+
+from app.config import settings
+from app.services import metrics
+from app.services.ratelimit import MemoryStore, shared_store
+
+logger = logging.getLogger(__name__)
+
+
+class ChatLimiter:
+    def __init__(self, store=None):
+        self.local = MemoryStore()
+        self.store = store or shared_store
+        # 本进程计数（/admin/chat/rate-limit 输出，同时计入 Prometheus 指标）
+        self.stats: Dict[str, int] = {"allowed": 0, "limited": 0, "coalesced": 0, "dropped": 0, "closed": 0}
+
+    async def acquire(self, conn_key: str, user_key: str) -> float:
+        """两个桶都放行返回 0，否则返回需要等待的秒数"""
+        wait = self.local.hit_now(f"conn:{conn_key}", settings.CHAT_RATE_PER_CONNECTION, settings.CHAT_BURST_PER_CONNECTION)
+        if wait:
+            return wait
+        return await self.store.hit(f"chat:{user_key}", settings.CHAT_RATE_PER_USER, settings.CHAT_BURST_PER_USER)
+
+    def count(self, outcome: str):
+        self.stats[outcome] += 1
+        metrics.CHAT_RATE_LIMIT.labels(outcome).inc()
+
+    def forget(self, conn_key: str):
+        self.local.reset(f"conn:{conn_key}")
+
+
+chat_limiter = ChatLimiter()
+
+
+class MessageThrottle:
+    """
+    单个连接的发送节流
+
+    publish 负责真正发送一条消息；notify 在开始限流时通知发送者（等待秒数）；
+    close 在连续违规过多时关闭连接。
+    """
+
+    def __init__(
+        self,
+        conn_key: str,
+        user_key: str,
+        publish: Callable[[str], Awaitable[None]],
+        notify: Callable[[float], None],
+        close: Callable[[], None],
+    ):
+        self.conn_key = conn_key
+        self.user_key = user_key
+        self._publish = publish
+        self._notify = notify
+        self._close = close
+        self.strikes = 0
+        self._held: Optional[str] = None
+        self._flusher: Optional[asyncio.Task] = None
+
+    async def submit(self, content: str) -> bool:
+        """提交一条消息，返回 False 表示连接因违规被关闭"""
+        if self._held is None:
+            wait = await chat_limiter.acquire(self.conn_key, self.user_key)
+            if not wait:
+                self.strikes = 0
+                chat_limiter.count("allowed")
+                await self._publish(content)
+                return True
+        else:
+            wait = None
+        return self._hold(content, wait)
+
+    def _hold(self, content: str, wait: Optional[float]) -> bool:
+        chat_limiter.count("limited")
+        self.strikes += 1
+        if self.strikes > settings.CHAT_RATE_MAX_STRIKES:
+            chat_limiter.count("closed")
+            self._close()
+            return False
+
+        if self._held is None:
+            self._held = content
+            self._notify(wait)
+            self._flusher = asyncio.create_task(self._flush_later(wait))
+        elif len(self._held) + 1 + len(content) <= settings.CHAT_COALESCE_MAX_CHARS:
+            self._held = f"{self._held}\n{content}"
+            chat_limiter.count("coalesced")
+        else:
+            chat_limiter.count("dropped")
+        return True
+
+    async def _flush_later(self, wait: float):
+        """等到有令牌后把合并的消息作为一条发出"""
+        while True:
+            await asyncio.sleep(wait)
+            wait = await chat_limiter.acquire(self.conn_key, self.user_key)
+            if not wait:
+                break
+        content, self._held = self._held, None
+        self._flusher = None
+        self.strikes = 0
+        chat_limiter.count("allowed")
+        try:
+            await self._publish(content)
+        except Exception as e:
+            logger.warning("Failed to send coalesced message: %s", e)
+
+    def stop(self):
+        """连接结束：丢弃未发出的合并消息"""
+        if self._flusher:
+            self._flusher.cancel()
+        chat_limiter.forget(self.conn_key)
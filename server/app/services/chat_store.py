@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-
+"""
+聊天消息 / 活动日志的批量延迟写入
+
+消息 ID 在进程内生成（雪花算法：41 位毫秒时间戳 + 10 位节点号 + 12 位序号），
+广播不再等待数据库提交。缓冲区每 CHAT_FLUSH_INTERVAL_MS 毫秒或攒够
+CHAT_FLUSH_MAX_ROWS 行时批量 INSERT 一次，进程退出时写完剩余数据。
+
+写入失败时数据放回缓冲区，按失败次数退避重试；连续失败 CHAT_FLUSH_MAX_RETRIES 次后逐行写入，
+仍然失败的行（数据不合法、主键冲突等）记录到错误日志后丢弃，不会让一行坏数据阻塞整个进程的写入。
+"""
+import asyncio
+import logging
+import os
+import socket
+import threading
+import time
+import zlib
+from datetime import datetime
+from typing import List, Optional, Tuple
+
+from sqlalchemy import insert
+
+from app.config import settings
+from app.models.chat import ChatMessage, ChatActivityLog
+from app.services import metrics
+
+logger = logging.getLogger(__name__)
+
+# 2024-01-01 00:00:00 UTC
+SNOWFLAKE_EPOCH_MS = 1704067200000
+
+
+class SnowflakeGenerator:
+    """按时间递增的 63 位 ID，多进程通过节点号区分"""
+
+    def __init__(self, node_id: int):
+        self.node_id = node_id & 0x3FF
+        self._last_ms = -1
+        self._sequence = 0
+        self._lock = threading.Lock()
+
+    def next_id(self) -> int:
+        with self._lock:
+            now_ms = int(time.time() * 1000)
+            if now_ms < self._last_ms:
+                # 时钟回拨：沿用上一毫秒继续分配
+                now_ms = self._last_ms
+            if now_ms == self._last_ms:
+                self._sequence = (self._sequence + 1) & 0xFFF
+                if self._sequence == 0:
+                    # 同一毫秒序号用完，等到下一毫秒
+                    while now_ms <= self._last_ms:
+                        now_ms = int(time.time() * 1000)
+            else:
+                self._sequence = 0
+            self._last_ms = now_ms
+            return ((now_ms - SNOWFLAKE_EPOCH_MS) << 22) | (self.node_id << 12) | self._sequence
+
+
+def _default_node_id() -> int:
+    """
+    同一主机上的进程按 PID 区分（同时存活的 uvicorn 进程 PID 通常相邻，取低 10 位后不会重复）；
+    主机名哈希只用来错开不同主机，多台主机部署时用 CHAT_ID_NODE 显式分配
+    """
+    if settings.CHAT_ID_NODE >= 0:
+        return settings.CHAT_ID_NODE
+    return zlib.crc32(socket.gethostname().encode()) + os.getpid()
+
+
+class ChatWriteBehind:
+    def __init__(self):
+        self.ids = SnowflakeGenerator(_default_node_id())
+        self._messages: List[dict] = []
+        self._activity: List[dict] = []
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = False
+        self._flush_lock = asyncio.Lock()
+        # 连续批量写入失败次数
+        self._failures = 0
+
+    @property
+    def pending(self) -> int:
+        return len(self._messages) + len(self._activity)
+
+    def add_message(self, user_id: Optional[int], display_name: str, content: str) -> Tuple[int, datetime]:
+        """登记一条消息，立即返回 (ID, 创建时间)"""
+        row = {
+            "id": self.ids.next_id(),
+            "user_id": user_id,
+            "display_name": display_name,
+            "content": content,
+            "created_at": datetime.utcnow(),
+        }
+        self._messages.append(row)
+        self._maybe_wake()
+        return row["id"], row["created_at"]
+
+    def add_activity(self, user_id: Optional[int], username: Optional[str], display_name: str, activity_type: str) -> datetime:
+        created_at = datetime.utcnow()
+        self._activity.append({
+            "user_id": user_id,
+            "username": username,
+            "display_name": display_name,
+            "activity_type": activity_type,
+            "created_at": created_at,
+        })
+        self._maybe_wake()
+        return created_at
+
+    def discard_message(self, message_id: int) -> bool:
+        """删除尚未写入数据库的消息，找到返回 True"""
+        for i, row in enumerate(self._messages):
+            if row["id"] == message_id:
+                del self._messages[i]
+                return True
+        return False
+
+    def _maybe_wake(self):
+        # 失败退避期间不提前唤醒
+        if self.pending >= settings.CHAT_FLUSH_MAX_ROWS and not self._failures:
+            self._wakeup.set()
+
+    async def _insert(self, batches):
+        """batches: [(模型, 行列表)]，同一事务写入"""
+        from app.models.database import async_session
+
+        async with async_session() as db:
+            for model, rows in batches:
+                if rows:
+                    await db.execute(insert(model), rows)
+            await db.commit()
+
+    async def _insert_rows(self, batches):
+        """逐行写入，失败的行记录日志后丢弃"""
+        for model, rows in batches:
+            for row in rows:
+                try:
+                    await self._insert([(model, [row])])
+                except Exception as e:
+                    metrics.CHAT_DROPPED_ROWS.labels(model.__tablename__).inc()
+                    logger.error("Dropped %s row %r: %s", model.__tablename__, row, e)
+
+    async def flush(self, final: bool = False):
+        """
+        把当前缓冲区写入数据库
+
+        失败时放回缓冲区下次重试；连续失败 CHAT_FLUSH_MAX_RETRIES 次（或 final）时改为逐行写入
+        """
+        async with self._flush_lock:
+            messages, self._messages = self._messages, []
+            activity, self._activity = self._activity, []
+            if not messages and not activity:
+                return
+            batches = [(ChatMessage, messages), (ChatActivityLog, activity)]
+            try:
+                await self._insert(batches)
+                self._failures = 0
+                return
+            except Exception as e:
+                self._failures += 1
+                if not final and self._failures < settings.CHAT_FLUSH_MAX_RETRIES:
+                    self._messages[:0] = messages
+                    self._activity[:0] = activity
+                    logger.error(
+                        "Flush failed (%d messages, %d logs, attempt %d/%d): %s",
+                        len(messages), len(activity), self._failures, settings.CHAT_FLUSH_MAX_RETRIES, e,
+                    )
+                    return
+                logger.error("Flush failed %d times, writing %d messages, %d logs row by row: %s",
+                             self._failures, len(messages), len(activity), e)
+            self._failures = 0
+            await self._insert_rows(batches)
+
+    async def _run(self):
+        interval = settings.CHAT_FLUSH_INTERVAL_MS / 1000
+        while not self._stopping:
+            # 写入失败后按失败次数指数退避，数据库故障期间不必每个周期都重试
+            delay = min(interval * 2 ** self._failures, 30.0)
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), delay)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """停止后台写入并写完剩余数据（不取消进行中的写入，避免丢数据）"""
+        self._stopping = True
+        self._wakeup.set()
+        if self._task:
+            await self._task
+        await self.flush(final=True)
+
+
+chat_store = ChatWriteBehind()
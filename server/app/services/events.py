@@ -0,0 +1,212 @@
+# -*- coding: utf-8 -*-
+"""
+进程间事件总线与主节点选举
+
+聊天广播、任务状态事件、缓存失效都通过总线发布，每个进程订阅后在本地处理，
+这样可以运行多个 uvicorn 进程 / 多台主机而不拆分聊天室、不丢计数。
+
+- EVENT_BUS_URL 为空：进程内总线（单进程部署，行为与原来一致）
+- EVENT_BUS_URL=redis://...：Redis Pub/Sub（需要安装 redis 包，测试可用 fakeredis）
+
+publish() 先在本进程同步执行处理函数，再发给其他进程；收到自己发出的消息会忽略，
+因此调用方返回时本地状态已经更新。
+
+后台单例任务（超时回收等）只在主节点运行：Redis 模式下用 SET NX PX 租约选主，
+进程内模式下当前进程始终是主节点。
+"""
+import asyncio
+import json
+import logging
+import os
+import socket
+import uuid
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+Handler = Callable[[dict], Awaitable[None]]
+
+NODE_ID = f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+
+# 频道
+CHAT = "chat"
+JOBS = "jobs"
+CACHE = "cache"
+
+
+class InProcessBus:
+    """单进程总线：只在本地分发"""
+
+    def __init__(self):
+        self._handlers: Dict[str, List[Handler]] = {}
+
+    def subscribe(self, channel: str, handler: Handler):
+        self._handlers.setdefault(channel, []).append(handler)
+
+    async def _dispatch(self, channel: str, payload: dict):
+        for handler in self._handlers.get(channel, []):
+            try:
+                await handler(payload)
+            except Exception as e:
+                logger.exception("Handler error on %s: %s", channel, e)
+
+    async def publish(self, channel: str, payload: dict):
+        await self._dispatch(channel, payload)
+
+    async def start(self):
+        pass
+
+    async def stop(self):
+        pass
+
+    async def try_acquire_lease(self, name: str, ttl_seconds: int) -> bool:
+        return True
+
+    async def release_lease(self, name: str):
+        pass
+
+
+class RedisBus(InProcessBus):
+    """Redis Pub/Sub 总线"""
+
+    # 续约：只有持有者才能延长租约
+    _RENEW_SCRIPT = """
+    if redis.call('get', KEYS[1]) == ARGV[1] then
+        return redis.call('pexpire', KEYS[1], ARGV[2])
+    end
+    return 0
+    """
+    _RELEASE_SCRIPT = """
+    if redis.call('get', KEYS[1]) == ARGV[1] then
+        return redis.call('del', KEYS[1])
+    end
+    return 0
+    """
+
+    def __init__(self, url: str, client=None):
+        super().__init__()
+        self.url = url
+        self.prefix = settings.EVENT_BUS_PREFIX
+        self._client = client
+        self._pubsub = None
+        self._listener: Optional[asyncio.Task] = None
+
+    @property
+    def client(self):
+        if self._client is None:
+            import redis.asyncio as redis
+            self._client = redis.from_url(self.url, decode_responses=True)
+        return self._client
+
+    def _channel(self, channel: str) -> str:
+        return f"{self.prefix}:{channel}"
+
+    async def publish(self, channel: str, payload: dict):
+        await self._dispatch(channel, payload)
+        message = json.dumps({"origin": NODE_ID, "payload": payload}, ensure_ascii=False, default=str)
+        await self.client.publish(self._channel(channel), message)
+
+    async def start(self):
+        self._pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+        await self._pubsub.subscribe(*(self._channel(c) for c in self._handlers))
+        self._listener = asyncio.create_task(self._listen())
+
+    async def _listen(self):
+        strip = len(self.prefix) + 1
+        while True:
+            try:
+                async for message in self._pubsub.listen():
+                    data = json.loads(message["data"])
+                    if data.get("origin") == NODE_ID:
+                        continue
+                    await self._dispatch(message["channel"][strip:], data["payload"])
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error("Listener error: %s, reconnecting", e)
+                await asyncio.sleep(1)
+
+    async def stop(self):
+        if self._listener:
+            self._listener.cancel()
+        if self._pubsub:
+            await self._pubsub.close()
+        await self.client.aclose()
+
+    async def try_acquire_lease(self, name: str, ttl_seconds: int) -> bool:
+        key = f"{self.prefix}:lease:{name}"
+        ttl_ms = ttl_seconds * 1000
+        if await self.client.set(key, NODE_ID, nx=True, px=ttl_ms):
+            return True
+        return bool(await self.client.eval(self._RENEW_SCRIPT, 1, key, NODE_ID, ttl_ms))
+
+    async def release_lease(self, name: str):
+        await self.client.eval(self._RELEASE_SCRIPT, 1, f"{self.prefix}:lease:{name}", NODE_ID)
+
+
+def create_bus(url: str):
+    if url.startswith(("redis://", "rediss://", "unix://")):
+        return RedisBus(url)
+    return InProcessBus()
+
+
+bus = create_bus(settings.EVENT_BUS_URL)
+
+
+def on_invalidate(name: str, callback: Callable[[dict], None]):
+    """注册缓存失效回调：任一进程调用 invalidate(name) 时所有进程都会执行"""
+    async def handler(payload: dict):
+        if payload.get("name") == name:
+            callback(payload)
+    bus.subscribe(CACHE, handler)
+
+
+async def invalidate(name: str, **details):
+    await bus.publish(CACHE, {"name": name, **details})
+
+
+class LeaderTask:
+    """
+    只在主节点运行的后台任务
+
+    每 ttl/3 秒尝试获取/续约租约；成为主节点时启动 factory() 创建的任务，
+    失去租约时取消。
+    """
+
+    def __init__(self, name: str, factory: Callable[[], Awaitable[None]], ttl_seconds: int = None):
+        self.name = name
+        self.factory = factory
+        self.ttl_seconds = ttl_seconds or settings.LEADER_LEASE_SECONDS
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def is_leader(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    async def run(self):
+        try:
+            while True:
+                try:
+                    acquired = await bus.try_acquire_lease(self.name, self.ttl_seconds)
+                except Exception as e:
+                    logger.warning("Lease error for %s: %s", self.name, e)
+                    acquired = False
+
+                if acquired and not self.is_leader:
+                    logger.info("%s is now leader for %s", NODE_ID, self.name)
+                    self._task = asyncio.create_task(self.factory())
+                elif not acquired and self.is_leader:
+                    logger.warning("%s lost leadership for %s", NODE_ID, self.name)
+                    self._task.cancel()
+                    self._task = None
+
+                await asyncio.sleep(self.ttl_seconds / 3)
+        finally:
+            if self._task:
+                self._task.cancel()
+                try:
+                    await bus.release_lease(self.name)
+                except Exception:
+                    pass
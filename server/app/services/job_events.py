@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+"""
+任务 / Worker 状态事件
+
+路由和后台任务通过这里发布状态变化，每个进程收到后更新自己的
+准入计数（admission）和超时调度（reaper，只有主节点维护截止时间堆）。
+"""
+from datetime import datetime
+from typing import Optional
+
+from app.services.events import bus, JOBS, NODE_ID
+from app.services.admission import admission
+from app.services.reaper import reaper
+from app.services import metrics
+
+
+def _ts(value: Optional[datetime]) -> Optional[str]:
+    return value.isoformat() if value else None
+
+
+def _dt(value: Optional[str]) -> Optional[datetime]:
+    return datetime.fromisoformat(value) if value else None
+
+
+async def job_transition(user_id: int, old_status: Optional[str], new_status: Optional[str], applied: bool = False):
+    """
+    发布任务状态变化，调用方应在事务提交之后调用
+
+    applied=True 表示本进程已提前同步更新过准入计数（见 create_job），本地分发时不再重复计数
+    """
+    # 只在发布进程计数，避免多进程重复
+    metrics.job_transition(old_status, new_status)
+    event = {"type": "transition", "user_id": user_id, "old": old_status, "new": new_status}
+    if applied:
+        event["applied_by"] = NODE_ID
+    await bus.publish(JOBS, event)
+
+
+async def job_started(job_id: str, started_at: datetime):
+    await bus.publish(JOBS, {"type": "started", "job_id": job_id, "started_at": _ts(started_at)})
+
+
+async def job_finished(job_id: str):
+    await bus.publish(JOBS, {"type": "finished", "job_id": job_id})
+
+
+async def job_requeued(job_id: str, lost_by: Optional[str]):
+    await bus.publish(JOBS, {"type": "requeued", "job_id": job_id, "worker_id": lost_by})
+
+
+async def worker_seen(worker_id: str, status: str, seen_at: datetime):
+    await bus.publish(JOBS, {"type": "worker_seen", "worker_id": worker_id, "status": status, "seen_at": _ts(seen_at)})
+
+
+async def worker_removed(worker_id: str):
+    await bus.publish(JOBS, {"type": "worker_removed", "worker_id": worker_id})
+
+
+async def _on_event(event: dict):
+    kind = event["type"]
+    if kind == "transition":
+        if event.get("applied_by") != NODE_ID:
+            admission.on_job_transition(event["user_id"], event["old"], event["new"])
+    elif kind == "started":
+        reaper.track_job(event["job_id"], _dt(event["started_at"]))
+    elif kind == "finished":
+        reaper.finish_job(event["job_id"])
+    elif kind == "requeued":
+        reaper.requeued(event["job_id"], event["worker_id"])
+    elif kind == "worker_seen":
+        seen_at = _dt(event["seen_at"])
+        admission.on_worker_seen(event["worker_id"], event["status"], seen_at)
+        reaper.worker_seen(event["worker_id"], seen_at)
+    elif kind == "worker_removed":
+        admission.on_worker_removed(event["worker_id"])
+        reaper.worker_removed(event["worker_id"])
+
+
+bus.subscribe(JOBS, _on_event)
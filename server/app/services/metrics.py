@@ -0,0 +1,228 @@
+# -*- coding: utf-8 -*-
+"""
+Prometheus 指标
+
+热路径上只做计数器加一 / 直方图观测（内存中的浮点累加），不访问数据库；
+队列长度、Worker 利用率等需要查库的指标在 /metrics 被抓取时才计算。
+
+多进程部署（uvicorn --workers N）时设置 PROMETHEUS_MULTIPROC_DIR，
+各进程把指标写入该目录下的 mmap 文件，/metrics 汇总所有进程（目录需在启动前清空）。
+"""
+import logging
+import os
+import time
+from datetime import datetime
+from typing import Optional
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+from sqlalchemy import event, func, select
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger(__name__)
+
+MULTIPROCESS = "PROMETHEUS_MULTIPROC_DIR" in os.environ
+
+# 生成耗时以秒到分钟计
+_JOB_BUCKETS = (1, 2, 5, 10, 20, 30, 60, 120, 300, 600, 1800, 3600)
+
+# ---------- HTTP ----------
+
+HTTP_REQUEST_SECONDS = Histogram(
+    "zimage_http_request_duration_seconds", "HTTP 请求耗时", ["method", "route", "status"],
+)
+
+# ---------- 数据库 ----------
+
+DB_QUERY_SECONDS = Histogram(
+    "zimage_db_query_duration_seconds", "SQL 语句执行耗时", ["operation"],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5),
+)
+
+# ---------- 任务 ----------
+
+JOB_TRANSITIONS = Counter("zimage_job_transitions_total", "任务状态变化", ["from_status", "to_status"])
+JOB_QUEUE_SECONDS = Histogram("zimage_job_queue_seconds", "任务从提交到被领取的时间", buckets=_JOB_BUCKETS)
+JOB_COMPLETE_SECONDS = Histogram(
+    "zimage_job_complete_seconds", "任务从提交到结束的时间", ["status"], buckets=_JOB_BUCKETS,
+)
+JOB_GENERATION_SECONDS = Histogram("zimage_job_generation_seconds", "任务从领取到结束的时间", ["status"], buckets=_JOB_BUCKETS)
+JOB_UPLOAD_BYTES = Histogram(
+    "zimage_job_upload_bytes", "Worker 上传的结果图片大小",
+    buckets=(64e3, 128e3, 256e3, 512e3, 1e6, 2e6, 4e6, 8e6, 16e6),
+)
+
+# 抓取时从数据库计算
+QUEUE_LENGTH = Gauge("zimage_queue_length", "排队中的任务数", ["priority"], multiprocess_mode="mostrecent")
+WORKERS_ONLINE = Gauge("zimage_workers_online", "在线 Worker 数", multiprocess_mode="mostrecent")
+WORKERS_BUSY = Gauge("zimage_workers_busy", "正在执行任务的在线 Worker 数", multiprocess_mode="mostrecent")
+WORKER_UTILIZATION = Gauge("zimage_worker_utilization", "忙碌 Worker / 在线 Worker", multiprocess_mode="mostrecent")
+WORKER_BUCKET_JOBS = Gauge(
+    "zimage_worker_bucket_jobs", "在线 Worker 自启动以来按生成尺寸（分辨率桶）统计的任务数，来自心跳 gpu_info",
+    ["size"], multiprocess_mode="mostrecent",
+)
+WORKER_MEMORY_PEAK = Gauge(
+    "zimage_worker_memory_peak_mb", "在线 Worker 按生成尺寸统计的最大显存峰值（MB），来自心跳 gpu_info",
+    ["size"], multiprocess_mode="mostrecent",
+)
+
+# ---------- 聊天 ----------
+
+CHAT_CONNECTIONS = Gauge("zimage_chat_connections", "本进程的聊天 WebSocket 连接数", multiprocess_mode="livesum")
+CHAT_MESSAGES = Counter("zimage_chat_messages_total", "发送的聊天消息数")
+CHAT_BROADCAST_SECONDS = Histogram(
+    "zimage_chat_broadcast_seconds", "广播投递到本进程所有连接发送队列的耗时",
+    buckets=(0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1),
+)
+CHAT_RATE_LIMIT = Counter("zimage_chat_rate_limit_total", "聊天限流结果", ["outcome"])
+CHAT_DROPPED_ROWS = Counter("zimage_chat_dropped_rows_total", "多次写入失败后丢弃的聊天消息 / 活动日志行", ["table"])
+
+# ---------- 日志 ----------
+
+LOG_DROPPED = Gauge("zimage_log_dropped", "日志队列满被丢弃的记录数（进程启动以来）", multiprocess_mode="livesum")
+
+
+# ---------- 记录 ----------
+
+def job_transition(old_status: Optional[str], new_status: Optional[str]):
+    JOB_TRANSITIONS.labels(old_status or "none", new_status or "none").inc()
+
+
+def job_claimed(created_at: datetime, started_at: datetime):
+    JOB_QUEUE_SECONDS.observe((started_at - created_at).total_seconds())
+
+
+def job_completed(status: str, created_at: datetime, started_at: Optional[datetime], finished_at: datetime):
+    JOB_COMPLETE_SECONDS.labels(status).observe((finished_at - created_at).total_seconds())
+    if started_at:
+        JOB_GENERATION_SECONDS.labels(status).observe((finished_at - started_at).total_seconds())
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if context is not None:
+        context._metrics_started = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = getattr(context, "_metrics_started", None)
+    if started is None:
+        return
+    operation = statement.lstrip().split(None, 1)[0].upper() if statement else "OTHER"
+    if operation not in ("SELECT", "INSERT", "UPDATE", "DELETE"):
+        operation = "OTHER"
+    DB_QUERY_SECONDS.labels(operation).observe(time.perf_counter() - started)
+
+
+def instrument_database():
+    """对所有引擎注册 SQL 计时钩子（异步引擎底层同样触发这些事件）"""
+    if not event.contains(Engine, "before_cursor_execute", _before_cursor_execute):
+        event.listen(Engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(Engine, "after_cursor_execute", _after_cursor_execute)
+
+
+class MetricsMiddleware:
+    """按路由模板（而不是原始路径）记录请求耗时，避免标签基数爆炸"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        status = 500
+        started = time.perf_counter()
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            route = scope.get("route")
+            path = getattr(route, "path", None) or "unmatched"
+            HTTP_REQUEST_SECONDS.labels(scope["method"], path, str(status)).observe(time.perf_counter() - started)
+
+
+_seen_priorities = {"0", "10"}  # 普通用户 / 管理员任务
+_seen_sizes = set()
+_seen_peak_sizes = set()
+
+
+async def _collect_from_database():
+    from app.models import Job, JobStatus, Worker
+    from app.models.database import async_session
+
+    async with async_session() as db:
+        result = await db.execute(
+            select(Job.priority, func.count(Job.id))
+            .where(Job.status == JobStatus.QUEUED.value)
+            .group_by(Job.priority)
+        )
+        counts = {str(priority): count for priority, count in result.all()}
+        # 多进程模式下指标文件不会随 clear() 删除，清空的优先级显式置 0
+        for priority in _seen_priorities - counts.keys():
+            QUEUE_LENGTH.labels(priority).set(0)
+        for priority, count in counts.items():
+            QUEUE_LENGTH.labels(priority).set(count)
+        _seen_priorities.update(counts)
+
+        workers = (await db.execute(select(Worker))).scalars().all()
+    online = [w for w in workers if w.is_online]
+    busy = sum(1 for w in online if w.current_job_id)
+    WORKERS_ONLINE.set(len(online))
+    WORKERS_BUSY.set(busy)
+    WORKER_UTILIZATION.set(busy / len(online) if online else 0)
+
+    sizes = {}
+    for worker in online:
+        for size, count in ((worker.gpu_info or {}).get("buckets") or {}).items():
+            sizes[size] = sizes.get(size, 0) + count
+    for size in _seen_sizes - sizes.keys():
+        WORKER_BUCKET_JOBS.labels(size).set(0)
+    for size, count in sizes.items():
+        WORKER_BUCKET_JOBS.labels(size).set(count)
+    _seen_sizes.update(sizes)
+
+    peaks = {}
+    for worker in online:
+        for size, peak in ((worker.gpu_info or {}).get("memory_peak_mb") or {}).items():
+            peaks[size] = max(peaks.get(size, 0), peak)
+    for size in _seen_peak_sizes - peaks.keys():
+        WORKER_MEMORY_PEAK.labels(size).set(0)
+    for size, peak in peaks.items():
+        WORKER_MEMORY_PEAK.labels(size).set(peak)
+    _seen_peak_sizes.update(peaks)
+
+
+async def render() -> bytes:
+    from app.logs import dropped_count
+    LOG_DROPPED.set(dropped_count())
+    try:
+        await _collect_from_database()
+    except Exception as e:
+        logger.warning("Failed to collect database gauges: %s", e)
+    if MULTIPROCESS:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry)
+
+
+def mark_process_dead():
+    """进程退出时清理本进程的 livesum 指标文件"""
+    if MULTIPROCESS:
+        multiprocess.mark_process_dead(os.getpid())
+
@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+"""
+聊天室在线状态索引
+
+按 (display_name, username) 维护连接引用计数，连接加入 / 离开时增量更新：
+只有某个用户第一次出现或最后一个连接离开时在线列表才变化，版本号加一并返回差异。
+在线列表快照缓存到下一次变化，读取不再遍历所有连接。
+
+索引覆盖所有进程的连接（键为 "节点ID:连接ID"），各节点定期同步自己的连接集合，
+崩溃节点的连接在同步超时后移除。
+"""
+import time
+from typing import Dict, List, Optional, Tuple
+
+Key = Tuple[str, Optional[str]]
+
+
+def _key(user_info: dict) -> Key:
+    return (user_info.get('display_name', '匿名用户'), user_info.get('username'))
+
+
+def _detail(key: Key, user_id: Optional[int]) -> dict:
+    return {'display_name': key[0], 'user_id': user_id, 'username': key[1]}
+
+
+class PresenceIndex:
+    def __init__(self):
+        # 在线用户 -> {'count': 连接数, 'user_id': ...}，dict 保持首次上线顺序
+        self._users: Dict[Key, dict] = {}
+        # 连接 -> 在线用户
+        self._connections: Dict[str, Key] = {}
+        # 节点 -> 最近一次同步时间
+        self._node_seen: Dict[str, float] = {}
+        self.version = 0
+        self._snapshots: Dict[bool, List[dict]] = {}
+
+    @property
+    def connection_count(self) -> int:
+        return len(self._connections)
+
+    # ---------- 增量更新，返回差异（无变化返回 None） ----------
+
+    def _changed(self, added: list, removed: list) -> Optional[dict]:
+        if not added and not removed:
+            return None
+        self.version += 1
+        self._snapshots.clear()
+        return {'version': self.version, 'added': added, 'removed': removed}
+
+    def _add(self, conn_key: str, user_info: dict, added: list):
+        if conn_key in self._connections:
+            return
+        key = _key(user_info)
+        self._connections[conn_key] = key
+        entry = self._users.get(key)
+        if entry:
+            entry['count'] += 1
+        else:
+            self._users[key] = {'count': 1, 'user_id': user_info.get('user_id')}
+            added.append(_detail(key, user_info.get('user_id')))
+
+    def _remove(self, conn_key: str, removed: list):
+        key = self._connections.pop(conn_key, None)
+        if key is None:
+            return
+        entry = self._users[key]
+        entry['count'] -= 1
+        if entry['count'] == 0:
+            del self._users[key]
+            removed.append(_detail(key, entry['user_id']))
+
+    def add(self, node: str, conn: int, user_info: dict) -> Optional[dict]:
+        # 增量事件也算节点存活：只发过增量、还没同步过的节点崩溃后同样会超时移除
+        self._node_seen[node] = time.monotonic()
+        added = []
+        self._add(f"{node}:{conn}", user_info, added)
+        return self._changed(added, [])
+
+    def remove(self, node: str, conn: int) -> Optional[dict]:
+        self._node_seen[node] = time.monotonic()
+        removed = []
+        self._remove(f"{node}:{conn}", removed)
+        return self._changed([], removed)
+
+    def drop_node(self, node: str) -> Optional[dict]:
+        self._node_seen.pop(node, None)
+        prefix = f"{node}:"
+        removed = []
+        for conn_key in [k for k in self._connections if k.startswith(prefix)]:
+            self._remove(conn_key, removed)
+        return self._changed([], removed)
+
+    def sync_node(self, node: str, connections: Dict[str, dict]) -> Optional[dict]:
+        """用节点上报的完整连接集合校正该节点的记录"""
+        self._node_seen[node] = time.monotonic()
+        prefix = f"{node}:"
+        added, removed = [], []
+        for conn_key in [k for k in self._connections if k.startswith(prefix)]:
+            if conn_key[len(prefix):] not in connections:
+                self._remove(conn_key, removed)
+        for conn, user_info in connections.items():
+            self._add(f"{prefix}{conn}", user_info, added)
+        # 同一用户先移除后加入时抵消
+        added_keys = {(u['display_name'], u['username']) for u in added}
+        removed_keys = {(u['display_name'], u['username']) for u in removed}
+        both = added_keys & removed_keys
+        added = [u for u in added if (u['display_name'], u['username']) not in both]
+        removed = [u for u in removed if (u['display_name'], u['username']) not in both]
+        return self._changed(added, removed)
+
+    def expired_nodes(self, timeout: float) -> List[str]:
+        threshold = time.monotonic() - timeout
+        return [node for node, seen in self._node_seen.items() if seen < threshold]
+
+    # ---------- 读取 ----------
+
+    def snapshot(self, include_details: bool = False) -> List[dict]:
+        """在线用户列表（缓存到下一次变化；调用方不要修改返回值）"""
+        users = self._snapshots.get(include_details)
+        if users is None:
+            if include_details:
+                users = [_detail(key, entry['user_id']) for key, entry in self._users.items()]
+            else:
+                users = [{'display_name': key[0]} for key in self._users]
+            self._snapshots[include_details] = users
+        return users
@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+"""
+每日配额账本
+
+配额用量单独记在 quota_ledger 表（每个用户一行：day 为日期序号，used 为当天用量）：
+- 提交任务时原子预占：UPDATE ... WHERE used < quota，不存在读-改-写竞争
+- 任务失败（REFUND_QUOTA_ON_FAILURE）或取消时退还
+- 跨天不需要写库重置：day 不是今天时视为用量 0，下一次预占顺带把 day 改为今天
+
+User.today_used_count 不再维护，用量以账本为准。
+"""
+from datetime import date, datetime, timezone
+from typing import Dict, Iterable, Optional
+
+from sqlalchemy import Column, Integer, MetaData, Table, case, or_, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.config import settings
+
+metadata = MetaData()
+
+quota_ledger = Table(
+    "quota_ledger",
+    metadata,
+    Column("user_id", Integer, primary_key=True, autoincrement=False),
+    Column("day", Integer, nullable=False),
+    Column("used", Integer, nullable=False, default=0),
+)
+
+
+def current_day() -> int:
+    """当前日期桶（与存储目录一致，按服务器本地日期）"""
+    return date.today().toordinal()
+
+
+def day_of(dt: Optional[datetime]) -> int:
+    """naive UTC 时间（如 Job.created_at）所在的日期桶，先换算为本地日期，与 current_day 同一时钟"""
+    if dt is None:
+        return current_day()
+    return dt.replace(tzinfo=timezone.utc).astimezone().date().toordinal()
+
+
+async def _try_increment(db: AsyncSession, user_id: int, day: int, quota: Optional[int]) -> bool:
+    c = quota_ledger.c
+    condition = c.user_id == user_id
+    if quota is not None:
+        # 跨天的行直接重置为 1；当天的行只有未用完才能加 1
+        condition = condition & or_(c.day != day, c.used < quota)
+    result = await db.execute(
+        update(quota_ledger)
+        .where(condition)
+        .values(used=case((c.day == day, c.used + 1), else_=1), day=day)
+    )
+    return result.rowcount == 1
+
+
+async def reserve(db: AsyncSession, user_id: int, quota: Optional[int]) -> bool:
+    """
+    预占一次配额，成功返回 True
+
+    quota=None 表示不限额（管理员），只记录用量。与任务 INSERT 在同一事务中，
+    任务写入失败时一起回滚。
+    """
+    # 配额为 0 时直接拒绝：否则跨天的行会在 UPDATE 中被重置为 1
+    if quota is not None and quota < 1:
+        return False
+    day = current_day()
+    if await _try_increment(db, user_id, day, quota):
+        return True
+
+    # 该用户还没有账本行：插入；并发插入冲突时回到 UPDATE 路径
+    try:
+        async with db.begin_nested():
+            await db.execute(quota_ledger.insert().values(user_id=user_id, day=day, used=1))
+        return True
+    except IntegrityError:
+        return await _try_increment(db, user_id, day, quota)
+
+
+async def refund(db: AsyncSession, user_id: int, reserved_at: Optional[datetime]):
+    """退还一次配额（只退预占当天的用量，跨天后无需退还）"""
+    c = quota_ledger.c
+    await db.execute(
+        update(quota_ledger)
+        .where(c.user_id == user_id, c.day == day_of(reserved_at), c.used > 0)
+        .values(used=c.used - 1)
+    )
+
+
+async def refund_failed(db: AsyncSession, user_id: int, reserved_at: Optional[datetime]):
+    """任务失败时按 REFUND_QUOTA_ON_FAILURE 决定是否退还"""
+    if settings.REFUND_QUOTA_ON_FAILURE:
+        await refund(db, user_id, reserved_at)
+
+
+async def get_usage(db: AsyncSession, user_ids: Iterable[int]) -> Dict[int, int]:
+    """批量获取今日用量，没有记录或记录不是今天的用户为 0"""
+    user_ids = list(user_ids)
+    if not user_ids:
+        return {}
+    c = quota_ledger.c
+    result = await db.execute(
+        select(c.user_id, c.used).where(c.user_id.in_(user_ids), c.day == current_day())
+    )
+    usage = {user_id: 0 for user_id in user_ids}
+    usage.update({user_id: used for user_id, used in result.all()})
+    return usage
@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+"""
+限流存储
+
+按 GCRA（通用信元速率算法）实现令牌桶：每个键只保存一个“理论到达时间”(TAT)，
+rate 为每秒补充的令牌数，burst 为桶容量。与令牌桶完全等价，但状态只有一个数，
+判断一次只需几次浮点运算，也方便在 Redis 中用一个 Lua 脚本原子完成。
+
+- MemoryStore：进程内字典（单进程部署，或只需本进程生效的计数，如单个连接）
+- RedisStore：多进程 / 多主机共享计数（RATE_LIMIT_STORAGE_URL=redis://...）
+
+hit() 返回需要等待的秒数，0 表示放行。
+"""
+import ipaddress
+import logging
+import time
+from typing import Dict, List, Optional
+
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+class MemoryStore:
+    """进程内 GCRA 状态"""
+
+    def __init__(self, max_keys: int = 100_000):
+        self._tat: Dict[str, float] = {}
+        self.max_keys = max_keys
+
+    def hit_now(self, key: str, rate: float, burst: int, cost: int = 1) -> float:
+        now = time.monotonic()
+        interval = 1.0 / rate
+        tat = self._tat.get(key, now)
+        if tat < now:
+            tat = now
+        new_tat = tat + interval * cost
+        allow_at = new_tat - burst * interval
+        if allow_at > now:
+            return allow_at - now
+        if len(self._tat) >= self.max_keys and key not in self._tat:
+            self._prune(now)
+        self._tat[key] = new_tat
+        return 0.0
+
+    async def hit(self, key: str, rate: float, burst: int, cost: int = 1) -> float:
+        return self.hit_now(key, rate, burst, cost)
+
+    def reset(self, key: str):
+        """清除某个键的状态（等同于满桶），如连接结束时"""
+        self._tat.pop(key, None)
+
+    def _prune(self, now: float):
+        """TAT 已过期的键等同于满桶，可以直接删除"""
+        for key in [k for k, tat in self._tat.items() if tat <= now]:
+            del self._tat[key]
+
+    async def close(self):
+        pass
+
+
+class RedisStore:
+    """Redis 共享 GCRA 状态（以 Redis 服务器时间为准，各主机时钟不必同步）"""
+
+    # ARGV: 间隔（毫秒）、容量、消耗；返回需等待的毫秒数（字符串，保留小数）
+    _GCRA_SCRIPT = """
+    local interval = tonumber(ARGV[1])
+    local burst = tonumber(ARGV[2])
+    local cost = tonumber(ARGV[3])
+    local t = redis.call('TIME')
+    local now = t[1] * 1000 + t[2] / 1000
+    local tat = tonumber(redis.call('GET', KEYS[1])) or now
+    if tat < now then tat = now end
+    local new_tat = tat + interval * cost
+    local allow_at = new_tat - burst * interval
+    if allow_at > now then
+        return tostring(allow_at - now)
+    end
+    redis.call('SET', KEYS[1], tostring(new_tat), 'PX', math.ceil(new_tat - now) + 1)
+    return '0'
+    """
+
+    def __init__(self, url: str, client=None):
+        self.url = url
+        self.prefix = f"{settings.EVENT_BUS_PREFIX}:rl:"
+        self._client = client
+        self._script = None
+
+    @property
+    def client(self):
+        if self._client is None:
+            import redis.asyncio as redis
+            self._client = redis.from_url(self.url, decode_responses=True)
+        return self._client
+
+    async def hit(self, key: str, rate: float, burst: int, cost: int = 1) -> float:
+        if self._script is None:
+            self._script = self.client.register_script(self._GCRA_SCRIPT)
+        try:
+            wait_ms = await self._script(keys=[self.prefix + key], args=[1000.0 / rate, burst, cost])
+        except Exception as e:
+            # 限流存储不可用时放行，不影响正常请求
+            logger.warning("Redis error, allowing request: %s", e)
+            return 0.0
+        return float(wait_ms) / 1000
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+
+
+def create_store(url: str):
+    if url.startswith(("redis://", "rediss://", "unix://")):
+        return RedisStore(url)
+    return MemoryStore()
+
+
+def _parse_networks(text: str) -> List:
+    networks = []
+    for item in text.split(","):
+        item = item.strip()
+        if item:
+            try:
+                networks.append(ipaddress.ip_network(item, strict=False))
+            except ValueError:
+                logger.warning("Ignoring invalid TRUSTED_PROXIES entry: %s", item)
+    return networks
+
+
+trusted_proxies = _parse_networks(settings.TRUSTED_PROXIES)
+
+
+def is_trusted_proxy(host: Optional[str]) -> bool:
+    if not host or not trusted_proxies:
+        return False
+    try:
+        address = ipaddress.ip_address(host)
+    except ValueError:
+        return False
+    return any(address in network for network in trusted_proxies)
+
+
+def resolve_ip(peer: Optional[str], real_ip: Optional[str], forwarded: Optional[str]) -> str:
+    """
+    客户端 IP：直连地址是受信代理（TRUSTED_PROXIES）时才采信代理头
+
+    X-Real-IP 由代理设置，优先；X-Forwarded-For 最左边的值可由客户端伪造，
+    从右往左跳过受信代理，取第一个不受信的地址
+    """
+    if is_trusted_proxy(peer):
+        if real_ip and real_ip.strip():
+            return real_ip.strip()
+        if forwarded:
+            hops = [hop.strip() for hop in forwarded.split(",") if hop.strip()]
+            for hop in reversed(hops):
+                if not is_trusted_proxy(hop):
+                    return hop
+            if hops:
+                return hops[0]
+    return peer or "unknown"
+
+
+def client_ip(headers, client) -> str:
+    """headers 为 Starlette Headers，client 为 request.client / websocket.client"""
+    return resolve_ip(client.host if client else None, headers.get("x-real-ip"), headers.get("x-forwarded-for"))
+
+
+# 跨进程共享的计数（用户 / IP 维度）
+shared_store = create_store(settings.RATE_LIMIT_STORAGE_URL)
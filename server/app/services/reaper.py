@@ -0,0 +1,225 @@
+# -*- coding: utf-8 -*-
+"""
+运行中任务的超时回收
+
+用最小堆维护两类截止时间：
+- 任务：started_at + JOB_TIMEOUT_SECONDS（领取、Worker 重新上报 running 时更新）
+- Worker：最近心跳 + WORKER_HEARTBEAT_TIMEOUT（每次心跳更新）
+
+调度循环只睡到最近的截止时间，到期立即处理，不再每分钟全表扫描。
+任务超时或 Worker 失联时标记失败并按配置退还配额；开启 REQUEUE_EXPIRED_JOBS 时，
+未超过 MAX_RETRY_COUNT 的任务改为重新排队（尽量交给其他 Worker）。
+
+多进程部署时只有主节点运行调度（见 app.services.events.LeaderTask），
+成为主节点时从数据库加载运行中的任务和 Worker 心跳；非主节点不维护截止时间堆。
+"""
+import asyncio
+import heapq
+import itertools
+import logging
+from datetime import datetime, timedelta
+from typing import Dict, Optional, Set, Tuple
+
+from sqlalchemy import select
+
+from app.config import settings
+from app.models import Job, JobStatus, Worker
+from app.services import quota, metrics
+
+logger = logging.getLogger(__name__)
+
+JOB = "job"
+WORKER = "worker"
+
+
+class DeadlineScheduler:
+    """按截止时间触发的最小堆，重新调度时旧条目惰性丢弃"""
+
+    def __init__(self):
+        self._heap = []
+        self._deadlines: Dict[Tuple[str, str], datetime] = {}
+        self._counter = itertools.count()
+        self._wakeup = asyncio.Event()
+
+    def __len__(self):
+        return len(self._deadlines)
+
+    def schedule(self, kind: str, key: str, deadline: datetime):
+        self._deadlines[(kind, key)] = deadline
+        entry = (deadline, next(self._counter), kind, key)
+        heapq.heappush(self._heap, entry)
+        # 新截止时间成为最早的一个时唤醒调度循环重新计算睡眠时间
+        if self._heap[0] is entry:
+            self._wakeup.set()
+
+    def cancel(self, kind: str, key: str):
+        self._deadlines.pop((kind, key), None)
+
+    def deadline(self, kind: str, key: str) -> Optional[datetime]:
+        return self._deadlines.get((kind, key))
+
+    def _pop_due(self, now: datetime) -> list:
+        due = []
+        while self._heap and self._heap[0][0] <= now:
+            deadline, _, kind, key = heapq.heappop(self._heap)
+            if self._deadlines.get((kind, key)) == deadline:
+                del self._deadlines[(kind, key)]
+                due.append((kind, key))
+        return due
+
+    async def run(self, handler):
+        while True:
+            self._wakeup.clear()
+            for kind, key in self._pop_due(datetime.utcnow()):
+                try:
+                    await handler(kind, key)
+                except Exception as e:
+                    logger.exception("Error handling %s %s: %s", kind, key, e)
+
+            timeout = None
+            if self._heap:
+                timeout = max(0.0, (self._heap[0][0] - datetime.utcnow()).total_seconds())
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+
+class JobReaper:
+    def __init__(self):
+        self.scheduler = DeadlineScheduler()
+        self.active = False
+        # job_id -> 曾经超时/失联的 Worker，重新排队后优先交给其他 Worker
+        self._avoid: Dict[str, Set[str]] = {}
+
+    # ---------- 事件 ----------
+
+    def track_job(self, job_id: str, started_at: Optional[datetime] = None):
+        """任务被领取或上报进度"""
+        if not self.active:
+            return
+        started_at = started_at or datetime.utcnow()
+        self.scheduler.schedule(JOB, job_id, started_at + timedelta(seconds=settings.JOB_TIMEOUT_SECONDS))
+
+    def finish_job(self, job_id: str):
+        """任务完成、失败或取消"""
+        self.scheduler.cancel(JOB, job_id)
+        self._avoid.pop(job_id, None)
+
+    def requeued(self, job_id: str, lost_by: Optional[str]):
+        """任务被回收重新排队"""
+        self.scheduler.cancel(JOB, job_id)
+        if lost_by:
+            self._avoid.setdefault(job_id, set()).add(lost_by)
+
+    def worker_seen(self, worker_id: str, seen_at: Optional[datetime] = None):
+        if not self.active:
+            return
+        seen_at = seen_at or datetime.utcnow()
+        self.scheduler.schedule(WORKER, worker_id, seen_at + timedelta(seconds=settings.WORKER_HEARTBEAT_TIMEOUT))
+
+    def worker_removed(self, worker_id: str):
+        self.scheduler.cancel(WORKER, worker_id)
+
+    def avoided_jobs(self, worker_id: str) -> Set[str]:
+        """该 Worker 曾超时/失联过的排队任务"""
+        return {job_id for job_id, workers in self._avoid.items() if worker_id in workers}
+
+    # ---------- 启动加载 ----------
+
+    async def seed(self, db):
+        running = (await db.execute(
+            select(Job.id, Job.started_at).where(Job.status == JobStatus.RUNNING.value)
+        )).all()
+        for job_id, started_at in running:
+            self.track_job(job_id, started_at)
+
+        workers = (await db.execute(select(Worker.id, Worker.last_seen_at))).all()
+        for worker_id, last_seen_at in workers:
+            if last_seen_at:
+                self.worker_seen(worker_id, last_seen_at)
+        return len(running)
+
+    # ---------- 到期处理 ----------
+
+    async def _expire_job(self, db, job: Job, reason: str):
+        from app.services import job_events
+
+        old_status = job.status
+        worker_id = job.worker_id
+        retries = job.retry_count or 0
+
+        if settings.REQUEUE_EXPIRED_JOBS and retries < settings.MAX_RETRY_COUNT:
+            job.status = JobStatus.QUEUED.value
+            job.retry_count = retries + 1
+            job.started_at = None
+            job.worker_id = None
+            await job_events.job_requeued(job.id, worker_id)
+            logger.warning("Job %s %s, requeued (retry %d/%d)", job.id, reason, job.retry_count, settings.MAX_RETRY_COUNT, extra={"job_id": job.id})
+        else:
+            job.status = JobStatus.FAILED.value
+            job.error_message = f"{reason}，已自动取消"
+            job.finished_at = datetime.utcnow()
+            await quota.refund_failed(db, job.user_id, job.created_at)
+            await job_events.job_finished(job.id)
+            metrics.job_completed(job.status, job.created_at, job.started_at, job.finished_at)
+            logger.warning("Job %s %s, marked as failed", job.id, reason, extra={"job_id": job.id})
+
+        await job_events.job_transition(job.user_id, old_status, job.status)
+
+    async def _on_job_deadline(self, db, job_id: str):
+        job = (await db.execute(select(Job).where(Job.id == job_id))).scalar_one_or_none()
+        if not job or job.status != JobStatus.RUNNING.value:
+            self._avoid.pop(job_id, None)
+            return
+        # 另一进程可能重新领取过（started_at 更新），以数据库为准
+        deadline = (job.started_at or datetime.utcnow()) + timedelta(seconds=settings.JOB_TIMEOUT_SECONDS)
+        if deadline > datetime.utcnow():
+            self.track_job(job.id, job.started_at)
+            return
+        await self._expire_job(db, job, f"生成超时（{settings.JOB_TIMEOUT_SECONDS // 60}分钟）")
+
+    async def _on_worker_deadline(self, db, worker_id: str):
+        worker = (await db.execute(select(Worker).where(Worker.id == worker_id))).scalar_one_or_none()
+        if not worker:
+            return
+        # 心跳可能由其他进程写入，以数据库为准
+        if worker.last_seen_at:
+            deadline = worker.last_seen_at + timedelta(seconds=settings.WORKER_HEARTBEAT_TIMEOUT)
+            if deadline > datetime.utcnow():
+                self.worker_seen(worker_id, worker.last_seen_at)
+                return
+
+        jobs = (await db.execute(
+            select(Job).where(Job.worker_id == worker_id, Job.status == JobStatus.RUNNING.value)
+        )).scalars().all()
+        for job in jobs:
+            await self._expire_job(db, job, f"Worker {worker_id} 失联")
+
+    async def _handle(self, kind: str, key: str):
+        from app.models.database import async_session
+
+        async with async_session() as db:
+            if kind == JOB:
+                await self._on_job_deadline(db, key)
+            elif settings.REAP_ON_WORKER_TIMEOUT:
+                await self._on_worker_deadline(db, key)
+            await db.commit()
+
+    async def run(self):
+        """主节点运行：加载截止时间后进入调度循环"""
+        from app.models.database import async_session
+
+        self.scheduler = DeadlineScheduler()
+        self.active = True
+        try:
+            async with async_session() as db:
+                running_count = await self.seed(db)
+            logger.info("Tracking %d running jobs", running_count)
+            await self.scheduler.run(self._handle)
+        finally:
+            self.active = False
+            self.scheduler = DeadlineScheduler()
+
+
+reaper = JobReaper()
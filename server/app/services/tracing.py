@@ -0,0 +1,237 @@
+# -*- coding: utf-8 -*-
+"""
+任务全链路追踪
+
+create_job 生成 trace_id，随 next-job 下发给 Worker，Worker 在状态上报 / 结果上传时
+带回自己测量的阶段耗时。各阶段以紧凑形式存入 job.result_metadata["trace"]：
+
+    {"id": "<32 位十六进制>", "spans": {"queue": [起点毫秒, 时长毫秒], ...}}
+
+起点为相对 job.created_at 的毫秒数。服务端阶段：
+- queue：提交到被领取
+- claim：领取接口内查询、加锁到写库前
+- upload：Worker 开始上传到服务端开始处理（含网络传输，受两端时钟偏差影响）
+- save：写图片文件
+- commit：结果写库
+Worker 阶段（由 Worker 上报，如 inference、encode）按同样格式合并。
+
+任务结束时整条链路按 OTLP/HTTP JSON 格式批量导出到 OTLP_ENDPOINT（为空则不导出），
+本地可用 `python -m bench.otlp_collector` 作为替身接收。
+"""
+import asyncio
+import logging
+import math
+import os
+import re
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+# 上报的阶段名限制，避免任意数据写进任务记录
+_SPAN_NAME = re.compile(r"^[a-z][a-z0-9_]{0,31}$")
+MAX_SPANS = 16
+
+
+def new_trace() -> dict:
+    return {"id": os.urandom(16).hex(), "spans": {}}
+
+
+def trace_of(job) -> Optional[dict]:
+    return (job.result_metadata or {}).get("trace")
+
+
+def trace_id_of(job) -> Optional[str]:
+    trace = trace_of(job)
+    return trace["id"] if trace else None
+
+
+def _epoch_ms(value: datetime) -> float:
+    """数据库中的时间为 UTC naive datetime"""
+    return value.replace(tzinfo=timezone.utc).timestamp() * 1000
+
+
+def _set_spans(job, spans: Dict[str, list]):
+    # 整体替换 JSON 字段，保证 SQLAlchemy 检测到变化
+    trace = trace_of(job)
+    if trace is None:
+        return
+    merged = dict(trace.get("spans") or {})
+    for name, span in spans.items():
+        if (name in merged or len(merged) < MAX_SPANS) and _SPAN_NAME.match(name):
+            merged[name] = span
+    job.result_metadata = {**job.result_metadata, "trace": {**trace, "spans": merged}}
+
+
+def record(job, name: str, start: datetime, end: datetime):
+    """记录一个服务端阶段"""
+    base = job.created_at
+    _set_spans(job, {name: [
+        round((start - base).total_seconds() * 1000, 1),
+        round(max(0.0, (end - start).total_seconds() * 1000), 1),
+    ]})
+
+
+def merge_reported(job, reported: Optional[dict], received_at: Optional[datetime] = None):
+    """
+    合并 Worker 上报的阶段：{"spans": {名称: [起点 epoch 毫秒, 时长毫秒]}, "sent_at": epoch 毫秒}
+
+    sent_at 与 received_at 同时存在时记录 upload 阶段。
+    """
+    if not isinstance(reported, dict):
+        return
+    base_ms = _epoch_ms(job.created_at)
+    spans = {}
+    for name, span in (reported.get("spans") or {}).items():
+        try:
+            start_ms, duration_ms = float(span[0]), float(span[1])
+        except (TypeError, ValueError, IndexError):
+            continue
+        spans[str(name)] = [round(start_ms - base_ms, 1), round(max(0.0, duration_ms), 1)]
+
+    sent_at = reported.get("sent_at")
+    if received_at is not None and isinstance(sent_at, (int, float)):
+        received_ms = _epoch_ms(received_at)
+        spans["upload"] = [round(sent_at - base_ms, 1), round(max(0.0, received_ms - sent_at), 1)]
+    _set_spans(job, spans)
+
+
+# ---------- 聚合 ----------
+
+def _percentile(ordered: List[float], pct: float) -> float:
+    k = max(0, min(len(ordered) - 1, math.ceil(pct / 100.0 * len(ordered)) - 1))
+    return ordered[k]
+
+
+def stage_percentiles(traces: List[dict]) -> Dict[str, dict]:
+    """按阶段统计时长分位数（毫秒）"""
+    durations: Dict[str, List[float]] = {}
+    for trace in traces:
+        for name, (_, duration) in (trace.get("spans") or {}).items():
+            durations.setdefault(name, []).append(duration)
+    stats = {}
+    for name, values in sorted(durations.items()):
+        values.sort()
+        stats[name] = {
+            "count": len(values),
+            "p50": _percentile(values, 50),
+            "p90": _percentile(values, 90),
+            "p99": _percentile(values, 99),
+            "max": values[-1],
+        }
+    return stats
+
+
+# ---------- OTLP 导出 ----------
+
+def _attr(key: str, value) -> dict:
+    if isinstance(value, bool):
+        return {"key": key, "value": {"boolValue": value}}
+    if isinstance(value, int):
+        return {"key": key, "value": {"intValue": str(value)}}
+    return {"key": key, "value": {"stringValue": str(value)}}
+
+
+def _nanos(epoch_ms: float) -> str:
+    return str(int(epoch_ms * 1_000_000))
+
+
+def otlp_spans(job) -> List[dict]:
+    """任务链路 -> OTLP span 列表：根 span 为整个任务，各阶段为子 span"""
+    trace = trace_of(job)
+    if not trace:
+        return []
+    trace_id = trace["id"]
+    root_id = trace_id[:16]
+    base_ms = _epoch_ms(job.created_at)
+    end_ms = _epoch_ms(job.finished_at) if job.finished_at else base_ms
+    spans = [{
+        "traceId": trace_id,
+        "spanId": root_id,
+        "name": "job",
+        "kind": 2,  # SERVER
+        "startTimeUnixNano": _nanos(base_ms),
+        "endTimeUnixNano": _nanos(end_ms),
+        "attributes": [
+            _attr("job.id", job.id),
+            _attr("job.status", job.status),
+            _attr("job.width", job.width),
+            _attr("job.height", job.height),
+            _attr("job.steps", job.steps),
+            _attr("worker.id", job.worker_id or ""),
+        ],
+        "status": {"code": 2 if job.status == "failed" else 1},
+    }]
+    for index, (name, (start, duration)) in enumerate((trace.get("spans") or {}).items()):
+        spans.append({
+            "traceId": trace_id,
+            "spanId": f"{root_id[:12]}{index + 1:04x}",
+            "parentSpanId": root_id,
+            "name": name,
+            "kind": 1,  # INTERNAL
+            "startTimeUnixNano": _nanos(base_ms + start),
+            "endTimeUnixNano": _nanos(base_ms + start + duration),
+        })
+    return spans
+
+
+class OTLPExporter:
+    """批量异步导出：任务结束时入队，后台每 OTLP_EXPORT_INTERVAL_SECONDS 秒发送一次"""
+
+    def __init__(self, endpoint: str):
+        self.endpoint = endpoint.rstrip("/")
+        self._pending: List[dict] = []
+        self._task: Optional[asyncio.Task] = None
+        self._client = None
+        self.dropped = 0
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.endpoint)
+
+    def export_job(self, job):
+        if not self.enabled:
+            return
+        if len(self._pending) >= settings.OTLP_MAX_QUEUE_SPANS:
+            self.dropped += 1
+            return
+        self._pending.extend(otlp_spans(job))
+
+    def _payload(self, spans: List[dict]) -> dict:
+        return {"resourceSpans": [{
+            "resource": {"attributes": [_attr("service.name", settings.OTLP_SERVICE_NAME)]},
+            "scopeSpans": [{"scope": {"name": "zimage.jobs"}, "spans": spans}],
+        }]}
+
+    async def flush(self):
+        if not self._pending:
+            return
+        spans, self._pending = self._pending, []
+        try:
+            response = await self._client.post(f"{self.endpoint}/v1/traces", json=self._payload(spans))
+            response.raise_for_status()
+        except Exception as e:
+            logger.warning("OTLP export failed (%d spans): %s", len(spans), e)
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(settings.OTLP_EXPORT_INTERVAL_SECONDS)
+            await self.flush()
+
+    def start(self):
+        if not self.enabled:
+            return
+        import httpx
+        self._client = httpx.AsyncClient(timeout=10)
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            await self.flush()
+            await self._client.aclose()
+
+
+exporter = OTLPExporter(settings.OTLP_ENDPOINT)
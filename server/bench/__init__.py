@@ -0,0 +1,2 @@
+# -*- coding: utf-8 -*-
+"""服务端基准测试与查询计划检查"""
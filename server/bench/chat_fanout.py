@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+"""
+聊天广播扇出基准
+
+模拟大量 WebSocket 连接（其中一部分是慢客户端），测量：
+- broadcast 调用本身的耗时（调用方被阻塞的时间）
+- 所有正常客户端收到消息的耗时
+legacy 模式按原实现逐个 await send_json，作为对照。
+
+使用方法:
+    python -m bench.chat_fanout --sockets 5000 --slow 50 --messages 20
+    python -m bench.chat_fanout --legacy
+"""
+import argparse
+import asyncio
+import json
+import time
+
+from bench.common import configure, percentile
+
+
+class FakeWebSocket:
+    def __init__(self, delay: float, on_receive):
+        self.delay = delay
+        self.on_receive = on_receive
+
+    async def accept(self):
+        pass
+
+    async def send_text(self, text: str):
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        self.on_receive(self)
+
+    async def send_json(self, data: dict):
+        await self.send_text(json.dumps(data, separators=(",", ":"), ensure_ascii=False))
+
+    async def close(self, code: int = 1000):
+        pass
+
+
+async def legacy_broadcast(sockets, message: dict):
+    """原实现：持锁逐个发送"""
+    for ws in sockets:
+        await ws.send_json(message.copy())
+
+
+async def main_async(args):
+    # 广播经事件总线投递给订阅的全局 manager
+    from app.api.chat import manager
+
+    pending = {"fast": 0}
+    done = asyncio.Event()
+
+    def on_receive(ws):
+        if not ws.delay:
+            pending["fast"] -= 1
+            if pending["fast"] == 0:
+                done.set()
+
+    sockets = []
+    for i in range(args.sockets):
+        delay = args.slow_delay if i < args.slow else 0.0
+        ws = FakeWebSocket(delay, on_receive)
+        sockets.append(ws)
+        if not args.legacy:
+            await manager.connect(ws, {
+                'user_id': i, 'username': f'u{i}', 'display_name': f'u{i}', 'avatar_url': None,
+                'is_admin': i % 1000 == 0,
+            })
+
+    fast_count = args.sockets - args.slow
+    call_ms, deliver_ms = [], []
+    for n in range(args.messages):
+        message = {'type': 'message', 'id': n, 'display_name': 'bench', 'content': 'x' * 80, 'is_admin': False}
+        pending["fast"] = fast_count
+        done.clear()
+        started = time.perf_counter()
+        if args.legacy:
+            broadcast = asyncio.create_task(legacy_broadcast(sockets, message))
+            await done.wait()
+            deliver_ms.append((time.perf_counter() - started) * 1000)
+            await broadcast
+            call_ms.append((time.perf_counter() - started) * 1000)
+        else:
+            await manager.broadcast(message)
+            call_ms.append((time.perf_counter() - started) * 1000)
+            await done.wait()
+            deliver_ms.append((time.perf_counter() - started) * 1000)
+
+    mode = "legacy" if args.legacy else "fanout"
+    print(f"mode={mode} sockets={args.sockets} slow={args.slow} (delay {args.slow_delay}s) messages={args.messages}")
+    print(f"broadcast call   p50={percentile(call_ms, 50):8.2f} ms  p99={percentile(call_ms, 99):8.2f} ms")
+    print(f"fast delivery    p50={percentile(deliver_ms, 50):8.2f} ms  p99={percentile(deliver_ms, 99):8.2f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="聊天广播扇出基准")
+    parser.add_argument("--sockets", type=int, default=5000)
+    parser.add_argument("--slow", type=int, default=50, help="慢客户端数量")
+    parser.add_argument("--slow-delay", type=float, default=0.2, help="慢客户端每条消息的发送耗时（秒）")
+    parser.add_argument("--messages", type=int, default=20)
+    parser.add_argument("--legacy", action="store_true", help="使用原逐个发送实现作为对照")
+    args = parser.parse_args()
+
+    configure()
+    asyncio.run(main_async(args))
+
+
+if __name__ == "__main__":
+    main()
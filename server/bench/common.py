@@ -0,0 +1,194 @@
+# -*- coding: utf-8 -*-
+"""
+基准脚本公共工具
+
+使用前必须先调用 configure()：app.config 在导入时读取环境变量，
+所以数据库地址、存储目录要在导入 app 之前设置好。
+"""
+import math
+import os
+import random
+import sys
+import tempfile
+import uuid
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta
+from pathlib import Path
+
+SERVER_ROOT = Path(__file__).resolve().parent.parent
+
+STATUSES = ["done"] * 80 + ["failed"] * 8 + ["cancelled"] * 6 + ["queued"] * 4 + ["running"] * 2
+
+
+def configure(database_url: str = None) -> str:
+    """设置数据库与存储目录环境变量，返回实际使用的数据库地址"""
+    if str(SERVER_ROOT) not in sys.path:
+        sys.path.insert(0, str(SERVER_ROOT))
+
+    workdir = Path(tempfile.mkdtemp(prefix="zimage-bench-"))
+    if not database_url:
+        database_url = f"sqlite+aiosqlite:///{workdir / 'bench.db'}"
+    os.environ["DATABASE_URL"] = database_url
+    os.environ.setdefault("STORAGE_ROOT", str(workdir / "storage"))
+    os.environ.setdefault("DEBUG", "false")
+    return database_url
+
+
+def percentile(values, pct: float) -> float:
+    """最近秩百分位数（values 无需预先排序）"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    k = max(0, min(len(ordered) - 1, math.ceil(pct / 100.0 * len(ordered)) - 1))
+    return ordered[k]
+
+
+async def seed(
+    num_users: int,
+    num_jobs: int,
+    batch_size: int = 5000,
+    rng: random.Random = None,
+    num_likes: int = 0,
+    num_comments: int = 0,
+) -> dict:
+    """
+    批量写入合成数据
+
+    任务状态按线上大致比例分布，约 30% 已完成作品发布到广场，
+    时间均匀分布在最近 90 天内。点赞和评论只落在广场作品上，
+    热度按幂律分布（少数作品占大部分互动）。返回用户 ID、广场作品 ID 等信息供场景使用。
+    """
+    from sqlalchemy import insert, select
+    from app.models.database import async_session
+    from app.models import User, Job, Like, Comment
+
+    rng = rng or random.Random(42)
+    now = datetime.utcnow()
+
+    async with async_session() as db:
+        for start in range(0, num_users, batch_size):
+            await db.execute(insert(User), [
+                {
+                    "linux_do_user_id": f"bench_{i}",
+                    "username": f"bench_user_{i}",
+                    "nickname": f"Bench {i}",
+                    "trust_level": rng.randint(0, 4),
+                    "daily_quota": 20,
+                }
+                for i in range(start, min(start + batch_size, num_users))
+            ])
+        await db.commit()
+
+        user_ids = (await db.execute(select(User.id))).scalars().all()
+
+        public_job_ids = []
+        for start in range(0, num_jobs, batch_size):
+            rows = []
+            for _ in range(start, min(start + batch_size, num_jobs)):
+                status = rng.choice(STATUSES)
+                created_at = now - timedelta(seconds=rng.randint(0, 90 * 86400))
+                started_at = created_at + timedelta(seconds=rng.randint(1, 120)) if status != "queued" else None
+                finished_at = (
+                    started_at + timedelta(seconds=rng.randint(5, 60))
+                    if status in ("done", "failed", "cancelled") else None
+                )
+                job_id = str(uuid.uuid4())
+                is_public = status == "done" and rng.random() < 0.3
+                if is_public:
+                    public_job_ids.append((job_id, finished_at))
+                rows.append({
+                    "id": job_id,
+                    "user_id": rng.choice(user_ids),
+                    "prompt": f"bench prompt {rng.random():.6f}",
+                    "width": 1024,
+                    "height": 1024,
+                    "steps": 9,
+                    "seed": -1,
+                    "status": status,
+                    "priority": 10 if rng.random() < 0.02 else 0,
+                    "created_at": created_at,
+                    "started_at": started_at,
+                    "finished_at": finished_at,
+                    "image_path": f"bench/{job_id}.png" if status == "done" else None,
+                    "is_public": is_public,
+                    "is_anonymous": rng.random() < 0.5,
+                    "is_deleted": rng.random() < 0.05,
+                })
+            await db.execute(insert(Job), rows)
+        await db.commit()
+
+        if public_job_ids and user_ids:
+            # 每个 (用户, 作品) 最多一个赞
+            liked = set()
+            num_likes = min(num_likes, len(user_ids) * len(public_job_ids) // 4)
+            for start in range(0, num_likes, batch_size):
+                rows = []
+                while len(rows) < min(batch_size, num_likes - start):
+                    pair = (rng.choice(user_ids), _popular(public_job_ids, rng)[0])
+                    if pair not in liked:
+                        liked.add(pair)
+                        rows.append({"user_id": pair[0], "job_id": pair[1]})
+                await db.execute(insert(Like), rows)
+
+            for start in range(0, num_comments, batch_size):
+                rows = []
+                for _ in range(start, min(start + batch_size, num_comments)):
+                    job_id, finished_at = _popular(public_job_ids, rng)
+                    rows.append({
+                        "user_id": rng.choice(user_ids),
+                        "job_id": job_id,
+                        "content": f"bench comment {rng.random():.6f}",
+                        "created_at": finished_at + timedelta(seconds=rng.randint(1, 86400)),
+                    })
+                await db.execute(insert(Comment), rows)
+            await db.commit()
+
+    return {"user_ids": list(user_ids), "public_job_ids": [job_id for job_id, _ in public_job_ids]}
+
+
+def _popular(items: list, rng: random.Random):
+    """幂律抽样：越靠前的元素被抽中的概率越高"""
+    return items[min(len(items) - 1, int(len(items) * rng.random() ** 3))]
+
+
+@asynccontextmanager
+async def running_app():
+    """启动 FastAPI 应用（含 lifespan），返回进程内 httpx 客户端"""
+    import httpx
+    from app.main import app
+
+    async with app.router.lifespan_context(app):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=60.0) as client:
+            yield client
+
+
+def user_headers(user_id: int) -> dict:
+    from app.api.auth import create_access_token
+    return {"Authorization": f"Bearer {create_access_token(user_id)}"}
+
+
+def worker_headers(worker_id: str) -> dict:
+    from app.config import settings
+    return {"X-Worker-Id": worker_id, "X-Api-Key": settings.WORKER_API_KEY}
+
+
+class StatementCounter:
+    """通过 SQLAlchemy 事件统计执行的 SQL 语句数"""
+
+    def __init__(self):
+        self.count = 0
+
+    def _on_execute(self, *args, **kwargs):
+        self.count += 1
+
+    def __enter__(self):
+        from sqlalchemy import event
+        from sqlalchemy.engine import Engine
+        event.listen(Engine, "before_cursor_execute", self._on_execute)
+        return self
+
+    def __exit__(self, *exc):
+        from sqlalchemy import event
+        from sqlalchemy.engine import Engine
+        event.remove(Engine, "before_cursor_execute", self._on_execute)
@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+"""
+对比两次负载测试结果（bench.load 的 --output 文件），超过阈值视为回归
+
+按 场景 / 接口 逐项比较：
+- 延迟 p50 / p99 变慢超过 --threshold（相对值）且超过 --min-ms（绝对值，过滤微秒级噪声）
+- 吞吐 rps 下降超过 --threshold
+- 出现新的错误（5xx / 异常）
+
+有回归时退出码为 1，可直接用于 CI。两边只有一边存在的接口只列出、不判定。
+
+使用方法:
+    python -m bench.compare results/base.json results/new.json
+    python -m bench.compare base.json new.json --threshold 0.2 --min-ms 2 --scenarios gallery,submit
+"""
+import argparse
+import json
+import sys
+
+LATENCY_KEYS = ["p50_ms", "p99_ms"]
+
+
+def _change(old: float, new: float) -> float:
+    return (new - old) / old if old else 0.0
+
+
+def compare(base: dict, current: dict, threshold: float, min_ms: float, scenarios=None) -> list:
+    """返回 [(场景, 接口, 指标, 旧值, 新值, 变化, 是否回归)]"""
+    rows = []
+    for scenario, base_scenario in base.get("scenarios", {}).items():
+        if scenarios and scenario not in scenarios:
+            continue
+        current_scenario = current.get("scenarios", {}).get(scenario)
+        if current_scenario is None:
+            rows.append((scenario, "*", "missing", None, None, None, False))
+            continue
+        base_endpoints = base_scenario["endpoints"]
+        current_endpoints = current_scenario["endpoints"]
+        for endpoint in sorted(set(base_endpoints) | set(current_endpoints)):
+            old, new = base_endpoints.get(endpoint), current_endpoints.get(endpoint)
+            if old is None or new is None:
+                rows.append((scenario, endpoint, "added" if old is None else "removed", None, None, None, False))
+                continue
+            for key in LATENCY_KEYS:
+                change = _change(old[key], new[key])
+                regressed = change > threshold and new[key] - old[key] > min_ms
+                rows.append((scenario, endpoint, key, old[key], new[key], change, regressed))
+            change = _change(old["rps"], new["rps"])
+            rows.append((scenario, endpoint, "rps", old["rps"], new["rps"], change, change < -threshold))
+            old_rate = old["errors"] / max(old["count"], 1)
+            new_rate = new["errors"] / max(new["count"], 1)
+            if new["errors"] or old["errors"]:
+                rows.append((scenario, endpoint, "error_rate", old_rate, new_rate, new_rate - old_rate,
+                             new_rate > old_rate))
+    return rows
+
+
+def _format(value) -> str:
+    if value is None:
+        return "-"
+    return f"{value:.3f}" if isinstance(value, float) and value < 1 else f"{value:.2f}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="对比两次负载测试结果")
+    parser.add_argument("base", help="基线结果 JSON")
+    parser.add_argument("current", help="本次结果 JSON")
+    parser.add_argument("--threshold", type=float, default=0.15, help="相对变化阈值，默认 15%%")
+    parser.add_argument("--min-ms", type=float, default=1.0, help="延迟绝对变化低于该值不算回归")
+    parser.add_argument("--scenarios", default=None, help="只比较这些场景（逗号分隔）")
+    parser.add_argument("--all", action="store_true", help="列出所有指标（默认只列出回归和变化超过阈值的项）")
+    args = parser.parse_args()
+
+    with open(args.base, encoding="utf-8") as f:
+        base = json.load(f)
+    with open(args.current, encoding="utf-8") as f:
+        current = json.load(f)
+    scenarios = set(args.scenarios.split(",")) if args.scenarios else None
+
+    for label, data in (("base", base), ("current", current)):
+        meta = data.get("meta", {})
+        print(f"{label:<8} rev={meta.get('revision') or '?'} db={meta.get('database')} "
+              f"scale={meta.get('scale')} at {meta.get('timestamp')}")
+    if base.get("meta", {}).get("scale") != current.get("meta", {}).get("scale"):
+        print("warning: runs use different --scale, latencies are not directly comparable")
+
+    rows = compare(base, current, args.threshold, args.min_ms, scenarios)
+    print(f"\n{'scenario':<9} {'endpoint':<48} {'metric':<10} {'base':>10} {'current':>10} {'change':>8}")
+    regressions = 0
+    for scenario, endpoint, metric, old, new, change, regressed in rows:
+        regressions += regressed
+        notable = change is None or abs(change) > args.threshold
+        if not (args.all or regressed or notable):
+            continue
+        change_text = "-" if change is None else f"{change * 100:+.1f}%"
+        flag = "  REGRESSION" if regressed else ""
+        print(f"{scenario:<9} {endpoint:<48} {metric:<10} {_format(old):>10} {_format(new):>10} "
+              f"{change_text:>8}{flag}")
+
+    print(f"\n{regressions} regression(s) (threshold {args.threshold * 100:.0f}%, min {args.min_ms} ms)")
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
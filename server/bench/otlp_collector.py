@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+"""
+本地 OTLP/HTTP 收集器替身
+
+接收服务端导出的任务链路（POST /v1/traces，JSON 编码），逐个 span 追加写入 JSON Lines 文件，
+并在终端打印每条链路的阶段耗时，方便没有 Jaeger / Collector 时调试。
+
+使用方法:
+    python -m bench.otlp_collector --port 4318 --output traces.jsonl
+    OTLP_ENDPOINT=http://localhost:4318 uvicorn app.main:app
+"""
+import argparse
+import json
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def make_handler(output):
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            if self.path != "/v1/traces":
+                self.send_response(404)
+                self.end_headers()
+                return
+            body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            try:
+                payload = json.loads(body)
+            except json.JSONDecodeError:
+                self.send_response(400)
+                self.end_headers()
+                return
+
+            for resource in payload.get("resourceSpans", []):
+                for scope in resource.get("scopeSpans", []):
+                    for span in scope.get("spans", []):
+                        output.write(json.dumps(span, ensure_ascii=False) + "\n")
+                        duration_ms = (int(span["endTimeUnixNano"]) - int(span["startTimeUnixNano"])) / 1e6
+                        indent = "  " if span.get("parentSpanId") else ""
+                        print(f"{span['traceId'][:8]} {indent}{span['name']:<12} {duration_ms:10.1f} ms")
+            output.flush()
+
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.end_headers()
+            self.wfile.write(b"{}")
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description="本地 OTLP/HTTP 收集器替身")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=4318)
+    parser.add_argument("--output", default="traces.jsonl")
+    args = parser.parse_args()
+
+    with open(args.output, "a", encoding="utf-8") as output:
+        server = ThreadingHTTPServer((args.host, args.port), make_handler(output))
+        print(f"[OTLP] Listening on http://{args.host}:{args.port}/v1/traces, writing {args.output}")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+
+
+if __name__ == "__main__":
+    main()
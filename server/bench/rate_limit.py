@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+"""
+API 限流中间件开销基准
+
+直接以 ASGI 方式调用中间件（下游为空应用，不经过网络和路由），
+测量每个请求增加的耗时：命中规则的登录用户、按 IP 计数的游客、未匹配规则的路径、
+Worker 请求，以及被拒绝（429）的请求。
+
+使用方法:
+    python -m bench.rate_limit --requests 200000
+    python -m bench.rate_limit --storage redis://localhost:6379/15
+"""
+import argparse
+import asyncio
+import os
+import time
+
+from bench.common import configure
+
+
+async def _noop_app(scope, receive, send):
+    pass
+
+
+async def _noop_send(message):
+    pass
+
+
+def _scope(method: str, path: str, headers: list) -> dict:
+    return {"type": "http", "method": method, "path": path, "headers": headers, "client": ("10.0.0.1", 50000)}
+
+
+async def _measure(app, scopes, n: int) -> float:
+    """平均每请求微秒数"""
+    count = len(scopes)
+    started = time.perf_counter()
+    for i in range(n):
+        await app(scopes[i % count], None, _noop_send)
+    return (time.perf_counter() - started) / n * 1e6
+
+
+async def main_async(args):
+    from app.config import settings
+    from app.api.auth import create_access_token
+    from app.api.ratelimit import RateLimitMiddleware
+    from app.services.ratelimit import MemoryStore, RedisStore
+
+    store = RedisStore(args.storage) if args.storage else MemoryStore()
+    # 放行场景用足够大的预算，只测开销
+    generous = {"GET /api/jobs/{job_id}": "1000000/s", "GET /api/gallery": "1000000/s"}
+    middleware = RateLimitMiddleware(_noop_app, rules=generous, default="", store=store)
+    strict = RateLimitMiddleware(_noop_app, rules={"GET /api/jobs/{job_id}": "1/h:1"}, default="", store=store)
+
+    users = [
+        [(b"authorization", f"Bearer {create_access_token(i)}".encode())]
+        for i in range(args.users)
+    ]
+    scenarios = {
+        "baseline (no middleware)": (_noop_app, [_scope("GET", "/api/jobs/abc", h) for h in users]),
+        "user, matched rule": (middleware, [_scope("GET", "/api/jobs/abc", h) for h in users]),
+        "guest by ip": (middleware, [_scope("GET", "/api/gallery", [(b"x-real-ip", f"10.0.{i // 256}.{i % 256}".encode())]) for i in range(args.users)]),
+        "unmatched path": (middleware, [_scope("GET", "/health", [])]),
+        "worker (api key)": (middleware, [_scope("GET", "/api/jobs/abc", [(b"x-api-key", settings.WORKER_API_KEY.encode())])]),
+        "rejected (429)": (strict, [_scope("GET", "/api/jobs/abc", users[0])]),
+    }
+
+    print(f"storage={'redis' if args.storage else 'memory'} requests={args.requests} users={args.users}")
+    for name, (app, scopes) in scenarios.items():
+        await _measure(app, scopes, min(args.requests, 1000))  # 预热（令牌缓存、正则）
+        per_request = await _measure(app, scopes, args.requests)
+        print(f"{name:<26} {per_request:8.2f} us/request")
+    await store.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="API 限流中间件开销基准")
+    parser.add_argument("--requests", type=int, default=200000)
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--storage", default="", help="Redis 地址，默认进程内存储")
+    args = parser.parse_args()
+
+    configure()
+    # 游客场景经由代理（_scope 的直连地址）带 X-Real-IP
+    os.environ.setdefault("TRUSTED_PROXIES", "10.0.0.1")
+    asyncio.run(main_async(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+"""
+create_job 突发提交基准
+
+N 个不同用户同时提交任务，统计提交延迟 p50/p99 与每次提交执行的 SQL 语句数
+（包含 get_current_user 的用户查询）。
+
+使用方法:
+    python -m bench.submit_burst --users 2000 --concurrency 200
+"""
+import argparse
+import asyncio
+import time
+
+from bench.common import configure, percentile, seed, running_app, user_headers, worker_headers, StatementCounter
+
+
+async def main_async(args):
+    from app.models import init_db
+
+    await init_db()
+    info = await seed(args.users, 0)
+    user_ids = info["user_ids"]
+
+    async with running_app() as client:
+        resp = await client.post(
+            "/api/workers/heartbeat",
+            json={"worker_id": "bench-worker", "status": "idle"},
+            headers=worker_headers("bench-worker"),
+        )
+        resp.raise_for_status()
+        headers = [user_headers(uid) for uid in user_ids]
+
+        semaphore = asyncio.Semaphore(args.concurrency)
+        latencies = []
+        statuses = {}
+
+        async def submit(h):
+            async with semaphore:
+                started = time.perf_counter()
+                r = await client.post("/api/jobs", json={"prompt": "bench burst", "width": 512, "height": 512}, headers=h)
+                latencies.append((time.perf_counter() - started) * 1000)
+                statuses[r.status_code] = statuses.get(r.status_code, 0) + 1
+
+        with StatementCounter() as counter:
+            started = time.perf_counter()
+            await asyncio.gather(*(submit(h) for h in headers))
+            elapsed = time.perf_counter() - started
+
+    total = len(latencies)
+    print(f"submits:        {total} ({statuses})")
+    print(f"throughput:     {total / elapsed:.1f} req/s")
+    print(f"latency p50:    {percentile(latencies, 50):.2f} ms")
+    print(f"latency p99:    {percentile(latencies, 99):.2f} ms")
+    print(f"SQL per submit: {counter.count / max(total, 1):.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="create_job 突发提交基准")
+    parser.add_argument("--database-url", default=None)
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=200)
+    args = parser.parse_args()
+
+    configure(args.database_url)
+    asyncio.run(main_async(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+"""
+Worker 流水线端到端基准
+
+在本进程启动真实的 HTTP 服务（uvicorn + 临时 SQLite），用 worker/ 下的 Worker 运行时
+（假管线，不需要 GPU）处理一批任务，对比：
+- serial：不预取、在推理线程内编码上传（PREFETCH_JOBS=0 ENCODE_THREADS=0）
+- pipelined：预取 1 个任务、后台线程编码上传（默认配置）
+每种模式结束时发送 SIGTERM 等价的 stop()，顺带验证优雅退出。
+
+使用方法:
+    python -m bench.worker_e2e --jobs 40 --size 1024 --step-seconds 0.05
+"""
+import argparse
+import asyncio
+import os
+import socket
+import sys
+import threading
+import time
+
+from bench.common import SERVER_ROOT, configure, percentile, seed, user_headers
+
+WORKER_ROOT = SERVER_ROOT.parent / "worker"
+
+MODES = {
+    "serial": {"prefetch_jobs": 0, "encode_threads": 0},
+    "pipelined": {"prefetch_jobs": 1, "encode_threads": 2},
+}
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+async def run_mode(name: str, client, base_url: str, user_ids: list, args) -> dict:
+    from app.config import settings
+    from zimage_worker import Worker, WorkerConfig
+
+    config = WorkerConfig(
+        worker_id=f"e2e-{name}",
+        api_base=base_url,
+        api_key=settings.WORKER_API_KEY,
+        pipeline="dummy",
+        device="cpu",
+        poll_interval=0.2,
+        dummy_step_seconds=args.step_seconds,
+        **MODES[name],
+    )
+    worker = Worker(config)
+    thread = threading.Thread(target=worker.run, name=f"worker-{name}")
+    thread.start()
+    # 等心跳生效后再提交
+    await asyncio.sleep(0.5)
+
+    started = time.perf_counter()
+    submitted = {}
+    for user_id in user_ids:
+        resp = await client.post(
+            "/api/jobs",
+            json={"prompt": f"e2e {name}", "width": args.size, "height": args.size, "steps": args.steps},
+            headers=user_headers(user_id),
+        )
+        resp.raise_for_status()
+        submitted[resp.json()["id"]] = user_id
+
+    # 轮询直到全部完成
+    latencies = []
+    remaining = dict(submitted)
+    while remaining and time.perf_counter() - started < args.timeout:
+        await asyncio.sleep(0.25)
+        for job_id, user_id in list(remaining.items()):
+            resp = await client.get(f"/api/jobs/{job_id}", headers=user_headers(user_id))
+            data = resp.json()
+            if data["status"] in ("done", "failed"):
+                latencies.append((time.perf_counter() - started) * 1000)
+                del remaining[job_id]
+    elapsed = time.perf_counter() - started
+
+    worker.stop()
+    await asyncio.to_thread(thread.join)
+    return {
+        "jobs": len(submitted),
+        "unfinished": len(remaining),
+        "jobs_per_s": (len(submitted) - len(remaining)) / elapsed,
+        "elapsed_s": elapsed,
+        "completion_p50_ms": percentile(latencies, 50),
+        "stats": dict(worker.stats),
+    }
+
+
+async def main_async(args):
+    import httpx
+    import uvicorn
+    from app.main import app
+    from app.models import init_db
+
+    await init_db()
+    info = await seed(args.jobs * len(args.modes), 0)
+
+    port = _free_port()
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    serving = asyncio.create_task(server.serve())
+    while not server.started:
+        await asyncio.sleep(0.05)
+
+    base_url = f"http://127.0.0.1:{port}"
+    results = {}
+    async with httpx.AsyncClient(base_url=base_url, timeout=30.0) as client:
+        for i, mode in enumerate(args.modes):
+            user_ids = info["user_ids"][i * args.jobs:(i + 1) * args.jobs]
+            results[mode] = await run_mode(mode, client, base_url, user_ids, args)
+
+    server.should_exit = True
+    await serving
+
+    print(f"jobs={args.jobs} size={args.size} steps={args.steps} step={args.step_seconds}s")
+    for mode, r in results.items():
+        print(f"{mode:<10} {r['jobs_per_s']:6.2f} jobs/s  elapsed {r['elapsed_s']:6.2f}s  "
+              f"unfinished {r['unfinished']}  worker {r['stats']}")
+    if "serial" in results and "pipelined" in results and results["serial"]["jobs_per_s"]:
+        print(f"speedup    {results['pipelined']['jobs_per_s'] / results['serial']['jobs_per_s']:.2f}x")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Worker 流水线端到端基准")
+    parser.add_argument("--jobs", type=int, default=40, help="每种模式的任务数")
+    parser.add_argument("--size", type=int, default=1024, help="图片边长")
+    parser.add_argument("--steps", type=int, default=9)
+    parser.add_argument("--step-seconds", type=float, default=0.05, help="假管线每步耗时")
+    parser.add_argument("--modes", default="serial,pipelined")
+    parser.add_argument("--timeout", type=float, default=300.0)
+    args = parser.parse_args()
+    args.modes = [m for m in args.modes.split(",") if m in MODES]
+
+    os.environ["RATE_LIMIT_ENABLED"] = "false"
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+    configure()
+    if str(WORKER_ROOT) not in sys.path:
+        sys.path.insert(0, str(WORKER_ROOT))
+    asyncio.run(main_async(args))
+
+
+if __name__ == "__main__":
+    main()
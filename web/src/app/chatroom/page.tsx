@@ -8,7 +8,8 @@ import { Send, Users, Wifi, WifiOff, Lock, Loader2, Eye, EyeOff, Trash2, Chevron
 import { api } from '@/lib/api';
 
 interface ChatMessage {
-  id?: number;
+  // 雪花 ID 超过 Number 的安全整数范围，服务端以字符串返回
+  id?: string;
   type: 'message' | 'system' | 'online_update' | 'delete';
   display_name?: string;
   avatar_url?: string;
@@ -16,7 +17,7 @@ interface ChatMessage {
   timestamp: string;
   is_admin?: boolean;
   online_count?: number;
-  message_id?: number;
+  message_id?: string;
 }
 
 interface OnlineUser {
@@ -25,6 +26,14 @@ interface OnlineUser {
   user_id?: number;
 }
 
+interface PresenceDiff {
+  version: number;
+  added: OnlineUser[];
+  removed: OnlineUser[];
+}
+
+const presenceKey = (u: OnlineUser) => `${u.display_name}\u0000${u.username ?? ''}`;
+
 interface ActivityLog {
   type: 'join' | 'leave';
   display_name: string;
@@ -50,6 +59,7 @@ export default function ChatroomPage() {
   const reconnectTimeoutRef = useRef<NodeJS.Timeout | null>(null);
   const hasInitialized = useRef(false);
   const isManualDisconnect = useRef(false);
+  const presenceVersion = useRef(0);
 
   const scrollToBottom = () => {
     messagesEndRef.current?.scrollIntoView({ behavior: 'smooth' });
@@ -119,6 +129,7 @@ export default function ChatroomPage() {
 
       ws.onopen = () => {
         isManualDisconnect.current = false;
+        presenceVersion.current = 0;
         setIsConnected(true);
       };
 
@@ -130,6 +141,17 @@ export default function ChatroomPage() {
           }
           if (data.online_users) {
             setOnlineUsers(data.online_users);
+            presenceVersion.current = data.presence_version ?? 0;
+          }
+          // 在线用户增量变化（管理员可见），忽略早于当前列表的差异
+          const presence: PresenceDiff | undefined = data.presence;
+          if (presence && presence.version > presenceVersion.current) {
+            presenceVersion.current = presence.version;
+            const removed = new Set(presence.removed.map(presenceKey));
+            setOnlineUsers(prev => [
+              ...prev.filter(u => !removed.has(presenceKey(u))),
+              ...presence.added,
+            ]);
           }
           // 处理活动日志（管理员可见）
           if (data.activity) {
@@ -235,7 +257,7 @@ export default function ChatroomPage() {
   };
 
   // 删除消息（管理员）
-  const handleDeleteMessage = async (messageId: number) => {
+  const handleDeleteMessage = async (messageId: string) => {
     if (!confirm('确定要删除这条消息吗？')) return;
     try {
       await api.delete(`/api/chat/messages/${messageId}`);
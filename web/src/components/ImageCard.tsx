@@ -2,7 +2,7 @@
 
 import { useState, useEffect } from 'react';
 import { Download, Copy, Maximize2, Check, X, Share2, Globe, Heart, MessageCircle, Send, Trash2 } from 'lucide-react';
-import { socialApi, CommentItem } from '@/lib/api';
+import { imageExtension, socialApi, CommentItem } from '@/lib/api';
 import { useAuthStore } from '@/lib/store';
 
 interface ImageCardProps {
@@ -171,7 +171,7 @@ export default function ImageCard({
       const url = window.URL.createObjectURL(blob);
       const a = document.createElement('a');
       a.href = url;
-      a.download = `zimage-${Date.now()}.png`;
+      a.download = `zimage-${Date.now()}.${imageExtension(blob)}`;
       document.body.appendChild(a);
       a.click();
       window.URL.revokeObjectURL(url);
@@ -627,7 +627,7 @@ export function ImagePreviewModal({
       const url = window.URL.createObjectURL(blob);
       const a = document.createElement('a');
       a.href = url;
-      a.download = `zimage-${Date.now()}.png`;
+      a.download = `zimage-${Date.now()}.${imageExtension(blob)}`;
       document.body.appendChild(a);
       a.click();
       window.URL.revokeObjectURL(url);
@@ -3,7 +3,7 @@
 import { useState, useEffect } from 'react';
 import { Loader2, Check, X, Clock, Download, Copy, Maximize2, Share2, Globe, Trash2 } from 'lucide-react';
 import { ImagePreviewModal } from './ImageCard';
-import { jobsApi, type Job } from '@/lib/api';
+import { imageExtension, jobsApi, type Job } from '@/lib/api';
 
 interface Props {
   job: Job;
@@ -96,7 +96,7 @@ export default function JobCard({ job: initialJob, onUpdate }: Props) {
       const url = window.URL.createObjectURL(blob);
       const a = document.createElement('a');
       a.href = url;
-      a.download = `zimage-${job.id}.png`;
+      a.download = `zimage-${job.id}.${imageExtension(blob)}`;
       document.body.appendChild(a);
       a.click();
       window.URL.revokeObjectURL(url);
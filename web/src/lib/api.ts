@@ -110,6 +110,13 @@ export interface CommentItem {
   };
 }
 
+// 下载文件名的扩展名（Worker 可输出 PNG / WebP / JPEG / AVIF）
+export function imageExtension(blob: Blob): string {
+  const subtype = blob.type.split('/')[1];
+  if (!subtype) return 'png';
+  return subtype === 'jpeg' ? 'jpg' : subtype;
+}
+
 // API 函数
 export const authApi = {
   devLogin: async (username = 'dev_user', password?: string) => {
@@ -0,0 +1,2 @@
+# -*- coding: utf-8 -*-
+"""Worker 基准测试（在 worker/ 目录下以 python -m bench.xxx 运行）"""
@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+"""
+图片编码基准：各格式 / 压缩级别的编码耗时与文件大小
+
+默认用合成图（渐变 + 噪声，接近生成图的纹理），有条件时用 --image 指定真实生成结果。
+另外测 --workers 个线程 / 进程并行编码的吞吐（对应 Worker 的上传线程与 ENCODE_PROCESSES 进程池）。
+
+使用方法:
+    python -m bench.encode
+    python -m bench.encode --image output.png --repeat 5 --workers 4
+    python -m bench.encode --formats png:1,png:3,png:6,webp:0,webp:4,jpeg,avif
+"""
+import argparse
+import json
+import statistics
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from zimage_worker import encoding
+
+DEFAULT_CASES = "png:0,png:1,png:3,png:6,png:9,webp:0,webp:4,webp:6,jpeg,avif"
+
+
+def synthetic(width: int, height: int):
+    from PIL import Image
+
+    red = Image.linear_gradient("L").resize((width, height))
+    green = Image.radial_gradient("L").resize((width, height))
+    noise = Image.effect_noise((width, height), 12)
+    blue = Image.blend(red.rotate(90), noise, 0.1)
+    return Image.merge("RGB", (Image.blend(red, noise, 0.1), Image.blend(green, noise, 0.1), blue))
+
+
+def parse_cases(text: str):
+    cases = []
+    for item in text.split(","):
+        fmt, _, level = item.strip().partition(":")
+        if fmt:
+            cases.append((fmt, int(level) if level else None))
+    return cases
+
+
+def _label(fmt: str, level) -> str:
+    return f"{fmt}:{level}" if level is not None else fmt
+
+
+def main():
+    parser = argparse.ArgumentParser(description="图片编码基准")
+    parser.add_argument("--image", default=None, help="测试图片，默认合成 --size 的图")
+    parser.add_argument("--size", default="1024x1024")
+    parser.add_argument("--formats", default=DEFAULT_CASES, help="格式[:级别]，逗号分隔；jpeg / avif 的级别为质量")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--workers", type=int, default=4, help="并行吞吐测试的线程 / 进程数，0 为不测")
+    parser.add_argument("--json", default=None, help="结果另存为 JSON")
+    args = parser.parse_args()
+
+    from PIL import Image
+
+    if args.image:
+        image = Image.open(args.image).convert("RGB")
+    else:
+        width, height = (int(v) for v in args.size.lower().split("x"))
+        image = synthetic(width, height)
+    raw = image.size[0] * image.size[1] * 3
+    metadata = {"prompt": "基准测试 benchmark", "seed": 42, "model": "bench", "steps": 9,
+                "size": f"{image.size[0]}x{image.size[1]}"}
+
+    results = {}
+    for fmt, level in parse_cases(args.formats):
+        label = _label(fmt, level)
+        quality = level if fmt in ("jpeg", "avif") else None
+        level = None if fmt in ("jpeg", "avif") else level
+        try:
+            data = encoding.encode(image, fmt, level, quality, metadata)
+        except (KeyError, OSError, ValueError) as e:
+            print(f"{label:<8} skipped: {e}")
+            continue
+        seconds = []
+        for _ in range(args.repeat):
+            t = time.perf_counter()
+            encoding.encode(image, fmt, level, quality, metadata)
+            seconds.append(time.perf_counter() - t)
+        result = {"ms": round(statistics.median(seconds) * 1000, 1), "kb": round(len(data) / 1024, 1),
+                  "ratio": round(len(data) / raw, 3)}
+
+        if args.workers > 0:
+            count = args.workers * 2
+            # 每个任务一份拷贝：PIL 在 save 期间把参数挂在 Image 对象上，多线程保存同一张图会互相覆盖
+            images = [image.copy() for _ in range(count)]
+            for kind, pool_cls in (("threads", ThreadPoolExecutor), ("processes", ProcessPoolExecutor)):
+                with pool_cls(args.workers) as pool:
+                    list(pool.map(encoding.encode, images[:args.workers], [fmt] * args.workers,
+                                  [level] * args.workers, [quality] * args.workers))  # 预热（进程池启动）
+                    t = time.perf_counter()
+                    list(pool.map(encoding.encode, images, [fmt] * count, [level] * count, [quality] * count))
+                    result[f"{kind}_per_s"] = round(count / (time.perf_counter() - t), 1)
+        results[label] = result
+
+    print(f"image {image.size[0]}x{image.size[1]}, raw {raw / 1024:.0f}KB, median of {args.repeat}"
+          + (f", parallel with {args.workers} workers" if args.workers > 0 else ""))
+    header = f"{'format':<8} {'encode':>9} {'size':>10} {'ratio':>6}"
+    if args.workers > 0:
+        header += f" {'threads':>9} {'procs':>9}"
+    print(header)
+    for label, item in results.items():
+        line = f"{label:<8} {item['ms']:>7.1f}ms {item['kb']:>8.1f}KB {item['ratio']:>6.3f}"
+        if args.workers > 0:
+            line += f" {item['threads_per_s']:>7.1f}/s {item['processes_per_s']:>7.1f}/s"
+        print(line)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"args": vars(args), "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
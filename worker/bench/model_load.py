@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+"""
+模型冷启动基准：from_pretrained 对比预构建快照
+
+每种方式在独立子进程中加载（避免页缓存以外的进程内缓存影响），输出总耗时和各组件耗时。
+快照目录不存在时先构建。用小模型即可在 CPU 上验证，例如：
+
+使用方法:
+    python -m bench.model_load --model Tongyi-MAI/Z-Image-Turbo --snapshot /worker/models/zimage-bf16
+    python -m bench.model_load --model ./tiny-pipeline --snapshot /tmp/tiny-snapshot --device cpu --repeat 3
+"""
+import argparse
+import json
+import subprocess
+import sys
+import time
+
+_CHILD = """
+import json, sys, time
+sys.path.insert(0, {root!r})
+started = time.perf_counter()
+mode, model, snapshot, device = sys.argv[1:5]
+if mode == "snapshot":
+    from zimage_worker import snapshot as snapshots
+    _, timings = snapshots.load(snapshot, device)
+else:
+    import torch, diffusers
+    from zimage_worker.snapshot import resolve_source
+    index = json.loads((resolve_source(model) / "model_index.json").read_text(encoding="utf-8"))
+    cls = getattr(diffusers, index["_class_name"])
+    t = time.perf_counter()
+    pipe = cls.from_pretrained(model, torch_dtype=torch.bfloat16 if device.startswith("cuda") else torch.float32,
+                               low_cpu_mem_usage=True)
+    pipe.to(device)
+    timings = {{"from_pretrained": round(time.perf_counter() - t, 3), "total": round(time.perf_counter() - t, 3)}}
+timings["process"] = round(time.perf_counter() - started, 3)
+print("RESULT " + json.dumps(timings))
+"""
+
+
+def run_child(mode: str, args) -> dict:
+    from pathlib import Path
+    root = str(Path(__file__).resolve().parent.parent)
+    out = subprocess.run(
+        [sys.executable, "-c", _CHILD.format(root=root), mode, args.model, args.snapshot, args.device],
+        capture_output=True, text=True, check=True,
+    ).stdout
+    line = next(l for l in out.splitlines() if l.startswith("RESULT "))
+    return json.loads(line[len("RESULT "):])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="模型冷启动基准")
+    parser.add_argument("--model", default="Tongyi-MAI/Z-Image-Turbo")
+    parser.add_argument("--snapshot", required=True)
+    parser.add_argument("--device", default="cuda")
+    parser.add_argument("--dtype", default=None, help="构建快照的精度，默认 cuda 为 bfloat16、cpu 为 float32")
+    parser.add_argument("--repeat", type=int, default=1)
+    args = parser.parse_args()
+
+    from zimage_worker import snapshot as snapshots
+    if not snapshots.is_snapshot(args.snapshot):
+        started = time.perf_counter()
+        dtype = args.dtype or ("bfloat16" if args.device.startswith("cuda") else "float32")
+        snapshots.build(args.model, args.snapshot, dtype)
+        print(f"built snapshot in {time.perf_counter() - started:.1f}s (one-time)")
+
+    for mode in ("from_pretrained", "snapshot"):
+        for i in range(args.repeat):
+            timings = run_child(mode, args)
+            detail = ", ".join(f"{k} {v:.2f}s" for k, v in timings.items() if k not in ("total", "process"))
+            print(f"{mode:<16} run {i + 1}: total {timings['total']:.2f}s  process {timings['process']:.2f}s  ({detail})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,191 @@
+# -*- coding: utf-8 -*-
+"""
+量化基准：画质 vs 速度
+
+对每种量化模式用相同的提示词和种子生成图片，与不量化（none）的结果逐像素比较，
+输出加载耗时、单张耗时、显存峰值、PSNR 和平均绝对误差。
+--synthetic 不加载模型，只对与 DiT 同形状的 Linear 堆叠测前向耗时和相对误差，CPU 上几秒即可跑完。
+
+使用方法:
+    python -m bench.quantize --modes none,int8,fp8 --size 1024x1024 --images 4
+    python -m bench.quantize --model ./tiny-pipeline --device cpu --modes none,int8 --size 256x256
+    python -m bench.quantize --synthetic --device cpu
+"""
+import argparse
+import gc
+import json
+import time
+
+PROMPTS = [
+    "a red fox sitting in a snowy forest, golden hour",
+    "一碗热腾腾的牛肉面，俯拍，自然光",
+    "isometric illustration of a tiny city on a floating island",
+    "portrait of an old fisherman, film grain, 85mm",
+]
+
+
+def compare(reference, image) -> dict:
+    import numpy as np
+
+    a = np.asarray(reference, dtype=np.float32)
+    b = np.asarray(image, dtype=np.float32)
+    mse = float(((a - b) ** 2).mean())
+    return {
+        "psnr": round(10 * np.log10(255.0 ** 2 / mse), 2) if mse > 0 else float("inf"),
+        "mae": round(float(np.abs(a - b).mean()), 3),
+    }
+
+
+def _peak_mb(device: str):
+    import torch
+    if device.startswith("cuda"):
+        return torch.cuda.max_memory_allocated() // 2 ** 20
+    return None
+
+
+def run_mode(mode: str, args, width: int, height: int) -> dict:
+    import torch
+    from zimage_worker.pipelines import load_zimage
+
+    if args.device.startswith("cuda"):
+        torch.cuda.reset_peak_memory_stats()
+    pipe, timings = load_zimage(args.model, args.device, args.cpu_offload, args.snapshot, mode, args.cache)
+    images, seconds = [], []
+    for i in range(args.images + 1):
+        prompt = PROMPTS[i % len(PROMPTS)]
+        t = time.perf_counter()
+        with torch.inference_mode():
+            image = pipe(
+                prompt=prompt,
+                width=width,
+                height=height,
+                num_inference_steps=args.steps,
+                guidance_scale=0.0,
+                generator=torch.Generator("cpu").manual_seed(args.seed + i),
+            ).images[0]
+        if args.device.startswith("cuda"):
+            torch.cuda.synchronize()
+        if i == 0:
+            continue  # 第一张包含 CUDA 初始化等一次性开销，不计入
+        seconds.append(time.perf_counter() - t)
+        images.append(image)
+    result = {
+        "load_s": timings["total"],
+        "quantize_s": timings.get("quantize", 0.0),
+        "image_s": round(sum(seconds) / len(seconds), 3),
+        "peak_mb": _peak_mb(args.device),
+        "images": images,
+    }
+    del pipe
+    gc.collect()
+    if args.device.startswith("cuda"):
+        torch.cuda.empty_cache()
+    return result
+
+
+def run_synthetic(args) -> dict:
+    """与 DiT 一个 block 的 attention + MLP 同形状的 Linear 堆叠"""
+    import torch
+    from zimage_worker import quantize
+
+    dim, hidden, tokens = args.dim, args.dim * 4, args.tokens
+    dtype = torch.bfloat16 if args.device.startswith("cuda") else torch.float32
+
+    def build():
+        torch.manual_seed(0)
+        layers = []
+        for _ in range(args.layers):
+            layers += [torch.nn.Linear(dim, 3 * dim), torch.nn.Linear(3 * dim, dim),
+                       torch.nn.Linear(dim, hidden), torch.nn.Linear(hidden, dim)]
+        # 每个 Linear 单独调用（不是 Sequential），这里只关心逐层误差和耗时
+        return torch.nn.ModuleList(layers).to(dtype)
+
+    def forward(model, x):
+        out = x
+        for i in range(0, len(model), 4):
+            qkv = model[i](out)
+            out = out + model[i + 1](qkv)
+            out = out + model[i + 3](torch.nn.functional.gelu(model[i + 2](out)))
+        return out
+
+    x = torch.randn(tokens, dim, dtype=dtype)
+    results, reference = {}, None
+    for mode in args.modes:
+        model = build()
+        if mode != "none":
+            if args.device == "cpu" and mode == "int8":
+                quantize.quantize_dynamic_cpu(model)
+            else:
+                quantize.quantize_module(model, mode)
+        model.to(args.device)
+        inputs = x.to(args.device)
+        with torch.inference_mode():
+            forward(model, inputs)  # 预热
+            t = time.perf_counter()
+            for _ in range(args.repeat):
+                out = forward(model, inputs)
+            if args.device.startswith("cuda"):
+                torch.cuda.synchronize()
+            elapsed = (time.perf_counter() - t) / args.repeat
+        out = out.float().cpu()
+        if reference is None:
+            reference = out
+        error = float((out - reference).norm() / reference.norm())
+        results[mode] = {"forward_ms": round(elapsed * 1000, 2), "rel_error": round(error, 5)}
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="量化基准：画质 vs 速度")
+    parser.add_argument("--model", default="Tongyi-MAI/Z-Image-Turbo")
+    parser.add_argument("--snapshot", default="")
+    parser.add_argument("--device", default="cuda")
+    parser.add_argument("--cpu-offload", action="store_true")
+    parser.add_argument("--modes", default="none,int8,fp8", help="逗号分隔，第一个为对照组")
+    parser.add_argument("--cache", default="", help="量化缓存目录")
+    parser.add_argument("--size", default="1024x1024")
+    parser.add_argument("--steps", type=int, default=9)
+    parser.add_argument("--images", type=int, default=4)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--synthetic", action="store_true", help="只测 Linear 堆叠，不加载模型")
+    parser.add_argument("--dim", type=int, default=3840)
+    parser.add_argument("--layers", type=int, default=2)
+    parser.add_argument("--tokens", type=int, default=1024)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--json", default=None, help="结果另存为 JSON")
+    args = parser.parse_args()
+    args.modes = [m.strip() for m in args.modes.split(",") if m.strip()]
+
+    if args.synthetic:
+        results = run_synthetic(args)
+        print(f"{'mode':<6} {'forward':>10} {'rel error':>10}")
+        for mode, item in results.items():
+            print(f"{mode:<6} {item['forward_ms']:>8.2f}ms {item['rel_error']:>10.5f}")
+    else:
+        from zimage_worker.compile_cache import parse_sizes
+        width, height = parse_sizes(args.size)[0]
+        results, reference = {}, None
+        for mode in args.modes:
+            result = run_mode(mode, args, width, height)
+            images = result.pop("images")
+            if reference is None:
+                reference = images
+            scores = [compare(a, b) for a, b in zip(reference, images)]
+            result["psnr"] = round(sum(s["psnr"] for s in scores) / len(scores), 2)
+            result["mae"] = round(sum(s["mae"] for s in scores) / len(scores), 3)
+            results[mode] = result
+
+        base = results[args.modes[0]]["image_s"]
+        print(f"{'mode':<6} {'load':>7} {'quant':>7} {'image':>8} {'speedup':>8} {'peak':>9} {'psnr':>7} {'mae':>7}")
+        for mode, item in results.items():
+            peak = f"{item['peak_mb']}MB" if item["peak_mb"] is not None else "-"
+            print(f"{mode:<6} {item['load_s']:>6.1f}s {item['quantize_s']:>6.1f}s {item['image_s']:>7.2f}s "
+                  f"{base / item['image_s']:>7.2f}x {peak:>9} {item['psnr']:>7.2f} {item['mae']:>7.3f}")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"args": {k: v for k, v in vars(args).items()}, "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+"""
+去噪步间缓存基准：不同阈值的加速比与画质偏差
+
+模型只加载一次，依次用各阈值（0 为对照组，不缓存）以相同的提示词和种子生成图片，
+输出单张耗时、加速比、跳过的步数、与对照组相比的 PSNR 和平均绝对误差。
+
+使用方法:
+    python -m bench.step_cache --thresholds 0,0.05,0.1,0.2 --size 1024x1024 --images 4
+    python -m bench.step_cache --model ./tiny-pipeline --device cpu --size 256x256 --save /tmp/step-cache
+"""
+import argparse
+import json
+import time
+from pathlib import Path
+
+from bench.quantize import PROMPTS, compare
+
+
+def main():
+    parser = argparse.ArgumentParser(description="去噪步间缓存基准")
+    parser.add_argument("--model", default="Tongyi-MAI/Z-Image-Turbo")
+    parser.add_argument("--snapshot", default="")
+    parser.add_argument("--device", default="cuda")
+    parser.add_argument("--cpu-offload", action="store_true")
+    parser.add_argument("--quantize", default="none")
+    parser.add_argument("--thresholds", default="0,0.05,0.1,0.2", help="逗号分隔，0 为对照组")
+    parser.add_argument("--size", default="1024x1024")
+    parser.add_argument("--steps", type=int, default=9)
+    parser.add_argument("--images", type=int, default=4)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--save", default=None, help="保存各阈值生成的图片，便于肉眼对比")
+    parser.add_argument("--json", default=None, help="结果另存为 JSON")
+    args = parser.parse_args()
+
+    import torch
+    from zimage_worker.compile_cache import parse_sizes
+    from zimage_worker.pipelines import load_zimage
+    from zimage_worker.step_cache import StepCache
+
+    thresholds = sorted({float(t) for t in args.thresholds.split(",") if t.strip()} | {0.0})
+    width, height = parse_sizes(args.size)[0]
+    pipe, _ = load_zimage(args.model, args.device, args.cpu_offload, args.snapshot, args.quantize)
+    # 以任意正阈值包装，之后逐个阈值切换；阈值 0 时包装层直通
+    cache = StepCache.attach(pipe.transformer, max(thresholds) or 1.0)
+    if not cache.enabled:
+        raise SystemExit("step cache is not supported by this transformer")
+
+    def generate(i: int):
+        cache.reset()
+        with torch.inference_mode():
+            image = pipe(
+                prompt=PROMPTS[i % len(PROMPTS)],
+                width=width,
+                height=height,
+                num_inference_steps=args.steps,
+                guidance_scale=0.0,
+                generator=torch.Generator("cpu").manual_seed(args.seed + i),
+            ).images[0]
+        if args.device.startswith("cuda"):
+            torch.cuda.synchronize()
+        return image
+
+    cache.threshold, cache.enabled = 0.0, False
+    generate(0)  # 预热，不计入
+
+    results, reference = {}, None
+    for threshold in thresholds:
+        cache.threshold, cache.enabled = threshold, threshold > 0
+        images, seconds, skipped, steps = [], [], 0, 0
+        for i in range(args.images):
+            t = time.perf_counter()
+            images.append(generate(i))
+            seconds.append(time.perf_counter() - t)
+            skipped += cache.skipped
+            steps += cache.steps
+        if reference is None:
+            reference = images
+        scores = [compare(a, b) for a, b in zip(reference, images)]
+        results[threshold] = {
+            "image_s": round(sum(seconds) / len(seconds), 3),
+            "skipped": f"{skipped}/{steps}" if threshold > 0 else "-",
+            "psnr": round(sum(s["psnr"] for s in scores) / len(scores), 2),
+            "mae": round(sum(s["mae"] for s in scores) / len(scores), 3),
+        }
+        if args.save:
+            directory = Path(args.save)
+            directory.mkdir(parents=True, exist_ok=True)
+            for i, image in enumerate(images):
+                image.save(directory / f"t{threshold:g}-{i}.png")
+
+    base = results[0.0]["image_s"]
+    print(f"{'threshold':>9} {'image':>8} {'speedup':>8} {'skipped':>8} {'psnr':>7} {'mae':>7}")
+    for threshold, item in results.items():
+        print(f"{threshold:>9g} {item['image_s']:>7.2f}s {base / item['image_s']:>7.2f}x "
+              f"{item['skipped']:>8} {item['psnr']:>7.2f} {item['mae']:>7.3f}")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"args": vars(args), "results": {str(k): v for k, v in results.items()}}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+"""
+Z-Image Worker
+
+从服务端领取生图任务，生成后上传结果。配置见 .env（DEPLOY.md 第二部分）
+与 zimage_worker.config。
+
+使用方法:
+    python worker.py
+    python worker.py --pipeline dummy --device cpu    # 不加载模型，CPU 联调
+    python worker.py --supervisor --devices cuda:0,cuda:1    # 每张卡一个推理进程
+"""
+import argparse
+import logging
+import os
+import signal
+import sys
+
+# 设置 Windows 终端 UTF-8 编码
+if sys.platform == "win32":
+    os.system("chcp 65001 >nul 2>&1")
+    sys.stdout.reconfigure(encoding='utf-8', errors='replace')
+    sys.stderr.reconfigure(encoding='utf-8', errors='replace')
+
+try:
+    from dotenv import load_dotenv
+    load_dotenv()
+except ImportError:
+    pass
+
+from zimage_worker import Supervisor, Worker, WorkerConfig
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Z-Image Worker")
+    parser.add_argument("--pipeline", choices=["zimage", "dummy"], default=None, help="生图管线（默认读 WORKER_PIPELINE）")
+    parser.add_argument("--device", default=None, help="运行设备（默认读 DEVICE）")
+    parser.add_argument("--supervisor", action="store_true", default=None, help="监督模式：每个设备一个推理进程（默认读 SUPERVISOR）")
+    parser.add_argument("--devices", default=None, help="监督模式的设备列表，如 cuda:0,cuda:1 或 cpu（默认读 WORKER_DEVICES）")
+    parser.add_argument("--procs-per-device", type=int, default=None, help="每个设备的推理进程数（默认读 PROCS_PER_DEVICE）")
+    parser.add_argument("--quantize", choices=["none", "int8", "fp8"], default=None, help="权重量化（默认读 QUANTIZE）")
+    parser.add_argument("--api-base", default=None, help="服务器地址（默认读 REMOTE_API_BASE）")
+    parser.add_argument("--worker-id", default=None, help="Worker ID（默认读 WORKER_ID）")
+    parser.add_argument("--log-level", default=os.getenv("LOG_LEVEL", "INFO"))
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    logging.basicConfig(
+        level=args.log_level.upper(),
+        format="%(asctime)s %(levelname)-7s [%(name)s] %(message)s",
+    )
+    config = WorkerConfig.from_env(
+        pipeline=args.pipeline,
+        device=args.device,
+        quantize=args.quantize,
+        supervisor=args.supervisor,
+        devices=args.devices,
+        procs_per_device=args.procs_per_device,
+        api_base=args.api_base,
+        worker_id=args.worker_id,
+    )
+
+    print("=" * 60)
+    print("  Z-Image Worker")
+    print(f"  ID: {config.worker_id}")
+    print(f"  Name: {config.worker_name}")
+    print(f"  Server: {config.api_base}")
+    if config.supervisor:
+        print(f"  Mode: supervisor ({config.devices} x {config.procs_per_device})")
+    print("=" * 60)
+
+    worker = Supervisor(config) if config.supervisor else Worker(config)
+
+    def on_signal(signum, frame):
+        # 第一次：处理完进行中的任务再退出；第二次：立即退出
+        if worker.stopping:
+            print("\n强制退出")
+            os._exit(1)
+        worker.stop()
+
+    signal.signal(signal.SIGINT, on_signal)
+    signal.signal(signal.SIGTERM, on_signal)
+
+    worker.run()
+
+
+if __name__ == "__main__":
+    main()
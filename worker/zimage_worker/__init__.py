@@ -0,0 +1,15 @@
+# -*- coding: utf-8 -*-
+"""
+Z-Image Worker 运行时
+
+- config：从环境变量 / .env 读取配置
+- api：与服务端 workers / jobs 接口通信（长连接复用的 httpx 客户端）
+- pipelines：生图管线（Z-Image 或 CPU 上的假管线）
+- runtime：领取、推理、编码、上传流水线
+- supervisor：一台机器多设备 / 多进程（共享领取队列和文本编码缓存）
+"""
+from zimage_worker.config import WorkerConfig
+from zimage_worker.runtime import Worker
+from zimage_worker.supervisor import Supervisor
+
+__all__ = ["WorkerConfig", "Worker", "Supervisor"]
@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+"""
+服务端 API 客户端
+
+所有线程共用一个 httpx.Client：连接池保持长连接，心跳、领取、上传不必每次重新握手
+（HTTPS 下尤其明显）。网络错误和 5xx 按指数退避重试。
+"""
+import json
+import logging
+import time
+from typing import Optional
+
+import httpx
+
+from zimage_worker.config import WorkerConfig
+
+logger = logging.getLogger(__name__)
+
+
+class ApiError(Exception):
+    pass
+
+
+class ApiClient:
+    def __init__(self, config: WorkerConfig, transport: Optional[httpx.BaseTransport] = None):
+        self.worker_id = config.worker_id
+        self.retries = config.upload_retries
+        self._client = httpx.Client(
+            base_url=config.api_base.rstrip("/") + "/api",
+            headers={"X-Worker-Id": config.worker_id, "X-Api-Key": config.api_key},
+            timeout=httpx.Timeout(60.0, connect=10.0),
+            limits=httpx.Limits(max_connections=16, max_keepalive_connections=16, keepalive_expiry=120),
+            transport=transport,
+        )
+
+    def _request(self, method: str, path: str, retries: int = 0, **kwargs) -> httpx.Response:
+        delay = 1.0
+        for attempt in range(retries + 1):
+            try:
+                response = self._client.request(method, path, **kwargs)
+                if response.status_code < 500:
+                    return response
+                error = f"HTTP {response.status_code}"
+            except httpx.TransportError as e:
+                error = str(e) or type(e).__name__
+            if attempt < retries:
+                logger.warning("%s %s failed (%s), retrying in %.0fs", method, path, error, delay)
+                time.sleep(delay)
+                delay = min(delay * 2, 30.0)
+        raise ApiError(f"{method} {path} failed: {error}")
+
+    def heartbeat(self, status: str, current_job_id: Optional[str] = None, gpu_info: Optional[dict] = None) -> bool:
+        try:
+            response = self._request("POST", "/workers/heartbeat", json={
+                "worker_id": self.worker_id,
+                "status": status,
+                "current_job_id": current_job_id,
+                "gpu_info": gpu_info,
+            })
+        except ApiError as e:
+            logger.warning("Heartbeat failed: %s", e)
+            return False
+        return response.status_code == 200
+
+    def next_job(self) -> Optional[dict]:
+        """领取下一个任务，队列为空返回 None"""
+        response = self._request("GET", f"/workers/{self.worker_id}/next-job")
+        if response.status_code == 204:
+            return None
+        if response.status_code != 200:
+            raise ApiError(f"next-job: HTTP {response.status_code} {response.text[:200]}")
+        return response.json()
+
+    def update_status(
+        self,
+        job_id: str,
+        status: str,
+        error_message: Optional[str] = None,
+        trace: Optional[dict] = None,
+    ):
+        response = self._request("PATCH", f"/jobs/{job_id}/status", retries=self.retries, json={
+            "status": status,
+            "error_message": error_message,
+            "trace": trace,
+        })
+        if response.status_code != 200:
+            raise ApiError(f"status: HTTP {response.status_code} {response.text[:200]}")
+
+    def upload_result(
+        self,
+        job_id: str,
+        data: bytes,
+        metadata: dict,
+        filename: str = "result.png",
+        content_type: str = "image/png",
+    ):
+        response = self._request(
+            "POST", f"/jobs/{job_id}/result", retries=self.retries,
+            files={"image": (filename, data, content_type)},
+            data={"metadata": json.dumps(metadata, ensure_ascii=False)},
+        )
+        if response.status_code != 200:
+            raise ApiError(f"upload: HTTP {response.status_code} {response.text[:200]}")
+
+    def close(self):
+        self._client.close()
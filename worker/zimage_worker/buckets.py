@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+"""
+分辨率分桶
+
+服务端允许 256~1024 之间的任意宽高。torch.compile 以静态形状编译时每个新尺寸都要重新编译 /
+重新调优内核，随机某个任务就会卡住几十秒。分桶把请求尺寸映射到少量固定尺寸（桶）上生成：
+
+- pad：选能装下请求尺寸、面积最小的桶，生成后居中裁剪回请求尺寸（不重采样）；
+  没有桶装得下、或多算的面积超过 BUCKET_MAX_AREA_RATIO 时退回 snap
+- snap：选宽高比最接近的桶（同比例取面积最接近的），生成后先居中裁剪到请求的宽高比再缩放（不拉伸）；
+  桶与请求的面积比超过 BUCKET_MAX_AREA_RATIO（多算太多或缩放损失太大）时不分桶
+- off：不分桶，按请求尺寸生成（默认；不编译时分桶只会多算，应与 COMPILE=true 一起开启）
+
+BUCKET_CROP=false 时不裁剪 / 缩放，直接返回桶尺寸的图片。
+预热（zimage_worker.compile_cache）在分桶开启时覆盖全部桶，各尺寸命中次数随心跳 gpu_info 上报。
+"""
+import threading
+from typing import Dict, List, Optional, Tuple
+
+# 宽 x 高，均为 64 的倍数（VAE 8 倍下采样 x patch 2，再留余量）
+DEFAULT_BUCKETS = "1024x1024,1024x768,768x1024,1024x576,576x1024,768x768,768x512,512x768,512x512"
+MODES = ("off", "pad", "snap")
+MAX_AREA_RATIO = 1.5
+
+
+class BucketPolicy:
+    def __init__(self, buckets: List[Tuple[int, int]], mode: str = "pad", crop: bool = True,
+                 max_area_ratio: float = MAX_AREA_RATIO):
+        if mode not in MODES:
+            raise ValueError(f"unknown bucket mode: {mode}")
+        self.buckets = sorted(set(buckets), key=lambda size: (size[0] * size[1], size))
+        self.mode = mode if self.buckets else "off"
+        self.crop = crop
+        self.max_area_ratio = max_area_ratio
+        self._hits: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config) -> "BucketPolicy":
+        from zimage_worker.compile_cache import parse_sizes
+        return cls(parse_sizes(config.buckets), config.bucket_mode, config.bucket_crop, config.bucket_max_area_ratio)
+
+    @property
+    def enabled(self) -> bool:
+        return self.mode != "off"
+
+    def _pads(self, bucket: Tuple[int, int], width: int, height: int) -> bool:
+        """桶能装下请求尺寸，且多算的面积在上限内（pad 可用）"""
+        return (bucket[0] >= width and bucket[1] >= height
+                and bucket[0] * bucket[1] <= width * height * self.max_area_ratio)
+
+    def choose(self, width: int, height: int) -> Tuple[int, int]:
+        """请求尺寸 -> 生成尺寸"""
+        if not self.enabled or (width, height) in self.buckets:
+            return width, height
+        if self.mode == "pad":
+            # 按面积升序，第一个装得下的就是最小的；它多算太多时更大的桶只会更多，退回 snap
+            for bucket in self.buckets:
+                if bucket[0] >= width and bucket[1] >= height:
+                    if self._pads(bucket, width, height):
+                        return bucket
+                    break
+        ratio = width / height
+        bucket = min(
+            self.buckets,
+            key=lambda b: (abs(b[0] / b[1] - ratio), abs(b[0] * b[1] - width * height)),
+        )
+        scale = bucket[0] * bucket[1] / (width * height)
+        if scale > self.max_area_ratio or scale < 1 / self.max_area_ratio:
+            return width, height
+        return bucket
+
+    def record(self, size: Tuple[int, int]):
+        """记录实际生成尺寸（不分桶时即请求尺寸的分布，可据此调整桶）"""
+        key = f"{size[0]}x{size[1]}"
+        with self._lock:
+            self._hits[key] = self._hits.get(key, 0) + 1
+
+    def finish(self, image, requested: Tuple[int, int]):
+        """把桶尺寸的图片还原为请求尺寸"""
+        if not self.crop or image.size == tuple(requested):
+            return image
+        width, height = requested
+        if self.mode == "pad" and self._pads(image.size, width, height):
+            left = (image.size[0] - width) // 2
+            top = (image.size[1] - height) // 2
+            return image.crop((left, top, left + width, top + height))
+        # snap：先居中裁剪到请求的宽高比，再缩放，不拉伸画面
+        from PIL import Image
+        source_width, source_height = image.size
+        if source_width * height > width * source_height:
+            cropped = round(source_height * width / height)
+            left = (source_width - cropped) // 2
+            image = image.crop((left, 0, left + cropped, source_height))
+        elif source_width * height < width * source_height:
+            cropped = round(source_width * height / width)
+            top = (source_height - cropped) // 2
+            image = image.crop((0, top, source_width, top + cropped))
+        return image.resize((width, height), Image.LANCZOS)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._hits)
+
+    def warmup_sizes(self) -> Optional[List[Tuple[int, int]]]:
+        return list(self.buckets) if self.enabled else None
@@ -0,0 +1,206 @@
+# -*- coding: utf-8 -*-
+"""
+torch.compile 持久化缓存
+
+inductor / triton 的编译产物默认在 /tmp，每次重启（尤其是容器）都要重新编译，
+重启后的第一个任务要多等几十秒到几分钟。这里把缓存放到持久目录：
+
+    <COMPILE_CACHE_DIR>/<键>/
+        inductor/   TORCHINDUCTOR_CACHE_DIR（FX graph / autograd 缓存）
+        triton/     TRITON_CACHE_DIR
+        artifacts.bin   torch.compiler.save_cache_artifacts() 的打包产物（torch>=2.6）
+        warm.json   已预热的尺寸
+
+键由模型指纹、精度、torch / CUDA 版本和设备型号决定，任一变化都换一个目录，旧产物不会被误用。
+transformer 以静态形状编译（dynamic=False），每个尺寸一份内核，尺寸信息由 inductor 自己的图缓存键区分；
+warm.json 只用于启动时报告哪些尺寸已有缓存。
+
+使用方法（预热常用尺寸，之后 Worker / generate.py --compile 启动即命中缓存）:
+    python -m zimage_worker.compile_cache warmup --sizes 1024x1024,768x1024,1024x768
+"""
+import argparse
+import hashlib
+import json
+import logging
+import os
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_ROOT = Path.home() / ".cache" / "zimage" / "compile"
+DEFAULT_SIZES = "1024x1024,768x1024,1024x768"
+
+
+def parse_sizes(text: str) -> List[Tuple[int, int]]:
+    """'1024x1024,768x1024' -> [(宽, 高), ...]"""
+    sizes = []
+    for item in text.split(","):
+        item = item.strip().lower()
+        if item:
+            width, height = item.split("x")
+            sizes.append((int(width), int(height)))
+    return sizes
+
+
+def _counters() -> Dict[str, int]:
+    try:
+        from torch._dynamo.utils import counters
+    except ImportError:
+        return {"hit": 0, "miss": 0}
+    inductor = counters["inductor"]
+    return {"hit": inductor.get("fxgraph_cache_hit", 0), "miss": inductor.get("fxgraph_cache_miss", 0)}
+
+
+class CompileCache:
+    def __init__(self, root, fingerprint: str, dtype: str, device: str):
+        import torch
+
+        device_name = "cpu"
+        if device.startswith("cuda") and torch.cuda.is_available():
+            device_name = torch.cuda.get_device_name(torch.device(device).index or 0)
+        parts = {
+            "model": fingerprint,
+            "dtype": dtype,
+            "torch": torch.__version__,
+            "cuda": torch.version.cuda or "",
+            "device": device_name,
+        }
+        self.key = hashlib.sha256(json.dumps(parts, sort_keys=True).encode()).hexdigest()[:16]
+        self.dir = Path(root or DEFAULT_ROOT) / self.key
+        self.parts = parts
+
+    @property
+    def _warm_file(self) -> Path:
+        return self.dir / "warm.json"
+
+    def warm_sizes(self) -> set:
+        try:
+            return {tuple(size) for size in json.loads(self._warm_file.read_text())}
+        except (OSError, ValueError):
+            return set()
+
+    def activate(self):
+        """在首次编译前调用：把 inductor / triton 缓存指到持久目录并载入打包产物"""
+        import torch
+
+        (self.dir / "inductor").mkdir(parents=True, exist_ok=True)
+        (self.dir / "triton").mkdir(parents=True, exist_ok=True)
+        (self.dir / "key.json").write_text(json.dumps(self.parts, indent=2))
+        os.environ["TORCHINDUCTOR_CACHE_DIR"] = str(self.dir / "inductor")
+        os.environ["TRITON_CACHE_DIR"] = str(self.dir / "triton")
+        os.environ.setdefault("TORCHINDUCTOR_FX_GRAPH_CACHE", "1")
+        os.environ.setdefault("TORCHINDUCTOR_AUTOGRAD_CACHE", "1")
+        import torch._inductor.config as inductor_config
+        inductor_config.fx_graph_cache = True
+
+        artifacts = self.dir / "artifacts.bin"
+        if artifacts.exists() and hasattr(torch.compiler, "load_cache_artifacts"):
+            try:
+                torch.compiler.load_cache_artifacts(artifacts.read_bytes())
+            except Exception as e:
+                logger.warning("Ignoring unreadable compile artifacts: %s", e)
+
+    def mark_warm(self, sizes):
+        import torch
+
+        warm = self.warm_sizes() | {tuple(size) for size in sizes}
+        self._warm_file.write_text(json.dumps(sorted(warm)))
+        if hasattr(torch.compiler, "save_cache_artifacts"):
+            try:
+                saved = torch.compiler.save_cache_artifacts()
+                if saved:
+                    (self.dir / "artifacts.bin").write_bytes(saved[0])
+            except Exception as e:
+                logger.warning("Failed to save compile artifacts: %s", e)
+
+
+def compile_pipeline(pipe, cache: Optional[CompileCache]):
+    """以静态形状编译 transformer（与 generate.py --compile 相同的模块，加上持久缓存）"""
+    if cache is not None:
+        cache.activate()
+        warm = cache.warm_sizes()
+        logger.info("Compile cache %s: %d warm size(s) %s", cache.dir, len(warm),
+                    ", ".join(f"{w}x{h}" for w, h in sorted(warm)) or "-")
+    pipe.transformer.compile(dynamic=False)
+
+
+def warmup(pipe, sizes, cache: Optional[CompileCache] = None, steps: int = 2) -> dict:
+    """
+    按尺寸各跑一次少步数推理，触发编译（或从缓存载入），返回报告
+
+    {"sizes": {"1024x1024": {"seconds": 3.2, "cached": True}}, "hit": n, "miss": n, "seconds": 总耗时}
+    """
+    import torch
+
+    before = _counters()
+    warm_before = cache.warm_sizes() if cache else set()
+    report = {"sizes": {}}
+    started = time.perf_counter()
+    for width, height in sizes:
+        t = time.perf_counter()
+        with torch.inference_mode():
+            pipe(
+                prompt="warmup",
+                width=width,
+                height=height,
+                num_inference_steps=steps,
+                guidance_scale=0.0,
+                generator=torch.Generator("cpu").manual_seed(0),
+            )
+        report["sizes"][f"{width}x{height}"] = {
+            "seconds": round(time.perf_counter() - t, 2),
+            "cached": (width, height) in warm_before,
+        }
+    after = _counters()
+    report["hit"] = after["hit"] - before["hit"]
+    report["miss"] = after["miss"] - before["miss"]
+    report["seconds"] = round(time.perf_counter() - started, 2)
+    if cache:
+        cache.mark_warm(sizes)
+    return report
+
+
+def format_report(report: dict) -> str:
+    sizes = ", ".join(
+        f"{size} {item['seconds']:.1f}s{' (cached)' if item['cached'] else ''}"
+        for size, item in report["sizes"].items()
+    )
+    return f"{report['seconds']:.1f}s, fx graph cache hit {report['hit']} / miss {report['miss']}: {sizes}"
+
+
+def main(argv: Optional[list] = None):
+    parser = argparse.ArgumentParser(description="torch.compile 缓存预热")
+    sub = parser.add_subparsers(dest="command", required=True)
+    warm_parser = sub.add_parser("warmup", help="加载模型、编译并预热各尺寸（配置读环境变量 / .env）")
+    warm_parser.add_argument(
+        "--sizes", default=None,
+        help=f"默认读 WARMUP_SIZES（分桶开启时为全部桶），否则 {DEFAULT_SIZES}；显式指定时不按分桶展开",
+    )
+    warm_parser.add_argument("--steps", type=int, default=2)
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(name)s] %(message)s")
+    try:
+        from dotenv import load_dotenv
+        load_dotenv()
+    except ImportError:
+        pass
+
+    from zimage_worker.config import WorkerConfig
+    from zimage_worker.pipelines import ZImageGenerator
+
+    config = WorkerConfig.from_env(compile=True)
+    if args.sizes:
+        # 显式尺寸优先：只预热这些尺寸，不按分桶展开
+        config.warmup_sizes = args.sizes
+        config.bucket_mode = "off"
+    config.warmup_steps = args.steps
+    generator = ZImageGenerator(config)
+    generator.load()
+    print(f"compile cache: {generator.compile_cache.dir}")
+    print(f"warm-up: {format_report(generator.warmup_report)}")
+
+
+if __name__ == "__main__":
+    main()
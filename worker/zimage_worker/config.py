@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+"""Worker 配置（环境变量，兼容 DEPLOY.md 中的 .env）"""
+import os
+from dataclasses import dataclass, fields
+from typing import Mapping, Optional
+
+from zimage_worker.buckets import DEFAULT_BUCKETS
+
+
+def _bool(value: str) -> bool:
+    return value.strip().lower() in ("1", "true", "yes", "on")
+
+
+@dataclass
+class WorkerConfig:
+    # Worker 标识
+    worker_id: str = "worker-local"
+    worker_name: str = ""
+    # 服务器连接
+    api_base: str = "http://localhost:8000"
+    api_key: str = "dev-api-key-change-in-production"
+    # 模型
+    model_id: str = "Tongyi-MAI/Z-Image-Turbo"
+    device: str = "cuda"
+    cpu_offload: bool = False
+    model_snapshot: str = ""  # 预构建快照目录（见 zimage_worker.snapshot），不存在时首次启动自动构建
+    quantize: str = "none"  # none / int8 / fp8，transformer 与 text_encoder 仅权重量化（见 zimage_worker.quantize）
+    quantize_cache_dir: str = ""  # 为空时为 ~/.cache/zimage/quantized
+    cache_threshold: float = 0.0  # 去噪步间缓存阈值，0 为关闭（见 zimage_worker.step_cache）
+    memory_mode: str = "auto"  # auto / low / off：VAE 分块解码与 attention 分块（见 zimage_worker.memory）
+    compile: bool = False  # torch.compile transformer（缓存见 zimage_worker.compile_cache）
+    compile_cache_dir: str = ""  # 为空时为 ~/.cache/zimage/compile
+    warmup_sizes: str = "1024x1024,768x1024,1024x768"  # 启动时预热的尺寸（宽x高），分桶开启时改为全部桶
+    warmup_steps: int = 2
+    bucket_mode: str = "off"  # off / pad / snap，见 zimage_worker.buckets；只对 compile 的静态形状有收益
+    buckets: str = DEFAULT_BUCKETS
+    bucket_crop: bool = True  # 裁剪 / 缩放回请求尺寸
+    bucket_max_area_ratio: float = 1.5  # 桶与请求的面积比上限，超过时 pad 退回 snap、snap 不分桶
+    text_cache_dir: str = ""  # 文本编码缓存目录（建议 tmpfs），为空不缓存；监督模式下默认 /dev/shm 下的目录
+    text_cache_size: int = 256
+    pipeline: str = "zimage"  # zimage / dummy（CPU 假管线，用于联调和测试）
+    # 监督模式（见 zimage_worker.supervisor）：每个设备一个（或多个）推理进程
+    supervisor: bool = False
+    devices: str = "auto"  # 逗号分隔，如 cuda:0,cuda:1 或 cpu；auto 为全部 GPU，没有 GPU 时为 cpu
+    procs_per_device: int = 1
+    cpu_cores: str = ""  # 各 CPU 进程绑定的核，分号分隔，如 0-7;8-15；为空时平均划分
+    # 结果图片编码（见 zimage_worker.encoding）
+    encode_format: str = "png"  # png / webp（无损）/ jpeg / avif
+    encode_level: int = -1  # PNG 压缩级别 0~9 / WebP method 0~6，-1 为格式默认值
+    encode_quality: int = 0  # JPEG / AVIF 质量，0 为格式默认值
+    encode_processes: int = 0  # >0 时在进程池中编码
+    # 本地备份（为空则不备份）
+    backup_root: str = ""
+    # 调度
+    poll_interval: float = 2.0  # 队列为空时的轮询间隔（秒）
+    heartbeat_interval: float = 10.0  # 需小于服务端 WORKER_HEARTBEAT_TIMEOUT
+    prefetch_jobs: int = 1  # 推理当前任务时预先领取的任务数，0 为不预取
+    encode_threads: int = 2  # 后台编码 / 上传线程数，0 为在推理线程内串行完成
+    max_pending_uploads: int = 4  # 等待编码 / 上传的图片上限，超过后推理等待
+    upload_retries: int = 3
+    drain_timeout: float = 120.0  # 收到 SIGTERM 后等待进行中任务完成的上限（秒）
+    # 假管线每步耗时（秒）
+    dummy_step_seconds: float = 0.05
+
+    # 字段 -> 环境变量
+    ENV = {
+        "worker_id": "WORKER_ID",
+        "worker_name": "WORKER_NAME",
+        "api_base": "REMOTE_API_BASE",
+        "api_key": "WORKER_API_KEY",
+        "model_id": "MODEL_ID",
+        "device": "DEVICE",
+        "cpu_offload": "USE_CPU_OFFLOAD",
+        "model_snapshot": "MODEL_SNAPSHOT",
+        "quantize": "QUANTIZE",
+        "quantize_cache_dir": "QUANTIZE_CACHE_DIR",
+        "cache_threshold": "CACHE_THRESHOLD",
+        "memory_mode": "MEMORY_MODE",
+        "compile": "COMPILE",
+        "compile_cache_dir": "COMPILE_CACHE_DIR",
+        "warmup_sizes": "WARMUP_SIZES",
+        "warmup_steps": "WARMUP_STEPS",
+        "bucket_mode": "BUCKET_MODE",
+        "buckets": "BUCKETS",
+        "bucket_crop": "BUCKET_CROP",
+        "bucket_max_area_ratio": "BUCKET_MAX_AREA_RATIO",
+        "text_cache_dir": "TEXT_CACHE_DIR",
+        "text_cache_size": "TEXT_CACHE_SIZE",
+        "pipeline": "WORKER_PIPELINE",
+        "supervisor": "SUPERVISOR",
+        "devices": "WORKER_DEVICES",
+        "procs_per_device": "PROCS_PER_DEVICE",
+        "cpu_cores": "CPU_CORES",
+        "encode_format": "ENCODE_FORMAT",
+        "encode_level": "ENCODE_LEVEL",
+        "encode_quality": "ENCODE_QUALITY",
+        "encode_processes": "ENCODE_PROCESSES",
+        "backup_root": "LOCAL_BACKUP_ROOT",
+        "poll_interval": "POLL_INTERVAL",
+        "heartbeat_interval": "HEARTBEAT_INTERVAL",
+        "prefetch_jobs": "PREFETCH_JOBS",
+        "encode_threads": "ENCODE_THREADS",
+        "max_pending_uploads": "MAX_PENDING_UPLOADS",
+        "upload_retries": "UPLOAD_RETRIES",
+        "drain_timeout": "DRAIN_TIMEOUT",
+        "dummy_step_seconds": "DUMMY_STEP_SECONDS",
+    }
+
+    @classmethod
+    def from_env(cls, env: Optional[Mapping[str, str]] = None, **overrides) -> "WorkerConfig":
+        env = os.environ if env is None else env
+        values = {}
+        for field in fields(cls):
+            name = cls.ENV.get(field.name)
+            if name and env.get(name, "") != "":
+                raw = env[name]
+                if field.type in (bool, "bool"):
+                    values[field.name] = _bool(raw)
+                elif field.type in (int, "int"):
+                    values[field.name] = int(raw)
+                elif field.type in (float, "float"):
+                    values[field.name] = float(raw)
+                else:
+                    values[field.name] = raw
+        values.update({k: v for k, v in overrides.items() if v is not None})
+        config = cls(**values)
+        if not config.worker_name:
+            config.worker_name = config.worker_id
+        return config
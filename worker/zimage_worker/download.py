@@ -0,0 +1,478 @@
+# -*- coding: utf-8 -*-
+"""
+模型下载器（并发分块、断点续传、校验）
+
+from_pretrained 单连接顺序下载约 25GB，中断后只能从头来，下载完也不校验。这里直接走
+Hub 的 HTTP 接口下载到普通目录（可作为 --model 传给 generate.py，或用来构建快照）：
+
+- 文件列表和校验值取自 /api/models/<repo>/revision/<rev>?blobs=true：
+  LFS 文件校验 sha256，普通文件校验 git blob sha1
+- 大文件按 CHUNK 切块，多个块 / 多个文件并发 Range 下载，写入 <文件>.part
+- 已完成的块记在 <文件>.part.json，中断后重跑只下载缺的块
+- 校验通过才改名为正式文件，并记入 <目录>/.download.json；再次运行时大小一致的文件直接跳过
+  （--verify 重新计算已有文件的校验值，不一致的重新下载）
+- 终端实时显示进度、速度和剩余时间
+
+--endpoint 可换镜像（如 https://hf-mirror.com，默认读 HF_ENDPOINT）。
+serve 子命令把本地目录按同样的接口发布出来（支持 Range），用于本地测试：
+
+    python -m zimage_worker.download serve ./tiny-model --port 8900
+    python -m zimage_worker.download get org/tiny-model --endpoint http://127.0.0.1:8900 --output /tmp/tiny
+"""
+import argparse
+import hashlib
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path, PurePosixPath
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_ENDPOINT = "https://huggingface.co"
+CHUNK = 64 * 2 ** 20
+MANIFEST = ".download.json"
+
+
+class DownloadError(Exception):
+    pass
+
+
+class RangeNotSupported(DownloadError):
+    pass
+
+
+def _git_blob_sha1(path: Path) -> str:
+    digest = hashlib.sha1(f"blob {path.stat().st_size}\0".encode())
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(8 * 2 ** 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _sha256(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(8 * 2 ** 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _human(n: float) -> str:
+    for unit in ("B", "KB", "MB", "GB"):
+        if n < 1024 or unit == "GB":
+            return f"{n:.1f}{unit}"
+        n /= 1024
+
+
+class Progress:
+    """汇总所有线程的下载字节数，定时在一行内刷新"""
+
+    def __init__(self, total: int, done: int, enabled: bool = True):
+        self.total = total
+        self.done = done
+        self.session = 0
+        self.started = time.monotonic()
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._loop, daemon=True)
+
+    def add(self, n: int):
+        with self._lock:
+            self.done += n
+            self.session += n
+
+    def start(self):
+        if self.enabled:
+            self._thread.start()
+
+    def finish(self):
+        self._stop.set()
+        if self.enabled:
+            self._thread.join()
+            self._print()
+            sys.stdout.write("\n")
+
+    def speed(self) -> float:
+        return self.session / max(time.monotonic() - self.started, 1e-6)
+
+    def _print(self):
+        speed = self.speed()
+        left = self.total - self.done
+        eta = f"{left / speed / 60:.1f}min" if speed > 0 and left > 0 else "-"
+        percent = self.done / self.total * 100 if self.total else 100.0
+        sys.stdout.write(
+            f"\r  {_human(self.done)} / {_human(self.total)}  {percent:5.1f}%  {_human(speed)}/s  ETA {eta}   "
+        )
+        sys.stdout.flush()
+
+    def _loop(self):
+        while not self._stop.wait(1.0):
+            self._print()
+
+
+class Downloader:
+    def __init__(self, repo: str, output, revision: str = "main", endpoint: Optional[str] = None,
+                 token: Optional[str] = None, workers: int = 8, chunk_size: int = CHUNK, progress: bool = True,
+                 verify_existing: bool = False):
+        import httpx
+
+        self.repo = repo
+        self.output = Path(output)
+        self.revision = revision
+        self.endpoint = (endpoint or os.environ.get("HF_ENDPOINT") or DEFAULT_ENDPOINT).rstrip("/")
+        self.workers = workers
+        self.chunk_size = chunk_size
+        self.show_progress = progress
+        self.verify_existing = verify_existing
+        token = token or os.environ.get("HF_TOKEN")
+        self._client = httpx.Client(
+            headers={"Authorization": f"Bearer {token}"} if token else {},
+            timeout=httpx.Timeout(60.0, connect=15.0),
+            limits=httpx.Limits(max_connections=workers * 2, max_keepalive_connections=workers * 2),
+            follow_redirects=True,
+        )
+        self._manifest_lock = threading.Lock()
+        self.progress: Optional[Progress] = None
+
+    # ---------- 文件列表 ----------
+
+    def list_files(self) -> List[dict]:
+        """[{"path", "size", "sha256" 或 "sha1"}]，并把 revision 固定为具体提交"""
+        url = f"{self.endpoint}/api/models/{self.repo}/revision/{self.revision}"
+        response = self._client.get(url, params={"blobs": "true"})
+        if response.status_code != 200:
+            raise DownloadError(f"listing {self.repo}@{self.revision}: HTTP {response.status_code} {response.text[:200]}")
+        info = response.json()
+        self.revision = info.get("sha") or self.revision
+        files = []
+        for sibling in info.get("siblings", []):
+            lfs = sibling.get("lfs") or {}
+            item = {"path": self._safe_path(sibling["rfilename"]), "size": lfs.get("size", sibling.get("size"))}
+            if lfs.get("sha256"):
+                item["sha256"] = lfs["sha256"]
+            elif sibling.get("blobId"):
+                item["sha1"] = sibling["blobId"]
+            if item["size"] is None:
+                raise DownloadError(f"no size for {item['path']} (listing without blobs=true?)")
+            files.append(item)
+        return files
+
+    def _safe_path(self, path: str) -> str:
+        """列表中的文件名只能是输出目录下的相对路径（镜像或服务端不可信）"""
+        pure = PurePosixPath(path)
+        if not path or "\\" in path or pure.is_absolute() or ".." in pure.parts:
+            raise DownloadError(f"unsafe path in listing: {path!r}")
+        root = self.output.resolve()
+        if not (root / pure).resolve().is_relative_to(root):
+            raise DownloadError(f"unsafe path in listing: {path!r}")
+        return path
+
+    def _url(self, path: str) -> str:
+        return f"{self.endpoint}/{self.repo}/resolve/{self.revision}/{path}"
+
+    # ---------- 本地清单 ----------
+
+    def _read_manifest(self) -> dict:
+        try:
+            return json.loads((self.output / MANIFEST).read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return {}
+
+    def _record(self, item: dict):
+        with self._manifest_lock:
+            manifest = self._read_manifest()
+            manifest.setdefault("files", {})[item["path"]] = {
+                k: item[k] for k in ("size", "sha256", "sha1") if k in item
+            }
+            manifest.update({"repo": self.repo, "revision": self.revision, "endpoint": self.endpoint})
+            tmp = self.output / f"{MANIFEST}.tmp"
+            tmp.write_text(json.dumps(manifest, indent=2, ensure_ascii=False), encoding="utf-8")
+            tmp.replace(self.output / MANIFEST)
+
+    def _is_done(self, item: dict, manifest: dict) -> bool:
+        target = self.output / item["path"]
+        recorded = manifest.get("files", {}).get(item["path"])
+        expected = {k: item[k] for k in ("size", "sha256", "sha1") if k in item}
+        if not (target.exists() and target.stat().st_size == item["size"] and recorded == expected):
+            return False
+        if not self.verify_existing:
+            return True
+        if "sha256" in item:
+            return _sha256(target) == item["sha256"]
+        return "sha1" not in item or _git_blob_sha1(target) == item["sha1"]
+
+    # ---------- 下载 ----------
+
+    def _chunks(self, item: dict) -> List[tuple]:
+        size = item["size"]
+        if size == 0:
+            return []
+        return [(start, min(start + self.chunk_size, size) - 1) for start in range(0, size, self.chunk_size)]
+
+    def _state_path(self, item: dict) -> Path:
+        return self.output / f"{item['path']}.part.json"
+
+    def _load_state(self, item: dict) -> set:
+        try:
+            state = json.loads(self._state_path(item).read_text())
+        except (OSError, ValueError):
+            return set()
+        # 块大小变了就不能沿用
+        if state.get("chunk_size") != self.chunk_size or state.get("size") != item["size"]:
+            return set()
+        return set(state.get("done", []))
+
+    def _save_state(self, item: dict, done: set):
+        path = self._state_path(item)
+        tmp = path.with_suffix(".tmp")
+        tmp.write_text(json.dumps({"size": item["size"], "chunk_size": self.chunk_size, "done": sorted(done)}))
+        tmp.replace(path)
+
+    def _fetch_chunk(self, item: dict, index: int, start: int, end: int, retries: int = 4):
+        part = self.output / f"{item['path']}.part"
+        ranged = not (start == 0 and end == item["size"] - 1)
+        delay = 1.0
+        for attempt in range(retries + 1):
+            written = 0
+            try:
+                with self._client.stream("GET", self._url(item["path"]), headers={"Range": f"bytes={start}-{end}"}) as response:
+                    if response.status_code == 200 and ranged:
+                        raise RangeNotSupported("server ignored the Range header, retry with --chunk-size 0")
+                    if response.status_code not in (200, 206):
+                        raise DownloadError(f"HTTP {response.status_code}")
+                    # 每个块各自打开文件，按偏移写入，互不干扰
+                    fd = os.open(part, os.O_WRONLY | getattr(os, "O_BINARY", 0))
+                    try:
+                        for block in response.iter_bytes(2 ** 20):
+                            _write_at(fd, block, start + written)
+                            written += len(block)
+                            self.progress.add(len(block))
+                    finally:
+                        os.close(fd)
+                if written != end - start + 1:
+                    raise DownloadError(f"short read {written}/{end - start + 1}")
+                return
+            except RangeNotSupported:
+                raise
+            except Exception as e:  # 网络错误、5xx、连接中断
+                self.progress.add(-written)
+                if attempt == retries:
+                    raise DownloadError(f"{item['path']} [{start}-{end}]: {e}") from e
+                logger.warning("%s chunk %d failed (%s), retrying in %.0fs", item["path"], index, e, delay)
+                time.sleep(delay)
+                delay = min(delay * 2, 30.0)
+
+    def _verify(self, item: dict):
+        part = self.output / f"{item['path']}.part"
+        if "sha256" in item:
+            actual, expected = _sha256(part), item["sha256"]
+        elif "sha1" in item:
+            actual, expected = _git_blob_sha1(part), item["sha1"]
+        else:
+            actual = expected = None
+        if actual != expected:
+            part.unlink(missing_ok=True)
+            self._state_path(item).unlink(missing_ok=True)
+            raise DownloadError(f"checksum mismatch for {item['path']}: expected {expected}, got {actual}")
+        part.replace(self.output / item["path"])
+        self._state_path(item).unlink(missing_ok=True)
+        self._record(item)
+
+    def download(self) -> dict:
+        """下载并校验全部文件，返回 {"files", "skipped", "bytes", "seconds", "speed"}"""
+        started = time.monotonic()
+        files = self.list_files()
+        self.output.mkdir(parents=True, exist_ok=True)
+        manifest = self._read_manifest()
+
+        pending, skipped = [], 0
+        for item in files:
+            if self._is_done(item, manifest):
+                skipped += 1
+            else:
+                pending.append(item)
+
+        jobs, already = [], 0
+        remaining: Dict[str, set] = {}
+        done_chunks: Dict[str, set] = {}
+        for item in pending:
+            target = self.output / f"{item['path']}.part"
+            target.parent.mkdir(parents=True, exist_ok=True)
+            if target.exists() and target.stat().st_size == item["size"]:
+                done = self._load_state(item)
+            else:
+                done = set()
+                with open(target, "wb") as f:
+                    f.truncate(item["size"])
+            chunks = self._chunks(item)
+            for index, (start, end) in enumerate(chunks):
+                if index in done:
+                    already += end - start + 1
+                else:
+                    jobs.append((item, index, start, end))
+            done_chunks[item["path"]] = done
+            remaining[item["path"]] = {i for i in range(len(chunks)) if i not in done}
+
+        total = sum(item["size"] for item in pending)
+        self.progress = Progress(total, already, self.show_progress)
+        logger.info("%s@%s from %s: %d files, %d already verified, %s to download",
+                    self.repo, self.revision[:12], self.endpoint, len(files), skipped, _human(total - already))
+        self.progress.start()
+        pool = ThreadPoolExecutor(self.workers, thread_name_prefix="download")
+        try:
+            # 空文件和续传时已下完所有块的文件直接校验
+            verifies = [pool.submit(self._verify, item) for item in pending if not remaining[item["path"]]]
+            futures = {pool.submit(self._fetch_chunk, *job): job for job in jobs}
+            for future in as_completed(futures):
+                item, index = futures[future][:2]
+                future.result()
+                path = item["path"]
+                done_chunks[path].add(index)
+                remaining[path].discard(index)
+                self._save_state(item, done_chunks[path])
+                if not remaining[path]:
+                    verifies.append(pool.submit(self._verify, item))
+            for future in verifies:
+                future.result()
+        finally:
+            # 出错或 Ctrl+C 时不再开始新的块；已完成的块记录在 .part.json，重跑时续传
+            pool.shutdown(wait=True, cancel_futures=True)
+            self.progress.finish()
+            self._client.close()
+
+        seconds = time.monotonic() - started
+        return {
+            "files": len(files),
+            "skipped": skipped,
+            "bytes": self.progress.session,
+            "seconds": round(seconds, 1),
+            "speed": self.progress.speed(),
+        }
+
+
+def _seek_write(fd: int, data: bytes, offset: int):
+    os.lseek(fd, offset, os.SEEK_SET)
+    os.write(fd, data)
+
+
+# Windows 没有 os.pwrite
+_write_at = getattr(os, "pwrite", _seek_write)
+
+
+# ---------- 本地测试服务 ----------
+
+def serve(directory, port: int = 8900, host: str = "127.0.0.1", repo_prefix: str = ""):
+    """
+    把本地目录按 Hub 接口发布：任意 <repo> 的 revision 列表和 resolve 下载（支持 Range）
+
+    列表中大于 1MB 的文件按 LFS（sha256）描述，其余按普通文件（git blob sha1）。
+    """
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+    from urllib.parse import unquote, urlparse
+
+    root = Path(directory).resolve()
+
+    def listing() -> dict:
+        siblings = []
+        for path in sorted(p for p in root.rglob("*") if p.is_file()):
+            rel = path.relative_to(root).as_posix()
+            size = path.stat().st_size
+            if size > 2 ** 20:
+                siblings.append({"rfilename": rel, "size": size, "lfs": {"sha256": _sha256(path), "size": size}})
+            else:
+                siblings.append({"rfilename": rel, "size": size, "blobId": _git_blob_sha1(path)})
+        return {"sha": "0" * 40, "siblings": siblings}
+
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, format, *args):
+            logger.debug(format, *args)
+
+        def _json(self, data: dict):
+            body = json.dumps(data).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            parts = unquote(urlparse(self.path).path).strip("/").split("/")
+            if parts[:2] == ["api", "models"] and "revision" in parts:
+                return self._json(listing())
+            if "resolve" not in parts:
+                return self.send_error(404)
+            rel = "/".join(parts[parts.index("resolve") + 2:])
+            path = (root / rel).resolve()
+            if root not in path.parents or not path.is_file():
+                return self.send_error(404)
+            size = path.stat().st_size
+            start, end = 0, size - 1
+            header = self.headers.get("Range")
+            if header and header.startswith("bytes="):
+                first, _, last = header[6:].partition("-")
+                start, end = int(first or 0), min(int(last) if last else size - 1, size - 1)
+                self.send_response(206)
+                self.send_header("Content-Range", f"bytes {start}-{end}/{size}")
+            else:
+                self.send_response(200)
+            self.send_header("Accept-Ranges", "bytes")
+            self.send_header("Content-Length", str(end - start + 1))
+            self.end_headers()
+            with open(path, "rb") as f:
+                f.seek(start)
+                left = end - start + 1
+                while left > 0:
+                    block = f.read(min(left, 2 ** 20))
+                    if not block:
+                        break
+                    self.wfile.write(block)
+                    left -= len(block)
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    print(f"serving {root} at http://{host}:{server.server_address[1]}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+def main(argv: Optional[list] = None):
+    parser = argparse.ArgumentParser(description="模型下载器")
+    sub = parser.add_subparsers(dest="command", required=True)
+    get = sub.add_parser("get", help="下载模型到目录")
+    get.add_argument("repo", nargs="?", default="Tongyi-MAI/Z-Image-Turbo")
+    get.add_argument("--output", default=None, help="默认 ./models/<模型名>")
+    get.add_argument("--revision", default="main")
+    get.add_argument("--endpoint", default=None, help=f"Hub 地址或镜像（默认读 HF_ENDPOINT，否则 {DEFAULT_ENDPOINT}）")
+    get.add_argument("--token", default=None, help="访问令牌（默认读 HF_TOKEN）")
+    get.add_argument("--workers", type=int, default=8, help="并发连接数")
+    get.add_argument("--verify", action="store_true", help="重新校验已下载的文件")
+    get.add_argument("--chunk-size", type=int, default=CHUNK // 2 ** 20, help="分块大小（MB），0 为整文件单连接")
+    srv = sub.add_parser("serve", help="把本地目录按 Hub 接口发布（本地测试用）")
+    srv.add_argument("directory")
+    srv.add_argument("--port", type=int, default=8900)
+    srv.add_argument("--host", default="127.0.0.1")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(name)s] %(message)s")
+
+    if args.command == "serve":
+        serve(args.directory, args.port, args.host)
+        return
+    output = args.output or str(Path("models") / args.repo.split("/")[-1])
+    downloader = Downloader(
+        args.repo, output, args.revision, args.endpoint, args.token, args.workers,
+        args.chunk_size * 2 ** 20 or 2 ** 62, verify_existing=args.verify,
+    )
+    result = downloader.download()
+    print(f"done: {result['files']} files ({result['skipped']} skipped), {_human(result['bytes'])} "
+          f"in {result['seconds']:.1f}s ({_human(result['speed'])}/s) -> {output}")
+
+
+if __name__ == "__main__":
+    main()
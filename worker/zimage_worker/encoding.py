@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+"""
+图片编码
+
+PIL 默认的 PNG（zlib 6 级）编码 1024x1024 RGB 要几百毫秒，生成的图片噪声多，
+高压缩级别几乎不再变小。可选格式：
+
+- png：无损，压缩级别可调（ENCODE_LEVEL 0~9，默认 3），生成信息写入 PNG 文本块
+- webp：无损 WebP，通常比 PNG 小 20~30%（ENCODE_LEVEL 为 method 0~6）
+- jpeg：有损，quality 95、不做色度抽样
+- avif：有损，quality 90（需要 Pillow>=11 或 pillow-avif-plugin）
+
+编码在 Worker 的编码 / 上传线程中进行；ENCODE_PROCESSES>0 时交给进程池，
+避免多卡监督模式或 CPU 推理时与推理线程争 GIL。各格式的耗时与大小见 bench/encode.py。
+"""
+import io
+import json
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+FORMATS = {
+    # 格式: (PIL 格式名, 扩展名, Content-Type)
+    "png": ("PNG", "png", "image/png"),
+    "webp": ("WEBP", "webp", "image/webp"),
+    "jpeg": ("JPEG", "jpg", "image/jpeg"),
+    "avif": ("AVIF", "avif", "image/avif"),
+}
+DEFAULT_LEVEL = {"png": 3, "webp": 4}
+DEFAULT_QUALITY = {"jpeg": 95, "avif": 90}
+# 各格式的取值范围（含两端）：PNG 压缩级别、WebP method、JPEG / AVIF 质量
+LEVEL_RANGE = {"png": (0, 9), "webp": (0, 6)}
+QUALITY_RANGE = {"jpeg": (0, 100), "avif": (0, 100)}
+TEXT_KEYS = ("prompt", "seed", "model", "steps", "size")
+
+
+def format_for(path) -> str:
+    """按文件扩展名推断格式，未知时为 png"""
+    suffix = str(path).rsplit(".", 1)[-1].lower()
+    for fmt, (_, extension, _) in FORMATS.items():
+        if suffix in (fmt, extension):
+            return fmt
+    return "png"
+
+
+def _png_info(metadata: dict):
+    from PIL.PngImagePlugin import PngInfo
+
+    info = PngInfo()
+    for key in TEXT_KEYS:
+        if metadata.get(key) is not None:
+            # 非 Latin-1 内容（中文提示词）PIL 会自动写成 iTXt
+            info.add_text(key, str(metadata[key]))
+    info.add_text("zimage", json.dumps(metadata, ensure_ascii=False, default=str))
+    return info
+
+
+def check_options(fmt: str, level: Optional[int] = None, quality: Optional[int] = None):
+    """校验格式和参数范围，不合法时抛 ValueError（不适用于该格式的参数忽略）"""
+    if fmt not in FORMATS:
+        raise ValueError(f"unknown image format: {fmt}")
+    for name, value, ranges in (("level", level, LEVEL_RANGE), ("quality", quality, QUALITY_RANGE)):
+        if value is None or fmt not in ranges:
+            continue
+        low, high = ranges[fmt]
+        if not low <= value <= high:
+            raise ValueError(f"{fmt} {name} must be in {low}~{high}, got {value}")
+
+
+def encode(image, fmt: str = "png", level: Optional[int] = None, quality: Optional[int] = None,
+           metadata: Optional[dict] = None) -> bytes:
+    """按格式编码为字节串；metadata 仅 PNG 写入文件（其他格式随上传元数据保存）"""
+    check_options(fmt, level, quality)
+    if fmt == "avif":
+        try:
+            import pillow_avif  # noqa: F401  Pillow<11 通过插件注册 AVIF
+        except ImportError:
+            pass
+    name = FORMATS[fmt][0]
+    level = DEFAULT_LEVEL.get(fmt) if level is None else level
+    quality = DEFAULT_QUALITY.get(fmt) if quality is None else quality
+
+    if fmt == "png":
+        options = {"compress_level": level}
+        if metadata:
+            options["pnginfo"] = _png_info(metadata)
+    elif fmt == "webp":
+        options = {"lossless": True, "method": level}
+    elif fmt == "jpeg":
+        options = {"quality": quality, "subsampling": 0}
+        image = image.convert("RGB")
+    else:
+        options = {"quality": quality}
+    buffer = io.BytesIO()
+    image.save(buffer, format=name, **options)
+    return buffer.getvalue()
+
+
+class Encoder:
+    """Worker 使用的编码器：格式参数取自配置，可选进程池"""
+
+    def __init__(self, fmt: str = "png", level: Optional[int] = None, quality: Optional[int] = None,
+                 processes: int = 0):
+        # 配置错误在启动时报出，而不是每张图上传失败
+        check_options(fmt, level, quality)
+        self.format = fmt
+        self.level = level
+        self.quality = quality
+        # spawn：推理进程里已有 CUDA 上下文和多个线程，fork 不安全
+        self._pool = (
+            ProcessPoolExecutor(processes, mp_context=multiprocessing.get_context("spawn"))
+            if processes > 0 else None
+        )
+
+    @classmethod
+    def from_config(cls, config) -> "Encoder":
+        return cls(
+            config.encode_format,
+            config.encode_level if config.encode_level >= 0 else None,
+            config.encode_quality or None,
+            config.encode_processes,
+        )
+
+    @property
+    def extension(self) -> str:
+        return FORMATS[self.format][1]
+
+    @property
+    def content_type(self) -> str:
+        return FORMATS[self.format][2]
+
+    def encode(self, image, metadata: Optional[dict] = None) -> bytes:
+        """在调用线程中阻塞返回；有进程池时在子进程编码（图片按像素序列化传过去）"""
+        if self._pool is None:
+            return encode(image, self.format, self.level, self.quality, metadata)
+        return self._pool.submit(encode, image, self.format, self.level, self.quality, metadata).result()
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
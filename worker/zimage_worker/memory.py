@@ -0,0 +1,197 @@
+# -*- coding: utf-8 -*-
+"""
+按显存规划执行方式（大尺寸不 OOM）
+
+VAE 解码和 attention 的显存随分辨率平方增长，超出显存时 Worker 直接崩溃。
+每个任务生成前按设备可用显存和生成尺寸估算峰值，选择：
+
+- VAE 分块（tiling）/ 分片（slicing）解码：峰值与图片尺寸基本无关，略慢
+- attention 按 query 分块：transformer 的 attention processor 调用期间，对 scaled_dot_product_attention 的
+  query 按序列维切块逐块计算，结果完全一致；
+  按 math 回退路径（完整注意力矩阵）估算，偏保守
+
+MEMORY_MODE：auto 按估算选择；low 总是分块；off 不处理。
+每个任务的显存峰值写入结果元数据，各尺寸的最大峰值随心跳 gpu_info 上报（服务端指标
+zimage_worker_memory_peak_mb），据此可以安全地调高 MAX_WIDTH / MAX_HEIGHT 或在一张卡上放更多任务。
+"""
+import logging
+import os
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import asdict, dataclass
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+MODES = ("auto", "low", "off")
+VAE_BYTES_PER_PIXEL = 4500  # bf16 整图解码峰值的量级（fp32 翻倍）
+TEXT_TOKENS = 512  # 文本 token 上限，与图像 token 拼在同一序列
+PATCH = 16  # VAE 8 倍下采样 x patch 2
+HEADROOM = 0.85  # 只规划可用显存的这一部分，留给碎片和其他临时张量
+LOW_CHUNK = 1024
+
+
+@dataclass
+class MemoryPlan:
+    vae_tiling: bool = False
+    attention_chunk: int = 0  # query 分块大小，0 为不分块
+    free_mb: Optional[int] = None
+    estimate_mb: Optional[int] = None  # 不分块时 VAE 解码与 attention 的估算峰值之和
+
+    def summary(self) -> dict:
+        return {k: v for k, v in asdict(self).items() if v is not None}
+
+
+def free_bytes(device: str) -> int:
+    """可用显存（含 torch 缓存分配器中已保留未使用的部分）；CPU 为可用内存"""
+    import torch
+
+    if device.startswith("cuda"):
+        index = torch.device(device).index or 0
+        free, _ = torch.cuda.mem_get_info(index)
+        return free + torch.cuda.memory_reserved(index) - torch.cuda.memory_allocated(index)
+    try:
+        return os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+    except (ValueError, OSError, AttributeError):
+        return 1 << 62  # 无法获取时不限制
+
+
+def attention_heads(transformer) -> int:
+    config = getattr(transformer, "config", None) or {}
+    for key in ("num_attention_heads", "n_heads", "num_heads"):
+        value = config.get(key) if hasattr(config, "get") else getattr(config, key, None)
+        if value:
+            return int(value)
+    return 32
+
+
+def plan(width: int, height: int, device: str, mode: str = "auto", heads: int = 32,
+         dtype_bytes: int = 2) -> MemoryPlan:
+    if mode not in MODES:
+        raise ValueError(f"unknown memory mode: {mode}")
+    if mode == "off":
+        return MemoryPlan()
+    if mode == "low":
+        return MemoryPlan(vae_tiling=True, attention_chunk=LOW_CHUNK)
+
+    free = free_bytes(device)
+    budget = free * HEADROOM
+    vae = width * height * VAE_BYTES_PER_PIXEL * dtype_bytes // 2
+    tokens = (width // PATCH) * (height // PATCH) + TEXT_TOKENS
+    row = heads * tokens * dtype_bytes  # 每个 query 的注意力权重
+    scores = row * tokens
+    result = MemoryPlan(free_mb=free // 2 ** 20, estimate_mb=(vae + scores) // 2 ** 20)
+    result.vae_tiling = vae > budget
+    # attention 与去噪同时驻留的其他张量较多，只给它一半预算
+    if scores > budget / 2:
+        chunk = int(budget / 2 // row) // 256 * 256
+        result.attention_chunk = max(256, chunk) if chunk < tokens else 0
+    return result
+
+
+def apply(pipe, memory_plan: MemoryPlan):
+    vae = getattr(pipe, "vae", None)
+    if vae is None or not hasattr(vae, "enable_tiling"):
+        return
+    if memory_plan.vae_tiling:
+        vae.enable_tiling()
+        vae.enable_slicing()
+    else:
+        vae.disable_tiling()
+        vae.disable_slicing()
+
+
+# 当前调用链上 attention 的 query 分块大小，只在 transformer 的 attention processor 调用期间非 0
+_attention_chunk: ContextVar[int] = ContextVar("attention_chunk", default=0)
+
+
+def _chunked_sdpa(original):
+    """按 query 分块的 scaled_dot_product_attention；分块大小取自 _attention_chunk，未设置时原样调用"""
+    import torch
+
+    def sdpa(query, key, value, attn_mask=None, *args, **kwargs):
+        chunk = _attention_chunk.get()
+        length = query.shape[-2]
+        if not chunk or length <= chunk or kwargs.get("is_causal"):
+            return original(query, key, value, attn_mask, *args, **kwargs)
+        outputs = []
+        for start in range(0, length, chunk):
+            mask = attn_mask
+            if mask is not None and mask.dim() >= 2 and mask.shape[-2] == length:
+                mask = mask[..., start:start + chunk, :]
+            outputs.append(original(query[..., start:start + chunk, :], key, value, mask, *args, **kwargs))
+        return torch.cat(outputs, dim=-2)
+
+    return sdpa
+
+
+class ChunkedAttnProcessor:
+    """包装 transformer 原有的 attention processor：只在它的调用期间让 attention 按 query 分块"""
+
+    def __init__(self, processor, chunk: int):
+        self.processor = processor
+        self.chunk = chunk
+
+    def __getattr__(self, name):
+        # diffusers 会读 processor 上的属性（如 _attention_backend）
+        return getattr(self.processor, name)
+
+    def __call__(self, *args, **kwargs):
+        token = _attention_chunk.set(self.chunk)
+        try:
+            return self.processor(*args, **kwargs)
+        finally:
+            _attention_chunk.reset(token)
+
+
+@contextmanager
+def chunked_attention(transformer, chunk: int):
+    """
+    在上下文内让 transformer 的 attention 按 query 分块
+
+    通过 set_attn_processor 给 transformer 的每个 attention 换上 ChunkedAttnProcessor，结束后换回；
+    分块只在这些 processor 的调用期间生效（ContextVar），text_encoder、VAE 和其他线程不受影响。
+    不分块时什么都不改，编译好的图不会因此失效。
+    """
+    processors = getattr(transformer, "attn_processors", None) if chunk else None
+    if not processors:
+        if chunk:
+            logger.warning("Transformer has no attention processors, attention chunking skipped")
+        yield
+        return
+    import torch.nn.functional as F
+
+    original = F.scaled_dot_product_attention
+    transformer.set_attn_processor({name: ChunkedAttnProcessor(p, chunk) for name, p in processors.items()})
+    F.scaled_dot_product_attention = _chunked_sdpa(original)
+    try:
+        yield
+    finally:
+        F.scaled_dot_product_attention = original
+        transformer.set_attn_processor(processors)
+
+
+@contextmanager
+def track(device: str):
+    """
+    统计上下文内的内存峰值，结束后写入 usage["peak_mb"]
+
+    CUDA 为本次的 max_memory_allocated；CPU 为进程的最大常驻内存（进程级，不能按任务重置）。
+    """
+    import torch
+
+    usage = {}
+    cuda = device.startswith("cuda")
+    if cuda:
+        torch.cuda.reset_peak_memory_stats(torch.device(device))
+    try:
+        yield usage
+    finally:
+        if cuda:
+            usage["peak_mb"] = torch.cuda.max_memory_allocated(torch.device(device)) // 2 ** 20
+        else:
+            try:
+                import resource
+                usage["peak_mb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss // 1024
+            except ImportError:
+                pass
@@ -0,0 +1,248 @@
+# -*- coding: utf-8 -*-
+"""
+生图管线
+
+generate(job) 接收 next-job 返回的任务，返回 (PIL.Image, 元数据)。
+- ZImageGenerator：diffusers ZImagePipeline（与 generate.py 相同的加载方式）
+- DummyGenerator：不依赖 torch，按步数 sleep 模拟推理并生成噪声图，
+  用于在 CPU 上联调整条 Worker 流水线
+"""
+import logging
+import os
+import random
+import time
+from typing import Tuple
+
+from zimage_worker import memory
+from zimage_worker.buckets import BucketPolicy
+from zimage_worker.config import WorkerConfig
+
+logger = logging.getLogger(__name__)
+
+
+def resolve_seed(seed) -> int:
+    if seed is None or int(seed) < 0:
+        return random.randint(0, 2 ** 32 - 1)
+    return int(seed)
+
+
+def _metadata(seed: int, model: str, size, requested) -> dict:
+    metadata = {"seed": seed, "model": model}
+    if tuple(size) != tuple(requested):
+        metadata["bucket"] = f"{size[0]}x{size[1]}"
+    return metadata
+
+
+def device_info(device: str) -> dict:
+    """心跳上报的设备信息"""
+    info = {"device": device, "cpu_count": os.cpu_count()}
+    if device.startswith("cuda"):
+        try:
+            import torch
+            if torch.cuda.is_available():
+                index = torch.device(device).index or 0
+                props = torch.cuda.get_device_properties(index)
+                info.update({
+                    "name": props.name,
+                    "memory_total_mb": props.total_memory // 2 ** 20,
+                    "memory_allocated_mb": torch.cuda.memory_allocated(index) // 2 ** 20,
+                })
+        except Exception as e:
+            logger.debug("Failed to query device: %s", e)
+    return info
+
+
+def load_zimage(model_id: str, device: str, cpu_offload: bool = False, snapshot: str = "",
+                quantize: str = "none", quantize_cache: str = ""):
+    """
+    加载 Z-Image 管线，返回 (pipe, 各阶段耗时)
+
+    snapshot 非空时走快照快速加载（见 zimage_worker.snapshot），目录不存在则先从 model_id 构建一次。
+    quantize 为 int8 / fp8 时先在 CPU 上加载并量化（或读取量化缓存），再放到目标设备（见 zimage_worker.quantize）。
+    """
+    import torch
+
+    started = time.perf_counter()
+    quantized = quantize != "none"
+    target = "cpu" if cpu_offload or quantized else device
+    if snapshot:
+        from zimage_worker import snapshot as snapshots
+        if not snapshots.is_snapshot(snapshot):
+            logger.info("Building snapshot %s from %s (one-time)", snapshot, model_id)
+            snapshots.build(model_id, snapshot, "bfloat16" if device.startswith("cuda") else "float32")
+        pipe, timings = snapshots.load(snapshot, target)
+    else:
+        from diffusers import ZImagePipeline
+        pipe = ZImagePipeline.from_pretrained(
+            model_id,
+            torch_dtype=torch.bfloat16 if device.startswith("cuda") else torch.float32,
+            low_cpu_mem_usage=True,
+        )
+        timings = {"from_pretrained": round(time.perf_counter() - started, 3)}
+
+    if quantized:
+        from zimage_worker.quantize import quantize_pipeline
+        t = time.perf_counter()
+        quantize_pipeline(pipe, quantize, device, model_fingerprint(model_id, snapshot), quantize_cache)
+        timings["quantize"] = round(time.perf_counter() - t, 3)
+
+    placed = time.perf_counter()
+    if cpu_offload:
+        logger.info("CPU offload enabled")
+        pipe.enable_model_cpu_offload()
+    elif target != device or not snapshot:
+        pipe.to(device)
+    timings["placement"] = round(time.perf_counter() - placed, 3)
+    timings["total"] = round(time.perf_counter() - started, 3)
+    return pipe, timings
+
+
+def model_fingerprint(model_id: str, snapshot: str = "", quantize: str = "none") -> str:
+    """编译缓存等按模型区分时使用：快照取来源哈希，否则取模型 ID 及其版本（见 snapshot.source_revision）；量化后的模型另算"""
+    from zimage_worker import snapshot as snapshots
+    if snapshot and snapshots.is_snapshot(snapshot):
+        manifest = snapshots.read_manifest(snapshot)
+        fingerprint = f"{manifest['source']}@{manifest['source_hash']}"
+    else:
+        revision = snapshots.source_revision(model_id)
+        fingerprint = f"{model_id}@{revision}" if revision else model_id
+    return fingerprint if quantize == "none" else f"{fingerprint}+{quantize}"
+
+
+class ZImageGenerator:
+    def __init__(self, config: WorkerConfig):
+        self.config = config
+        self.pipe = None
+        self.load_timings = {}
+        self.compile_cache = None
+        self.warmup_report = None
+        self.step_cache = None
+        self.memory_peaks = {}  # 生成尺寸 -> 最大显存峰值（MB）
+        self.text_cache = None
+        self.buckets = BucketPolicy.from_config(config)
+
+    def load(self):
+        from zimage_worker.snapshot import format_timings
+        from zimage_worker.step_cache import StepCache
+
+        logger.info("Loading model: %s", self.config.model_snapshot or self.config.model_id)
+        self.pipe, self.load_timings = load_zimage(
+            self.config.model_id, self.config.device, self.config.cpu_offload, self.config.model_snapshot,
+            self.config.quantize, self.config.quantize_cache_dir,
+        )
+        logger.info("Model loaded in %s", format_timings(self.load_timings))
+        # 在编译之前包装 block，编译后的图包含跳过逻辑
+        self.step_cache = StepCache.attach(self.pipe.transformer, self.config.cache_threshold)
+        if self.config.text_cache_dir:
+            from zimage_worker.text_cache import TextCache
+            self.text_cache = TextCache(
+                self.config.text_cache_dir,
+                model_fingerprint(self.config.model_id, self.config.model_snapshot, self.config.quantize),
+                self.config.text_cache_size,
+            )
+        if self.config.compile:
+            self._compile()
+
+    def _compile(self):
+        from zimage_worker import compile_cache
+
+        device = self.config.device
+        self.compile_cache = compile_cache.CompileCache(
+            self.config.compile_cache_dir,
+            model_fingerprint(self.config.model_id, self.config.model_snapshot, self.config.quantize),
+            "bfloat16" if device.startswith("cuda") else "float32",
+            device,
+        )
+        compile_cache.compile_pipeline(self.pipe, self.compile_cache)
+        # 先把常用尺寸（分桶时为全部桶）编译好或从缓存载入，第一个真实任务不再卡在编译上
+        sizes = self.buckets.warmup_sizes()
+        if sizes:
+            logger.info("Bucketing is %s: warming up all %d buckets instead of WARMUP_SIZES", self.buckets.mode, len(sizes))
+        else:
+            sizes = compile_cache.parse_sizes(self.config.warmup_sizes)
+        if sizes:
+            self.warmup_report = compile_cache.warmup(
+                self.pipe, sizes, self.compile_cache, self.config.warmup_steps,
+            )
+            logger.info("Warm-up: %s", compile_cache.format_report(self.warmup_report))
+
+    def generate(self, job: dict) -> Tuple[object, dict]:
+        import torch
+
+        seed = resolve_seed(job.get("seed"))
+        requested = (job["width"], job["height"])
+        width, height = self.buckets.choose(*requested)
+        self.buckets.record((width, height))
+        device = self.config.device
+        generator = torch.Generator("cpu" if self.config.cpu_offload else device).manual_seed(seed)
+        plan = memory.plan(
+            width, height, device, self.config.memory_mode,
+            memory.attention_heads(self.pipe.transformer), 2 if device.startswith("cuda") else 4,
+        )
+        memory.apply(self.pipe, plan)
+        inputs = {"prompt": job["prompt"]}
+        if self.text_cache is not None:
+            embeds = self.text_cache.embeds(self.pipe, job["prompt"], getattr(self.pipe, "_execution_device", device))
+            if embeds is not None:
+                inputs = {"prompt_embeds": embeds}
+        self.step_cache.reset()
+        with memory.track(device) as usage, memory.chunked_attention(self.pipe.transformer, plan.attention_chunk):
+            image = self.pipe(
+                **inputs,
+                height=height,
+                width=width,
+                num_inference_steps=job["steps"],
+                guidance_scale=0.0,  # Turbo 模型无需引导
+                generator=generator,
+            ).images[0]
+        size = f"{width}x{height}"
+        if "peak_mb" in usage:
+            self.memory_peaks[size] = max(self.memory_peaks.get(size, 0), usage["peak_mb"])
+        logger.debug("Memory for %s: %s, %s", size, usage, plan)
+        metadata = _metadata(seed, self.config.model_id, (width, height), requested)
+        metadata["memory"] = {**usage, **plan.summary()}
+        if self.step_cache.enabled:
+            stats = self.step_cache.stats()
+            metadata["step_cache"] = f"{stats['skipped']}/{stats['steps']}"
+        return self.buckets.finish(image, requested), metadata
+
+    def device_info(self) -> dict:
+        info = {
+            **device_info(self.config.device),
+            "buckets": self.buckets.stats(),
+            "memory_peak_mb": dict(self.memory_peaks),
+        }
+        if self.text_cache is not None:
+            info["text_cache"] = self.text_cache.stats()
+        return info
+
+
+class DummyGenerator:
+    def __init__(self, config: WorkerConfig):
+        self.config = config
+        self.buckets = BucketPolicy.from_config(config)
+
+    def load(self):
+        logger.info("Using dummy pipeline (%.3fs per step)", self.config.dummy_step_seconds)
+
+    def generate(self, job: dict) -> Tuple[object, dict]:
+        from PIL import Image
+
+        seed = resolve_seed(job.get("seed"))
+        requested = (job["width"], job["height"])
+        width, height = self.buckets.choose(*requested)
+        self.buckets.record((width, height))
+        # sleep 释放 GIL，与 GPU 推理时 CPU 空闲的情形一致
+        time.sleep(self.config.dummy_step_seconds * job.get("steps", 9))
+        noise = random.Random(seed).randbytes(width * height * 3)
+        image = Image.frombytes("RGB", (width, height), noise)
+        return self.buckets.finish(image, requested), _metadata(seed, "dummy", (width, height), requested)
+
+    def device_info(self) -> dict:
+        return {"device": "cpu", "cpu_count": os.cpu_count(), "pipeline": "dummy", "buckets": self.buckets.stats()}
+
+
+def create_generator(config: WorkerConfig):
+    if config.pipeline == "dummy":
+        return DummyGenerator(config)
+    return ZImageGenerator(config)
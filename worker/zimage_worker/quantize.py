@@ -0,0 +1,202 @@
+# -*- coding: utf-8 -*-
+"""
+权重量化（仅权重，激活保持 bf16 / fp32）
+
+16~24GB 显卡放不下 bf16 的 transformer + text encoder，只能 --cpu-offload，
+每步都经 PCIe 搬权重。量化后权重减半，可以整体放进显存：
+
+- int8（CUDA）：每输出通道对称量化，权重以 int8 存储，前向时逐层反量化为 bf16 再做矩阵乘
+- fp8（CUDA）：同上，权重存为 float8_e4m3fn（需 torch>=2.1）
+- int8（CPU）：torch 动态量化（quantize_dynamic，int8 权重 + 运行时量化激活），CPU 上可直接测速和对比画质
+
+只量化 transformer 与 text_encoder 中足够大的 Linear 层（小层省不了多少显存，误差占比却更大）；
+VAE 保持原精度。CUDA 模式的量化结果缓存到 QUANTIZE_CACHE_DIR，之后启动直接读取：
+
+    <QUANTIZE_CACHE_DIR>/<模型指纹与模式的哈希>/<组件>.safetensors   # 各层 int8/fp8 权重与缩放系数
+
+配合快照加载（内存映射）时，已被量化层替换的原始权重不会被读入内存。
+"""
+import hashlib
+import logging
+import time
+from pathlib import Path
+from typing import Dict, Iterable
+
+logger = logging.getLogger(__name__)
+
+MODES = ("none", "int8", "fp8")
+COMPONENTS = ("transformer", "text_encoder")
+DEFAULT_CACHE_ROOT = Path.home() / ".cache" / "zimage" / "quantized"
+MIN_PARAMS = 1 << 16  # 小于该参数量的 Linear 不量化
+
+
+def _torch():
+    import torch
+    return torch
+
+
+def _qdtype(mode: str):
+    torch = _torch()
+    if mode == "int8":
+        return torch.int8
+    if not hasattr(torch, "float8_e4m3fn"):
+        raise RuntimeError("fp8 quantization requires torch>=2.1")
+    return torch.float8_e4m3fn
+
+
+_linear_class = None
+
+
+def _quantized_linear_class():
+    """QuantizedLinear 在首次使用时定义，导入本模块不需要 torch"""
+    global _linear_class
+    if _linear_class is not None:
+        return _linear_class
+    torch = _torch()
+    import torch.nn.functional as F
+
+    class QuantizedLinear(torch.nn.Module):
+        def __init__(self, in_features: int, out_features: int, bias: bool, qdtype, device=None, dtype=None):
+            super().__init__()
+            self.in_features = in_features
+            self.out_features = out_features
+            self.register_buffer("weight_q", torch.empty(out_features, in_features, dtype=qdtype, device=device))
+            self.register_buffer("scale", torch.empty(out_features, 1, dtype=torch.float32, device=device))
+            self.bias = torch.nn.Parameter(torch.empty(out_features, dtype=dtype, device=device)) if bias else None
+
+        @classmethod
+        def from_linear(cls, linear, qdtype) -> "QuantizedLinear":
+            weight = linear.weight.detach().float()
+            limit = 127.0 if qdtype == torch.int8 else torch.finfo(qdtype).max
+            scale = weight.abs().amax(dim=1, keepdim=True).clamp(min=1e-8) / limit
+            quantized = weight / scale
+            if qdtype == torch.int8:
+                quantized = quantized.round().clamp(-127, 127)
+            module = cls(linear.in_features, linear.out_features, linear.bias is not None, qdtype,
+                         device=weight.device, dtype=linear.weight.dtype)
+            module.weight_q.copy_(quantized.to(qdtype))
+            module.scale.copy_(scale)
+            if linear.bias is not None:
+                module.bias = torch.nn.Parameter(linear.bias.detach().clone(), requires_grad=False)
+            return module
+
+        def forward(self, x):
+            weight = self.weight_q.to(x.dtype) * self.scale.to(x.dtype)
+            return F.linear(x, weight, self.bias)
+
+        def extra_repr(self) -> str:
+            return f"in_features={self.in_features}, out_features={self.out_features}, qdtype={self.weight_q.dtype}"
+
+    _linear_class = QuantizedLinear
+    return _linear_class
+
+
+def _targets(module) -> Iterable:
+    torch = _torch()
+    for name, child in module.named_modules():
+        if isinstance(child, torch.nn.Linear) and child.weight.numel() >= MIN_PARAMS:
+            yield name, child
+
+
+def _replace(root, name: str, new):
+    parent_name, _, attr = name.rpartition(".")
+    parent = root.get_submodule(parent_name) if parent_name else root
+    setattr(parent, attr, new)
+
+
+def _bytes(module) -> int:
+    return sum(t.numel() * t.element_size() for t in list(module.parameters()) + list(module.buffers()))
+
+
+def cache_path(root, fingerprint: str, mode: str) -> Path:
+    key = hashlib.sha256(f"{fingerprint}|{mode}|{MIN_PARAMS}".encode()).hexdigest()[:16]
+    return Path(root or DEFAULT_CACHE_ROOT) / key
+
+
+def quantize_module(module, mode: str, cache_file: Path = None) -> dict:
+    """原地量化一个组件（CUDA 路径），有缓存时从缓存读取；返回统计"""
+    from safetensors.torch import load_file, save_file
+
+    Linear = _quantized_linear_class()
+    qdtype = _qdtype(mode)
+    before = _bytes(module)
+    started = time.perf_counter()
+    targets = list(_targets(module))
+    cached = cache_file is not None and cache_file.exists()
+
+    if cached:
+        state = load_file(str(cache_file))
+        for name, linear in targets:
+            new = Linear(linear.in_features, linear.out_features, linear.bias is not None, qdtype,
+                         device="cpu", dtype=linear.weight.dtype)
+            new.weight_q = state[f"{name}.weight_q"]
+            new.scale = state[f"{name}.scale"]
+            if linear.bias is not None:
+                new.bias = _torch().nn.Parameter(linear.bias.detach(), requires_grad=False)
+            _replace(module, name, new)
+    else:
+        state = {}
+        for name, linear in targets:
+            new = Linear.from_linear(linear, qdtype)
+            _replace(module, name, new)
+            state[f"{name}.weight_q"] = new.weight_q
+            state[f"{name}.scale"] = new.scale
+        if cache_file is not None and state:
+            cache_file.parent.mkdir(parents=True, exist_ok=True)
+            partial = cache_file.with_suffix(".partial")
+            save_file(state, str(partial))
+            partial.replace(cache_file)
+
+    return {
+        "layers": len(targets),
+        "mb_before": round(before / 2 ** 20, 1),
+        "mb_after": round(_bytes(module) / 2 ** 20, 1),
+        "seconds": round(time.perf_counter() - started, 2),
+        "cached": cached,
+    }
+
+
+def quantize_dynamic_cpu(module) -> dict:
+    """CPU int8：torch 动态量化（Linear 权重 int8，激活运行时量化）"""
+    torch = _torch()
+    before = _bytes(module)
+    started = time.perf_counter()
+    # 按名字指定要量化的层，与 CUDA 路径同一套筛选（小 Linear 保持原精度），统计和实际量化的层一致
+    names = [name for name, _ in _targets(module)]
+    module.float()
+    qconfig = torch.ao.quantization.default_dynamic_qconfig
+    torch.ao.quantization.quantize_dynamic(module, {name: qconfig for name in names}, dtype=torch.qint8, inplace=True)
+    return {
+        "layers": len(names),
+        "mb_before": round(before / 2 ** 20, 1),
+        # 动态量化的权重打包在 C++ 对象中，不计入 parameters()，按 int8 估算
+        "mb_after": round((_bytes(module) + sum(
+            m.weight().numel() for m in module.modules() if hasattr(m, "_packed_params")
+        )) / 2 ** 20, 1),
+        "seconds": round(time.perf_counter() - started, 2),
+        "cached": False,
+    }
+
+
+def quantize_pipeline(pipe, mode: str, device: str, fingerprint: str, cache_dir: str = "") -> Dict[str, dict]:
+    """
+    量化 pipeline 的 transformer 与 text_encoder（调用前各组件应在 CPU 上），返回各组件统计
+
+    CPU 设备且 mode=int8 时使用动态量化（不缓存）；其余情况使用仅权重量化并缓存。
+    """
+    if mode not in MODES:
+        raise ValueError(f"unknown quantize mode: {mode}")
+    report = {}
+    if mode == "none":
+        return report
+    directory = cache_path(cache_dir, fingerprint, mode)
+    for name in COMPONENTS:
+        module = getattr(pipe, name, None)
+        if module is None:
+            continue
+        if device == "cpu" and mode == "int8":
+            report[name] = quantize_dynamic_cpu(module)
+        else:
+            report[name] = quantize_module(module, mode, directory / f"{name}.safetensors")
+        logger.info("Quantized %s to %s: %s", name, mode, report[name])
+    return report
@@ -0,0 +1,292 @@
+# -*- coding: utf-8 -*-
+"""
+Worker 流水线
+
+    领取线程 ──(预取队列)──> 推理（主线程）──(有界)──> 编码 / 上传线程池
+
+- 推理当前任务时，领取线程已经领好下一个任务（PREFETCH_JOBS），GPU 不必等一次网络往返
+- 编码（zimage_worker.encoding）、本地备份和上传在后台线程完成，GPU 同时开始下一个任务；
+  等待上传的图片数有上限（MAX_PENDING_UPLOADS），网络慢时推理会暂停而不是堆积内存
+- 心跳在独立线程发送，长时间推理和退出前的排空期间都不会被判定失联
+- stop()（SIGTERM）后不再领取新任务：当前推理和待上传的结果正常完成，
+  已预取但未开始的任务退回队列，最后上报 offline
+
+各阶段耗时以 {"spans": {名称: [起点 epoch 毫秒, 时长毫秒]}, "sent_at": epoch 毫秒}
+随结果上传（失败时随状态上报），由服务端合并进任务链路：
+fetch（领取请求）、wait（预取后等待推理）、inference、encode。
+"""
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from datetime import datetime
+from pathlib import Path
+from typing import Optional
+
+from zimage_worker.api import ApiClient, ApiError
+from zimage_worker.config import WorkerConfig
+from zimage_worker.encoding import Encoder
+from zimage_worker.pipelines import create_generator
+
+logger = logging.getLogger(__name__)
+
+
+def _now_ms() -> float:
+    return time.time() * 1000
+
+
+def _span(job: dict, name: str, start_ms: float, end_ms: Optional[float] = None):
+    end_ms = _now_ms() if end_ms is None else end_ms
+    job["_spans"][name] = [round(start_ms, 1), round(end_ms - start_ms, 1)]
+
+
+def _trace(job: dict) -> dict:
+    return {"spans": job["_spans"], "sent_at": round(_now_ms(), 1)}
+
+
+def claim_job(api: ApiClient) -> Optional[dict]:
+    """领取一个任务并记录 fetch 耗时，无任务或出错时返回 None"""
+    started = _now_ms()
+    try:
+        job = api.next_job()
+    except ApiError as e:
+        logger.warning("Failed to fetch job: %s", e)
+        return None
+    if job is not None:
+        job["_spans"] = {}
+        _span(job, "fetch", started)
+        job["_claimed_ms"] = _now_ms()
+        logger.info("Claimed job %s (%dx%d, %d steps)", job["id"], job["width"], job["height"], job["steps"])
+    return job
+
+
+def return_job(api: ApiClient, job: dict) -> bool:
+    """把已领取未开始的任务退回队列"""
+    try:
+        api.update_status(job["id"], "queued")
+        logger.info("Returned unstarted job %s to the queue", job["id"])
+        return True
+    except ApiError as e:
+        # 服务端会在心跳超时后回收
+        logger.warning("Failed to return job %s: %s", job["id"], e)
+        return False
+
+
+class Worker:
+    def __init__(self, config: WorkerConfig, api: Optional[ApiClient] = None, generator=None):
+        self.config = config
+        self.api = api or ApiClient(config)
+        self.generator = generator or create_generator(config)
+        self.encoder = Encoder.from_config(config)
+        self.stats = {"completed": 0, "failed": 0, "returned": 0}
+        self.current_job_id: Optional[str] = None
+
+        self._stopping = threading.Event()
+        # 当前推理和待上传结果都已结束：心跳持续到这里，否则服务端会在排空期间判定失联、回收任务
+        self._drained = threading.Event()
+        self._prefetched: "queue.Queue[dict]" = queue.Queue()
+        self._prefetch_slots = threading.Semaphore(config.prefetch_jobs)
+        self._upload_slots = threading.BoundedSemaphore(max(1, config.max_pending_uploads))
+        self._uploads = (
+            ThreadPoolExecutor(config.encode_threads, thread_name_prefix="upload")
+            if config.encode_threads > 0 else None
+        )
+        self._pending = set()
+        self._lock = threading.Lock()
+        self._threads = []
+
+    # ---------- 生命周期 ----------
+
+    def stop(self):
+        """开始优雅退出（可在信号处理函数中调用）"""
+        if not self._stopping.is_set():
+            logger.info("Stopping: finishing in-flight jobs, no new claims")
+            self._stopping.set()
+
+    @property
+    def stopping(self) -> bool:
+        return self._stopping.is_set()
+
+    def run(self):
+        self.generator.load()
+        self._start_thread(self._heartbeat_loop, "heartbeat")
+        if self.config.prefetch_jobs > 0:
+            self._start_thread(self._prefetch_loop, "prefetch")
+        logger.info("Started! Polling interval: %gs", self.config.poll_interval)
+
+        while not self._stopping.is_set():
+            job = self._next_job()
+            if job is not None:
+                self._process(job)
+
+        self._drain()
+
+    def _count(self, name: str):
+        with self._lock:
+            self.stats[name] += 1
+
+    def _start_thread(self, target, name: str):
+        thread = threading.Thread(target=target, name=name, daemon=True)
+        thread.start()
+        self._threads.append(thread)
+
+    def _drain(self):
+        # 领取线程退出后，队列里剩下的都是已领取未开始的任务
+        for thread in self._threads:
+            if thread.name == "prefetch":
+                thread.join()
+        while True:
+            try:
+                job = self._prefetched.get_nowait()
+            except queue.Empty:
+                break
+            self._return_job(job)
+
+        self._wait_uploads()
+        self._drained.set()
+        for thread in self._threads:
+            if thread.name == "heartbeat":
+                thread.join()
+        self.api.heartbeat("offline", gpu_info=self.generator.device_info())
+        self.api.close()
+        logger.info("Stopped: %s", self.stats)
+
+    def _wait_uploads(self):
+        with self._lock:
+            pending = set(self._pending)
+        if pending:
+            logger.info("Waiting for %d upload(s)", len(pending))
+            _, not_done = wait(pending, timeout=self.config.drain_timeout)
+            if not_done:
+                logger.warning("%d upload(s) still running after %gs, giving up", len(not_done), self.config.drain_timeout)
+        if self._uploads:
+            self._uploads.shutdown(wait=False, cancel_futures=True)
+        self.encoder.close()
+
+    # ---------- 领取 ----------
+
+    def _claim(self) -> Optional[dict]:
+        return claim_job(self.api)
+
+    def _prefetch_loop(self):
+        while not self._stopping.is_set():
+            # 预取队列满时等推理线程取走一个
+            if not self._prefetch_slots.acquire(timeout=0.5):
+                continue
+            if self._stopping.is_set():
+                self._prefetch_slots.release()
+                break
+            job = self._claim()
+            if job is None:
+                self._prefetch_slots.release()
+                self._stopping.wait(self.config.poll_interval)
+                continue
+            self._prefetched.put(job)
+
+    def _next_job(self) -> Optional[dict]:
+        if self.config.prefetch_jobs > 0:
+            try:
+                job = self._prefetched.get(timeout=0.5)
+            except queue.Empty:
+                return None
+            self._prefetch_slots.release()
+            return job
+        job = self._claim()
+        if job is None:
+            self._stopping.wait(self.config.poll_interval)
+        return job
+
+    def _return_job(self, job: dict):
+        if return_job(self.api, job):
+            self._count("returned")
+
+    # ---------- 推理 ----------
+
+    def _process(self, job: dict):
+        started = _now_ms()
+        _span(job, "wait", job["_claimed_ms"], started)
+        self.current_job_id = job["id"]
+        try:
+            image, metadata = self.generator.generate(job)
+        except Exception as e:
+            logger.exception("Job %s failed during inference", job["id"])
+            _span(job, "inference", started)
+            self._fail(job, f"生成失败: {e}")
+            return
+        finally:
+            self.current_job_id = None
+        _span(job, "inference", started)
+        logger.info("Job %s generated in %.1fs", job["id"], job["_spans"]["inference"][1] / 1000)
+
+        # 等待上传的结果过多时在这里阻塞，背压传到推理
+        self._upload_slots.acquire()
+        if self._uploads is None:
+            self._finish(job, image, metadata)
+            return
+        future = self._uploads.submit(self._finish, job, image, metadata)
+        with self._lock:
+            self._pending.add(future)
+        future.add_done_callback(self._upload_done)
+
+    def _upload_done(self, future):
+        with self._lock:
+            self._pending.discard(future)
+
+    # ---------- 编码 / 上传 ----------
+
+    def _finish(self, job: dict, image, metadata: dict):
+        try:
+            started = _now_ms()
+            data = self.encoder.encode(image, {
+                **metadata,
+                "prompt": job["prompt"],
+                "steps": job["steps"],
+                "size": f"{job['width']}x{job['height']}",
+                "job_id": job["id"],
+            })
+            _span(job, "encode", started)
+            self._backup(job, data)
+            self.api.upload_result(
+                job["id"], data, {**metadata, "trace": _trace(job)},
+                filename=f"result.{self.encoder.extension}", content_type=self.encoder.content_type,
+            )
+            self._count("completed")
+            logger.info("Job %s uploaded (%d bytes)", job["id"], len(data))
+        except Exception as e:
+            logger.exception("Job %s failed during upload", job["id"])
+            self._fail(job, f"上传失败: {e}")
+        finally:
+            self._upload_slots.release()
+
+    def _backup(self, job: dict, data: bytes):
+        if not self.config.backup_root:
+            return
+        try:
+            directory = Path(self.config.backup_root) / datetime.now().strftime("%Y-%m-%d")
+            directory.mkdir(parents=True, exist_ok=True)
+            (directory / f"{job['id']}.{self.encoder.extension}").write_bytes(data)
+        except OSError as e:
+            logger.warning("Local backup failed for %s: %s", job["id"], e)
+
+    def _fail(self, job: dict, message: str):
+        self._count("failed")
+        try:
+            self.api.update_status(job["id"], "failed", error_message=message[:500], trace=_trace(job))
+        except ApiError as e:
+            logger.warning("Failed to report failure of %s: %s", job["id"], e)
+
+    # ---------- 心跳 ----------
+
+    def _heartbeat_loop(self):
+        # stop() 之后继续发送，直到 _drain 等完上传
+        while not self._drained.is_set():
+            with self._lock:
+                uploading = bool(self._pending)
+            current = self.current_job_id
+            self.api.heartbeat(
+                "busy" if current or uploading else "idle",
+                current_job_id=current,
+                gpu_info=self.generator.device_info(),
+            )
+            self._drained.wait(self.config.heartbeat_interval)
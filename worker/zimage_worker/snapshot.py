@@ -0,0 +1,276 @@
+# -*- coding: utf-8 -*-
+"""
+预构建的模型快照：快速冷启动
+
+from_pretrained 每次启动都要读分片、逐个创建参数再拷贝权重、转换精度，大模型要几分钟。
+build() 把 HF 快照一次性转换成：
+
+    <快照目录>/
+        manifest.json                          # 组件列表、精度、来源版本与哈希
+        model_index.json、各组件 config / tokenizer / scheduler 文件（原样复制）
+        transformer/diffusion_pytorch_model.safetensors   # 每个组件合并为一个文件，已转为目标精度
+        text_encoder/model.safetensors
+        vae/diffusion_pytorch_model.safetensors
+
+load() 在 meta 设备上创建各组件（不分配内存），用 safetensors 内存映射直接读到目标设备
+（CPU 上零拷贝），以 assign 方式挂到模型上；各组件在线程池中并行加载，返回每个组件的耗时。
+目录结构与 diffusers 一致，必要时也可直接 from_pretrained(快照目录)。
+
+使用方法:
+    python -m zimage_worker.snapshot build --model Tongyi-MAI/Z-Image-Turbo --output /worker/models/zimage-bf16
+    python -m zimage_worker.snapshot load /worker/models/zimage-bf16 --device cuda
+"""
+import argparse
+import hashlib
+import json
+import logging
+import shutil
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+MANIFEST = "manifest.json"
+FORMAT_VERSION = 1
+_WEIGHT_SUFFIXES = (".safetensors", ".bin", ".pt", ".pth", ".ckpt")
+_WEIGHT_FILES = {"diffusers": "diffusion_pytorch_model.safetensors", "transformers": "model.safetensors"}
+
+
+def is_snapshot(path) -> bool:
+    return bool(path) and (Path(path) / MANIFEST).is_file()
+
+
+def read_manifest(path) -> dict:
+    return json.loads((Path(path) / MANIFEST).read_text(encoding="utf-8"))
+
+
+def resolve_source(model_id: str) -> Path:
+    """本地目录原样返回，否则从 HF Hub 下载（已下载则直接命中缓存）"""
+    path = Path(model_id)
+    if path.is_dir():
+        return path
+    from huggingface_hub import snapshot_download
+    return Path(snapshot_download(model_id))
+
+
+@lru_cache(maxsize=None)
+def source_revision(model_id: str) -> str:
+    """
+    模型来源的版本，用于缓存键（编译、量化缓存按它区分，上游更新后不会误用旧产物）
+
+    - HF Hub 模型：本地缓存中的 commit 哈希（不联网，未下载时返回空字符串）
+    - download_model.py 下载的目录：下载清单中各文件校验值的指纹
+    - 其他本地目录：各文件路径与大小的指纹
+    """
+    path = Path(model_id)
+    if path.is_dir():
+        from zimage_worker.download import MANIFEST as DOWNLOAD_MANIFEST
+        try:
+            files = json.loads((path / DOWNLOAD_MANIFEST).read_text(encoding="utf-8"))["files"]
+        except (OSError, ValueError, KeyError):
+            return _source_hash(path)
+        return hashlib.sha256(json.dumps(files, sort_keys=True).encode()).hexdigest()[:16]
+    try:
+        from huggingface_hub import snapshot_download
+        # 缓存目录 snapshots/<commit>
+        return Path(snapshot_download(model_id, local_files_only=True)).name
+    except Exception as e:
+        logger.warning("Cannot resolve cached revision of %s: %s", model_id, e)
+        return ""
+
+
+def _is_weight_file(path: Path) -> bool:
+    return path.name.endswith(_WEIGHT_SUFFIXES) or path.name.endswith(".index.json")
+
+
+def _read_state_dict(component_dir: Path) -> dict:
+    """读取组件的全部权重分片（safetensors 优先，兼容 .bin）"""
+    files = sorted(component_dir.glob("*.safetensors"))
+    state = {}
+    if files:
+        from safetensors.torch import load_file
+        for file in files:
+            state.update(load_file(str(file)))
+        return state
+    import torch
+    for file in sorted(component_dir.glob("*.bin")):
+        state.update(torch.load(file, map_location="cpu", weights_only=True))
+    return state
+
+
+def _source_hash(source: Path) -> str:
+    """来源快照的指纹：各文件相对路径与大小（HF 缓存目录名本身就是 commit 哈希）"""
+    digest = hashlib.sha256()
+    for file in sorted(p for p in source.rglob("*") if p.is_file()):
+        digest.update(f"{file.relative_to(source).as_posix()}:{file.stat().st_size}\n".encode())
+    return digest.hexdigest()[:16]
+
+
+def build(model_id: str, output, dtype: str = "bfloat16") -> dict:
+    """把 HF 快照转换为合并、已转精度的快照，返回 manifest"""
+    import torch
+    from safetensors.torch import save_file
+
+    target_dtype = getattr(torch, dtype)
+    source = resolve_source(model_id)
+    output = Path(output)
+    staging = output.with_name(output.name + ".partial")
+    if staging.exists():
+        shutil.rmtree(staging)
+    staging.mkdir(parents=True)
+
+    index = json.loads((source / "model_index.json").read_text(encoding="utf-8"))
+    components = {}
+    for name, spec in index.items():
+        if name.startswith("_") or not isinstance(spec, list) or spec[0] is None:
+            continue
+        library, class_name = spec
+        src_dir, dst_dir = source / name, staging / name
+        dst_dir.mkdir(parents=True, exist_ok=True)
+        for file in src_dir.rglob("*"):
+            if file.is_file() and not _is_weight_file(file):
+                (dst_dir / file.relative_to(src_dir)).parent.mkdir(parents=True, exist_ok=True)
+                shutil.copy2(file, dst_dir / file.relative_to(src_dir))
+
+        entry = {"library": library, "class": class_name}
+        started = time.perf_counter()
+        state = _read_state_dict(src_dir)
+        if state:
+            state = {
+                key: (tensor.to(target_dtype) if tensor.is_floating_point() else tensor).contiguous()
+                for key, tensor in state.items()
+            }
+            weights = _WEIGHT_FILES.get(library, "model.safetensors")
+            save_file(state, str(dst_dir / weights), metadata={"format": "pt"})
+            entry.update({
+                "weights": f"{name}/{weights}",
+                "tensors": len(state),
+                "bytes": sum(t.numel() * t.element_size() for t in state.values()),
+            })
+            logger.info("%s: %d tensors, %.1f MB in %.1fs", name, len(state), entry["bytes"] / 2 ** 20,
+                        time.perf_counter() - started)
+        components[name] = entry
+        del state
+
+    shutil.copy2(source / "model_index.json", staging / "model_index.json")
+    manifest = {
+        "format_version": FORMAT_VERSION,
+        "source": model_id,
+        "source_hash": _source_hash(source),
+        "pipeline_class": index.get("_class_name"),
+        "dtype": dtype,
+        "components": components,
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+    }
+    (staging / MANIFEST).write_text(json.dumps(manifest, indent=2, ensure_ascii=False), encoding="utf-8")
+
+    # 写完再改名，中途失败不会留下看似完整的快照
+    if output.exists():
+        shutil.rmtree(output)
+    staging.rename(output)
+    return manifest
+
+
+def _load_module(root: Path, name: str, entry: dict, device: str):
+    import torch
+    from accelerate import init_empty_weights
+    from safetensors.torch import load_file
+
+    library = __import__(entry["library"])
+    cls = getattr(library, entry["class"])
+    component_dir = root / name
+    with init_empty_weights():
+        if entry["library"] == "transformers":
+            from transformers import AutoConfig
+            module = cls(AutoConfig.from_pretrained(component_dir))
+        else:
+            module = cls.from_config(cls.load_config(component_dir))
+
+    # safetensors 内存映射读取，直接放到目标设备；assign 让参数直接引用这些张量而不再拷贝
+    state = load_file(str(root / entry["weights"]), device=device)
+    missing, unexpected = module.load_state_dict(state, strict=False, assign=True)
+    if hasattr(module, "tie_weights"):
+        module.tie_weights()
+    if unexpected:
+        logger.warning("%s: %d unexpected keys (e.g. %s)", name, len(unexpected), unexpected[0])
+    still_meta = [n for n, p in module.named_parameters() if p.device.type == "meta"]
+    if still_meta:
+        raise RuntimeError(f"{name}: {len(still_meta)} parameters not in snapshot (e.g. {still_meta[0]})")
+    # 非持久化 buffer（如 RoPE 频率）仍在 CPU 上
+    module.to(torch.device(device))
+    module.eval()
+    return module
+
+
+def _load_component(root: Path, name: str, entry: dict, device: str):
+    if "weights" in entry:
+        return _load_module(root, name, entry, device)
+    library = __import__(entry["library"])
+    return getattr(library, entry["class"]).from_pretrained(root / name)
+
+
+def load(path, device: str = "cuda", max_workers: int = 4) -> Tuple[object, Dict[str, float]]:
+    """加载快照，返回 (pipeline, {组件: 秒数, "total": 秒数})"""
+    import diffusers
+
+    root = Path(path)
+    manifest = read_manifest(root)
+    if manifest.get("format_version") != FORMAT_VERSION:
+        raise ValueError(f"unsupported snapshot format: {manifest.get('format_version')}")
+
+    started = time.perf_counter()
+    timings: Dict[str, float] = {}
+
+    def timed(name: str, entry: dict):
+        t = time.perf_counter()
+        component = _load_component(root, name, entry, device)
+        timings[name] = round(time.perf_counter() - t, 3)
+        return component
+
+    # 大组件先提交，尽早开始读盘
+    order = sorted(manifest["components"].items(), key=lambda item: -item[1].get("bytes", 0))
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="load") as pool:
+        futures = {name: pool.submit(timed, name, entry) for name, entry in order}
+        components = {name: future.result() for name, future in futures.items()}
+
+    pipeline_cls = getattr(diffusers, manifest["pipeline_class"])
+    pipe = pipeline_cls(**components)
+    timings["total"] = round(time.perf_counter() - started, 3)
+    return pipe, timings
+
+
+def format_timings(timings: Dict[str, float]) -> str:
+    parts = [f"{name} {seconds:.2f}s" for name, seconds in timings.items() if name != "total"]
+    return f"{timings.get('total', 0):.2f}s ({', '.join(parts)})"
+
+
+def main(argv: Optional[list] = None):
+    parser = argparse.ArgumentParser(description="模型快照：构建 / 测试加载")
+    sub = parser.add_subparsers(dest="command", required=True)
+    build_parser = sub.add_parser("build", help="从 HF 快照构建")
+    build_parser.add_argument("--model", default="Tongyi-MAI/Z-Image-Turbo", help="HF 模型 ID 或本地目录")
+    build_parser.add_argument("--output", required=True)
+    build_parser.add_argument("--dtype", default="bfloat16", choices=["bfloat16", "float16", "float32"])
+    load_parser = sub.add_parser("load", help="加载快照并输出各组件耗时")
+    load_parser.add_argument("path")
+    load_parser.add_argument("--device", default="cuda")
+    load_parser.add_argument("--workers", type=int, default=4)
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(name)s] %(message)s")
+
+    if args.command == "build":
+        started = time.perf_counter()
+        manifest = build(args.model, args.output, args.dtype)
+        total = sum(c.get("bytes", 0) for c in manifest["components"].values())
+        print(f"snapshot written to {args.output}: {total / 2 ** 30:.2f} GB {args.dtype} "
+              f"in {time.perf_counter() - started:.1f}s")
+    else:
+        _, timings = load(args.path, args.device, args.workers)
+        print(f"loaded in {format_timings(timings)}")
+
+
+if __name__ == "__main__":
+    main()
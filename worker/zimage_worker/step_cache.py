@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+"""
+去噪步间缓存（First-Block Cache，思路同 TeaCache / FORA）
+
+Turbo 每张图约 8 次 DiT 前向，相邻步的中间特征差别很小。每步照常计算第一个 block，
+用它的残差（输出 - 输入）与上次完整计算时相比的相对 L1 变化作为廉价估计：
+
+- 自上次完整计算以来累计变化 < 阈值：跳过其余 block，直接复用上次 “其余 block 的残差”
+- 否则：完整计算，并更新缓存的残差
+
+阈值越大跳得越多、越快，画质偏差越大；0 为关闭。第一步总是完整计算。
+只处理 transformer 中最长的 block 列表（主干），且要求 block 返回单个张量（单流 DiT）；
+不满足时自动关闭并告警。与 torch.compile 同时使用时，跳过判断处会产生 graph break。
+
+    cache = StepCache.attach(pipe.transformer, 0.1)
+    cache.reset()          # 每张图开始前
+    pipe(...)
+    cache.stats()          # {"steps": 8, "skipped": 3}
+"""
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def _blocks(transformer):
+    """transformer 的直接子模块中最长的 ModuleList"""
+    import torch
+
+    candidates = [
+        (name, module) for name, module in transformer.named_children()
+        if isinstance(module, torch.nn.ModuleList) and len(module) >= 3
+    ]
+    if not candidates:
+        return None, None
+    return max(candidates, key=lambda item: len(item[1]))
+
+
+class StepCache:
+    def __init__(self, threshold: float):
+        self.threshold = threshold
+        self.enabled = threshold > 0
+        self.reset()
+
+    @classmethod
+    def attach(cls, transformer, threshold: float) -> "StepCache":
+        """包装 transformer 主干的第一个、中间和最后一个 block"""
+        cache = cls(threshold)
+        if not cache.enabled:
+            return cache
+        name, blocks = _blocks(transformer)
+        if blocks is None:
+            logger.warning("Step cache disabled: no transformer block list found")
+            cache.enabled = False
+            return cache
+        CachedBlock = _cached_block_class()
+        last = len(blocks) - 1
+        for i in range(len(blocks)):
+            kind = "first" if i == 0 else "last" if i == last else "middle"
+            blocks[i] = CachedBlock(blocks[i], cache, kind)
+        logger.info("Step cache on %s (%d blocks), threshold %.3f", name, len(blocks), threshold)
+        return cache
+
+    def reset(self):
+        """每张图开始前调用"""
+        self.skip = False
+        self.start = None  # 本步第一个 block 的输出
+        self.first_residual = None  # 上次完整计算时第一个 block 的残差
+        self.rest_residual = None  # 上次完整计算时其余 block 的残差
+        self.accumulated = 0.0
+        self.steps = 0
+        self.skipped = 0
+
+    def stats(self) -> dict:
+        return {"steps": self.steps, "skipped": self.skipped}
+
+    def decide(self, residual):
+        """第一个 block 算完后决定本步是否跳过其余 block"""
+        self.steps += 1
+        if self.first_residual is None or self.rest_residual is None:
+            self.skip = False
+        else:
+            change = (residual - self.first_residual).abs().mean() / self.first_residual.abs().mean().clamp(min=1e-8)
+            self.accumulated += float(change)
+            self.skip = self.accumulated < self.threshold
+        if self.skip:
+            self.skipped += 1
+        else:
+            self.accumulated = 0.0
+            self.first_residual = residual
+
+    def disable(self, reason: str):
+        if self.enabled:
+            logger.warning("Step cache disabled: %s", reason)
+        self.enabled = False
+        self.skip = False
+
+
+_block_class = None
+
+
+def _cached_block_class():
+    """CachedBlock 在首次使用时定义，导入本模块不需要 torch"""
+    global _block_class
+    if _block_class is not None:
+        return _block_class
+    import torch
+
+    class CachedBlock(torch.nn.Module):
+        def __init__(self, block, cache: StepCache, kind: str):
+            super().__init__()
+            self.block = block
+            self.cache = cache
+            self.kind = kind  # first / middle / last
+
+        def forward(self, *args, **kwargs):
+            cache = self.cache
+            if not cache.enabled:
+                return self.block(*args, **kwargs)
+            x = args[0] if args else kwargs["hidden_states"]
+            if cache.skip and self.kind == "middle":
+                return x
+            if cache.skip and self.kind == "last":
+                # 中间 block 已直通，x 即本步第一个 block 的输出
+                return x + cache.rest_residual
+            out = self.block(*args, **kwargs)
+            if not isinstance(out, torch.Tensor):
+                cache.disable("transformer blocks do not return a single tensor")
+                return out
+            if self.kind == "first":
+                cache.start = out
+                cache.decide(out - x)
+            elif self.kind == "last":
+                cache.rest_residual = out - cache.start
+            return out
+
+    _block_class = CachedBlock
+    return _block_class
@@ -0,0 +1,381 @@
+# -*- coding: utf-8 -*-
+"""
+监督模式：一台机器上的多个推理进程
+
+    监督进程: 领取线程 ──(共享任务队列)──> 推理子进程 × N（每个设备一个，或 PROCS_PER_DEVICE 个）
+              心跳线程（汇总各子进程的 gpu_info）        └─ 各自编码 / 上传
+
+- 所有进程共用一个 Worker 身份：监督进程负责领取和心跳，子进程负责推理和上传
+- 只在有空闲且已加载完模型的子进程时领取，另外最多预取 PREFETCH_JOBS 个，任务不会压在加载中的进程上
+- 文本编码缓存（zimage_worker.text_cache）放在 /dev/shm，子进程之间共享
+- 子进程异常退出时，它取走后尚未上传完成的任务（推理中、编码 / 上传中）都上报失败
+  （避免同一任务反复拖垮进程），随后按退避间隔重启
+- CPU 设备按核划分并绑定（CPU_CORES，默认平均划分），每个进程的 torch 线程数等于其核数
+- 停止时子进程完成当前任务和上传后退出，队列中未开始的任务退回服务端
+
+子进程以 spawn 方式启动（CUDA 不支持 fork 后再初始化）。
+"""
+import logging
+import multiprocessing
+import os
+import queue
+import signal
+import threading
+import time
+from typing import Dict, List, Optional
+
+from zimage_worker.api import ApiClient
+from zimage_worker.config import WorkerConfig
+from zimage_worker.runtime import Worker, claim_job, return_job
+
+logger = logging.getLogger(__name__)
+
+RESTART_BACKOFF = (1, 5, 15, 60)  # 连续崩溃时的重启间隔（秒）
+STABLE_SECONDS = 300  # 运行超过这么久再崩溃，退避从头开始
+
+
+def parse_cores(text: str) -> List[List[int]]:
+    """'0-3,8;4-7' -> [[0, 1, 2, 3, 8], [4, 5, 6, 7]]"""
+    sets = []
+    for group in text.split(";"):
+        cores = []
+        for item in group.split(","):
+            item = item.strip()
+            if "-" in item:
+                first, last = item.split("-")
+                cores.extend(range(int(first), int(last) + 1))
+            elif item:
+                cores.append(int(item))
+        if cores:
+            sets.append(cores)
+    return sets
+
+
+def _available_cores() -> List[int]:
+    try:
+        return sorted(os.sched_getaffinity(0))
+    except AttributeError:
+        return list(range(os.cpu_count() or 1))
+
+
+def plan_slots(config: WorkerConfig) -> List[dict]:
+    """[{"device": "cuda:0", "cores": None}, {"device": "cpu", "cores": [0, 1, 2, 3]}, ...]"""
+    devices = [d.strip() for d in config.devices.split(",") if d.strip()]
+    if devices in ([], ["auto"]):
+        devices = ["cpu"]
+        if config.pipeline != "dummy":
+            import torch
+            if torch.cuda.is_available():
+                devices = [f"cuda:{i}" for i in range(torch.cuda.device_count())]
+    slots = [
+        {"device": device, "cores": None}
+        for device in devices
+        for _ in range(max(1, config.procs_per_device))
+    ]
+
+    cpu_slots = [slot for slot in slots if slot["device"] == "cpu"]
+    if cpu_slots:
+        core_sets = parse_cores(config.cpu_cores)
+        if not core_sets:
+            cores = _available_cores()
+            per = max(1, len(cores) // len(cpu_slots))
+            core_sets = [cores[i * per:(i + 1) * per] or cores for i in range(len(cpu_slots))]
+        for i, slot in enumerate(cpu_slots):
+            slot["cores"] = core_sets[i % len(core_sets)]
+    return slots
+
+
+# ---------- 子进程 ----------
+
+class _ChildWorker(Worker):
+    """从共享队列取任务的推理进程，领取和心跳由监督进程负责"""
+
+    def __init__(self, config: WorkerConfig, index: int, jobs, events, queued):
+        super().__init__(config)
+        self.index = index
+        self._jobs = jobs
+        self._events = events
+        self._queued = queued
+
+    def _emit(self, kind: str, value=None):
+        self._events.put((kind, self.index, value))
+
+    def _finish(self, job: dict, image, metadata: dict):
+        try:
+            super()._finish(job, image, metadata)
+        finally:
+            self._emit("done", job["id"])
+
+    def _fail(self, job: dict, message: str):
+        # 推理失败不会进入 _finish，上报失败后同样视为结束（上传失败时重复的 done 无影响）
+        super()._fail(job, message)
+        self._emit("done", job["id"])
+
+    def serve(self, stop):
+        self.generator.load()
+        self._emit("info", self.generator.device_info())
+        parent = multiprocessing.parent_process()
+        while not stop.is_set() and (parent is None or parent.is_alive()):
+            try:
+                job = self._jobs.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            # 取走后立即计数并通知，之后崩溃时监督进程能找到这个任务
+            with self._queued.get_lock():
+                self._queued.value -= 1
+            self._emit("started", job["id"])
+            self._process(job)
+            self._emit("finished", job["id"])
+            self._emit("info", self.generator.device_info())
+        self._wait_uploads()
+        self.api.close()
+        logger.info("Slot %d stopped: %s", self.index, self.stats)
+
+
+def _child_main(config: WorkerConfig, index: int, slot: dict, jobs, events, queued, stop, log_level: str):
+    # 终端 Ctrl+C 会发给整个进程组，子进程只听监督进程的 stop
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    logging.basicConfig(
+        level=log_level,
+        format=f"%(asctime)s %(levelname)-7s [slot {index} %(name)s] %(message)s",
+    )
+    if slot["cores"]:
+        os.sched_setaffinity(0, slot["cores"])
+        if config.pipeline != "dummy":
+            import torch
+            torch.set_num_threads(len(slot["cores"]))
+    config.device = slot["device"]
+    _ChildWorker(config, index, jobs, events, queued).serve(stop)
+
+
+# ---------- 监督进程 ----------
+
+class _Slot:
+    def __init__(self, index: int, spec: dict):
+        self.index = index
+        self.spec = spec
+        self.process: Optional[multiprocessing.Process] = None
+        self.started_at = 0.0
+        self.crashes = 0
+        self.restart_at = 0.0
+        self.ready = False
+        self.job_id: Optional[str] = None  # 正在推理的任务
+        self.in_flight: List[str] = []  # 已取走、尚未上传完成的任务（含 job_id）
+        self.info: dict = {}
+
+
+class Supervisor:
+    def __init__(self, config: WorkerConfig, api: Optional[ApiClient] = None):
+        if not config.text_cache_dir:
+            config.text_cache_dir = f"/dev/shm/zimage-text-{config.worker_id}"
+        self.config = config
+        self.api = api or ApiClient(config)
+        self.slots = [_Slot(i, spec) for i, spec in enumerate(plan_slots(config))]
+        self.stats = {"claimed": 0, "returned": 0, "restarts": 0, "crashed_jobs": 0}
+
+        self._mp = multiprocessing.get_context("spawn")
+        self._jobs = self._mp.Queue()
+        self._events = self._mp.Queue()
+        self._stop_children = self._mp.Event()
+        self._stopping = threading.Event()
+        # 子进程都已退出（推理和上传结束）：心跳持续到这里
+        self._drained = threading.Event()
+        # 已放入共享队列、尚未被子进程取走的任务数：子进程取走时直接减，不依赖事件送达
+        self._queued = self._mp.Value("i", 0)
+        self._threads = []
+
+    # ---------- 生命周期 ----------
+
+    def stop(self):
+        if not self._stopping.is_set():
+            logger.info("Stopping: children finish in-flight jobs, no new claims")
+            self._stopping.set()
+
+    @property
+    def stopping(self) -> bool:
+        return self._stopping.is_set()
+
+    def run(self):
+        for slot in self.slots:
+            self._spawn(slot)
+        logger.info("Supervising %d slot(s): %s", len(self.slots),
+                    ", ".join(f"{s.spec['device']}{self._cores_label(s)}" for s in self.slots))
+        for target, name in ((self._claim_loop, "claim"), (self._heartbeat_loop, "heartbeat")):
+            thread = threading.Thread(target=target, name=name, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+        while not self._stopping.is_set():
+            self._handle_events(timeout=0.5)
+            self._check_children()
+
+        self._drain()
+
+    @staticmethod
+    def _cores_label(slot: _Slot) -> str:
+        cores = slot.spec["cores"]
+        return f"[{cores[0]}-{cores[-1]}]" if cores else ""
+
+    def _spawn(self, slot: _Slot):
+        slot.process = self._mp.Process(
+            target=_child_main,
+            args=(self.config, slot.index, slot.spec, self._jobs, self._events, self._queued, self._stop_children,
+                  logging.getLevelName(logging.getLogger().level)),
+            name=f"zimage-slot-{slot.index}",
+        )
+        slot.process.start()
+        slot.started_at = time.monotonic()
+        slot.ready = False
+        slot.job_id = None
+        slot.in_flight = []
+
+    def _drain(self):
+        self._threads[0].join()  # 领取线程
+        self._stop_children.set()
+        deadline = time.monotonic() + self.config.drain_timeout
+        for slot in self.slots:
+            while slot.process.is_alive() and time.monotonic() < deadline:
+                self._handle_events(timeout=0.5)
+            if slot.process.is_alive():
+                logger.warning("Slot %d still running after %gs, terminating", slot.index, self.config.drain_timeout)
+                slot.process.terminate()
+            slot.process.join()
+        self._handle_events(timeout=0)
+        for slot in self.slots:
+            if slot.in_flight:
+                self._fail_crashed(slot)
+
+        # 子进程都已退出，队列中剩下的是已领取未开始的任务
+        while True:
+            try:
+                job = self._jobs.get(timeout=0.1)
+            except queue.Empty:
+                break
+            if return_job(self.api, job):
+                self.stats["returned"] += 1
+        self._drained.set()
+        self._threads[1].join()  # 心跳线程，避免在 offline 之后再发一次
+        self.api.heartbeat("offline", gpu_info=self.device_info())
+        self.api.close()
+        logger.info("Stopped: %s", self.stats)
+
+    # ---------- 子进程状态 ----------
+
+    def _handle_events(self, timeout: float):
+        try:
+            while True:
+                kind, index, value = self._events.get(timeout=timeout)
+                timeout = 0
+                slot = self.slots[index]
+                if kind == "info":
+                    slot.info = value
+                    slot.ready = True
+                elif kind == "started":
+                    slot.job_id = value
+                    slot.in_flight.append(value)
+                elif kind == "finished":
+                    slot.job_id = None
+                elif kind == "done" and value in slot.in_flight:
+                    slot.in_flight.remove(value)
+        except queue.Empty:
+            pass
+
+    def _check_children(self):
+        now = time.monotonic()
+        for slot in self.slots:
+            if slot.process.is_alive():
+                continue
+            if slot.restart_at == 0.0:
+                self._handle_events(timeout=0)
+                logger.error("Slot %d (%s) exited with code %s", slot.index, slot.spec["device"], slot.process.exitcode)
+                if slot.in_flight:
+                    self._fail_crashed(slot)
+                if now - slot.started_at > STABLE_SECONDS:
+                    slot.crashes = 0
+                delay = RESTART_BACKOFF[min(slot.crashes, len(RESTART_BACKOFF) - 1)]
+                slot.crashes += 1
+                slot.ready = False
+                slot.restart_at = now + delay
+                logger.info("Restarting slot %d in %ds", slot.index, delay)
+            elif now >= slot.restart_at:
+                slot.restart_at = 0.0
+                self.stats["restarts"] += 1
+                self._spawn(slot)
+
+    def _fail_crashed(self, slot: _Slot):
+        """上报子进程取走后未完成的全部任务（推理中和编码 / 上传中的）"""
+        for job_id in slot.in_flight:
+            self.stats["crashed_jobs"] += 1
+            try:
+                self.api.update_status(
+                    job_id, "failed",
+                    error_message=f"推理进程异常退出 (exit code {slot.process.exitcode})",
+                )
+            except Exception as e:
+                logger.warning("Failed to report crashed job %s: %s", job_id, e)
+        slot.job_id = None
+        slot.in_flight = []
+
+    # ---------- 领取 ----------
+
+    def _claim_loop(self):
+        while not self._stopping.is_set():
+            ready = [s for s in self.slots if s.ready]
+            idle = sum(1 for s in ready if s.job_id is None)
+            target = idle + self.config.prefetch_jobs if ready else 0
+            wanted = self._queued.value < target
+            if not wanted:
+                self._stopping.wait(0.2)
+                continue
+            job = claim_job(self.api)
+            if job is None:
+                self._stopping.wait(self.config.poll_interval)
+                continue
+            with self._queued.get_lock():
+                self._queued.value += 1
+            self.stats["claimed"] += 1
+            self._jobs.put(job)
+
+    # ---------- 心跳 ----------
+
+    def device_info(self) -> dict:
+        """汇总各子进程的 gpu_info：分桶计数相加、显存峰值取最大，另附每个子进程的状态和全部运行中的任务"""
+        buckets: Dict[str, int] = {}
+        peaks: Dict[str, int] = {}
+        slots = []
+        for slot in self.slots:
+            info = slot.info
+            for size, count in (info.get("buckets") or {}).items():
+                buckets[size] = buckets.get(size, 0) + count
+            for size, peak in (info.get("memory_peak_mb") or {}).items():
+                peaks[size] = max(peaks.get(size, 0), peak)
+            slots.append({
+                **{k: v for k, v in info.items() if k not in ("buckets", "memory_peak_mb")},
+                "device": slot.spec["device"],
+                "cores": self._cores_label(slot).strip("[]") or None,
+                "ready": slot.ready,
+                "busy": slot.job_id is not None,
+                "restarts": slot.crashes,
+            })
+        return {
+            "device": ",".join(sorted({s.spec["device"] for s in self.slots})),
+            "cpu_count": os.cpu_count(),
+            "capacity": sum(1 for s in self.slots if s.ready),
+            # current_job_id 只能放一个，其余运行中的任务在这里
+            "running_jobs": [job_id for s in self.slots for job_id in s.in_flight],
+            "slots": slots,
+            "buckets": buckets,
+            "memory_peak_mb": peaks,
+        }
+
+    def _heartbeat_loop(self):
+        # stop() 之后继续发送，直到子进程排空（最长 drain_timeout），否则服务端会判定失联、回收任务
+        while not self._drained.is_set():
+            info = self.device_info()
+            running = info["running_jobs"]
+            self.api.heartbeat(
+                "busy" if running or self._stopping.is_set() else "idle",
+                current_job_id=running[0] if running else None,
+                gpu_info=info,
+            )
+            self._drained.wait(self.config.heartbeat_interval)
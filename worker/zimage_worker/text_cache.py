@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+"""
+文本编码缓存（进程间共享）
+
+同一提示词（重新生成、换尺寸、换种子）不必再过一遍文本编码器。编码结果按
+“模型指纹 + 提示词” 的哈希存成 safetensors 文件，放在 tmpfs（如 /dev/shm）上即可在
+同一台机器的多个推理进程（见 zimage_worker.supervisor）之间共享：
+
+    <TEXT_CACHE_DIR>/<哈希>.safetensors
+
+写入先落临时文件再 rename，多进程同时写同一条也不会读到半个文件；
+超过 TEXT_CACHE_SIZE 条时删除最久未访问的。管线不支持 encode_prompt / prompt_embeds 时自动关闭。
+"""
+import hashlib
+import logging
+import os
+import threading
+from pathlib import Path
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+
+class TextCache:
+    def __init__(self, root, fingerprint: str, size: int = 256):
+        self.dir = Path(root)
+        self.dir.mkdir(parents=True, exist_ok=True)
+        self.fingerprint = fingerprint
+        self.size = size
+        self.enabled = True
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def _path(self, prompt: str) -> Path:
+        key = hashlib.sha256(f"{self.fingerprint}\n{prompt}".encode("utf-8")).hexdigest()[:32]
+        return self.dir / f"{key}.safetensors"
+
+    def embeds(self, pipe, prompt: str, device) -> Optional[object]:
+        """返回可传给 pipe(prompt_embeds=...) 的编码结果；不可用时返回 None（调用方改传 prompt）"""
+        if not self.enabled:
+            return None
+        from safetensors.torch import load_file, save_file
+
+        path = self._path(prompt)
+        try:
+            tensors = load_file(str(path), device=str(device))
+            os.utime(path)
+            with self._lock:
+                self.hits += 1
+            return _unpack(tensors)
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logger.warning("Dropping unreadable text cache entry %s: %s", path.name, e)
+            path.unlink(missing_ok=True)
+
+        try:
+            embeds = _encode(pipe, prompt, device)
+            partial = path.with_name(f"{path.stem}.{os.getpid()}.partial")
+            save_file(_pack(embeds), str(partial))
+            partial.replace(path)
+        except Exception as e:
+            logger.warning("Text cache disabled: %s", e)
+            self.enabled = False
+            return None
+        with self._lock:
+            self.misses += 1
+        self._evict()
+        return embeds
+
+    def _evict(self):
+        files = list(self.dir.glob("*.safetensors"))
+        if len(files) <= self.size:
+            return
+        files.sort(key=lambda p: p.stat().st_mtime if p.exists() else 0)
+        for path in files[:len(files) - self.size]:
+            path.unlink(missing_ok=True)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses}
+
+
+def _encode(pipe, prompt: str, device):
+    import torch
+
+    with torch.inference_mode():
+        result = pipe.encode_prompt(prompt=prompt, device=device, do_classifier_free_guidance=False)
+    # (prompt_embeds, negative_prompt_embeds)；不同版本 prompt_embeds 为张量或张量列表
+    return result[0] if isinstance(result, tuple) else result
+
+
+def _pack(embeds) -> dict:
+    if isinstance(embeds, (list, tuple)):
+        return {f"list.{i}": t.detach().to("cpu").contiguous() for i, t in enumerate(embeds)}
+    return {"tensor": embeds.detach().to("cpu").contiguous()}
+
+
+def _unpack(tensors: dict):
+    if "tensor" in tensors:
+        return tensors["tensor"]
+    return [tensors[f"list.{i}"] for i in range(len(tensors))]